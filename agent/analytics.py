@@ -0,0 +1,438 @@
+"""Convergence analytics over stored simulation results.
+
+Result rows are folded into per-session aggregates kept in a DuckDB file, so
+a question such as "how many iterations did each persona need to reach the
+target" reads one small table instead of every iteration row. Ingestion is
+incremental: result files are tracked by path and the embedded SQLite store
+by its last ingested row id, so a refresh only reads what is new. Every
+session aggregate can be merged with a later batch of the same session's
+rows, which keeps partially written sessions correct.
+"""
+import os
+import json
+import sqlite3
+import argparse
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+# Default location of the analytics database
+DEFAULT_ANALYTICS_PATH = "analytics.duckdb"
+# Normalized (0-1) rating a session has to reach to count as converged
+TARGET_NORMALIZED_RATING = 0.8
+# Rows read from the embedded SQLite store per ingest batch
+STORE_BATCH_ROWS = 200000
+
+# Markers the agents write into rows whose LLM response could not be parsed
+PARSE_ERROR_REACTION = "Error processing response"
+PARSE_ERROR_REASON = "Error in response format"
+PARSE_ERROR_CHANGES = "Error extracting changes summary"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analytics_meta (
+    key VARCHAR PRIMARY KEY,
+    value VARCHAR NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingested_sources (
+    source VARCHAR PRIMARY KEY,
+    size BIGINT,
+    mtime_ns BIGINT,
+    last_row_id BIGINT,
+    rows BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_stats (
+    session_id VARCHAR PRIMARY KEY,
+    persona_id VARCHAR,
+    persona_name VARCHAR,
+    rows BIGINT NOT NULL,
+    parse_error_rows BIGINT NOT NULL,
+    first_iteration INTEGER,
+    first_rating DOUBLE,
+    last_iteration INTEGER,
+    last_rating DOUBLE,
+    iterations_to_target INTEGER,
+    recommendation_iteration INTEGER,
+    recommendation_rating DOUBLE
+);
+CREATE TABLE IF NOT EXISTS persona_stats (
+    persona_id VARCHAR PRIMARY KEY,
+    persona_name VARCHAR,
+    sessions BIGINT NOT NULL,
+    sessions_reached BIGINT NOT NULL,
+    avg_iterations_to_target DOUBLE,
+    avg_rating_delta DOUBLE,
+    avg_recommendation_gap DOUBLE,
+    parse_error_rows BIGINT NOT NULL,
+    rows BIGINT NOT NULL
+);
+CREATE OR REPLACE VIEW session_metrics AS
+SELECT
+    session_id, persona_id, persona_name, rows, iterations_to_target,
+    iterations_to_target IS NOT NULL AS reached_target,
+    first_rating, last_rating,
+    last_rating - first_rating AS rating_delta,
+    recommendation_rating,
+    recommendation_rating - last_rating AS recommendation_gap,
+    parse_error_rows / rows AS parse_error_fraction
+FROM session_stats;
+CREATE OR REPLACE VIEW persona_metrics AS
+SELECT
+    persona_id, persona_name, sessions, sessions_reached,
+    sessions_reached / sessions AS success_rate,
+    avg_iterations_to_target, avg_rating_delta, avg_recommendation_gap,
+    parse_error_rows / rows AS parse_error_fraction
+FROM persona_stats;
+"""
+
+# Both stored layouts mapped onto one row shape. persona_responses rows
+# (Supabase, the local store, synthetic data) number iterations from 1;
+# result-sink rows number them from 0 and mark the closing row "Final state".
+# Simulated persona_responses rows flag parse failures in parse_error, since
+# their text columns hold no reaction, reasoning or changes to mark; rows
+# without the column are judged by their markers alone
+_RESPONSES_ROWS = f"""
+SELECT
+    CAST(session_id AS VARCHAR) AS session_id,
+    CAST(persona_id AS VARCHAR) AS persona_id,
+    CAST(persona_name AS VARCHAR) AS persona_name,
+    TRY_CAST(iteration AS INTEGER) AS iteration,
+    TRY_CAST(current_rating AS DOUBLE) AS current_rating,
+    TRY_CAST(normalized_current_rating AS DOUBLE) AS normalized_rating,
+    TRY_CAST(recommened_rating AS DOUBLE) AS recommendation_rating,
+    ({{parse_error}}
+     OR COALESCE(CAST(reason AS VARCHAR), '') = '{PARSE_ERROR_REASON}'
+     OR COALESCE(CAST(editor_changes AS VARCHAR), '') = '{PARSE_ERROR_CHANGES}') AS parse_error
+FROM {{source}}
+"""
+
+_RESULT_ROWS = f"""
+SELECT
+    CAST(session_id AS VARCHAR) AS session_id,
+    CAST(persona_id AS VARCHAR) AS persona_id,
+    CAST(persona_name AS VARCHAR) AS persona_name,
+    CASE WHEN reaction = 'Final state' THEN TRY_CAST(iteration AS INTEGER)
+         ELSE TRY_CAST(iteration AS INTEGER) + 1 END AS iteration,
+    TRY_CAST(current_rating AS DOUBLE) AS current_rating,
+    TRY_CAST(normalized_current_rating AS DOUBLE) AS normalized_rating,
+    TRY_CAST(recommendation_rating AS DOUBLE) AS recommendation_rating,
+    (COALESCE(CAST(reaction AS VARCHAR), '') = '{PARSE_ERROR_REACTION}'
+     OR COALESCE(CAST(recommendation_reasoning AS VARCHAR), '') = '{PARSE_ERROR_REASON}') AS parse_error
+FROM {{source}}
+"""
+
+# The columns read from the embedded store, in _RESPONSES_ROWS terms
+_STORE_COLUMNS = [
+    'id', 'session_id', 'persona_id', 'persona_name', 'iteration', 'current_rating',
+    'normalized_current_rating', 'recommened_rating', 'reason', 'editor_changes', 'parse_error'
+]
+
+
+def _import_duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("duckdb is required for convergence analytics: pip install duckdb") from e
+    return duckdb
+
+
+def _result_files(path: str) -> List[str]:
+    """Expand a file or a directory of result shards into the files to ingest."""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith((".csv", ".parquet")) and not name.startswith("_"):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+class ConvergenceAnalytics:
+    """Incrementally materialized convergence metrics per session and per persona.
+
+    Sources are result CSV/Parquet files in either the persona_responses or
+    the result-sink layout, directories of such files (e.g. synthetic data
+    shards), and embedded SQLite stores written with --local-db.
+    """
+
+    def __init__(self, path: str = DEFAULT_ANALYTICS_PATH, target: float = TARGET_NORMALIZED_RATING) -> None:
+        """Open (and create if needed) the analytics database.
+
+        Args:
+            path: DuckDB database file, or ":memory:" for a throwaway one
+            target: Normalized rating that counts as reaching the target
+
+        Raises:
+            ValueError: If the database was materialized for a different target
+        """
+        duckdb = _import_duckdb()
+        self.path = path
+        self.target = target
+        self._conn = duckdb.connect(path)
+        self._conn.execute(SCHEMA)
+        row = self._conn.execute("SELECT value FROM analytics_meta WHERE key = 'target'").fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO analytics_meta VALUES ('target', ?)", [repr(target)])
+        elif float(row[0]) != target:
+            raise ValueError(f"{path} was materialized for target {row[0]}, not {target}; use a new database")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _merge(self, rows_sql: str, params: Sequence = (), record: Optional[Callable[[int], None]] = None) -> int:
+        """Fold a batch of unified rows into session_stats and refresh the personas it touched.
+
+        Args:
+            rows_sql: Query producing the batch in the unified row layout
+            params: Parameters of the query
+            record: Called with the batch's row count inside the merge's transaction,
+                so a source is marked ingested exactly when its rows are merged
+
+        Returns:
+            The number of rows in the batch
+        """
+        conn = self._conn
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            conn.execute(f"""
+                CREATE OR REPLACE TEMP TABLE batch_sessions AS
+                SELECT
+                    session_id,
+                    any_value(persona_id) AS persona_id,
+                    any_value(persona_name) AS persona_name,
+                    count(*) AS rows,
+                    count(*) FILTER (WHERE parse_error) AS parse_error_rows,
+                    min(iteration) AS first_iteration,
+                    arg_min(current_rating, iteration) AS first_rating,
+                    max(iteration) AS last_iteration,
+                    arg_max(current_rating, iteration) AS last_rating,
+                    min(iteration) FILTER (WHERE normalized_rating >= {self.target!r}) AS iterations_to_target,
+                    max(iteration) FILTER (WHERE recommendation_rating IS NOT NULL) AS recommendation_iteration,
+                    arg_max(recommendation_rating, iteration)
+                        FILTER (WHERE recommendation_rating IS NOT NULL) AS recommendation_rating
+                FROM ({rows_sql}) AS batch
+                WHERE session_id IS NOT NULL
+                GROUP BY session_id
+            """, params)
+            conn.execute("""
+                INSERT INTO session_stats SELECT * FROM batch_sessions
+                ON CONFLICT (session_id) DO UPDATE SET
+                    rows = session_stats.rows + excluded.rows,
+                    parse_error_rows = session_stats.parse_error_rows + excluded.parse_error_rows,
+                    first_rating = CASE WHEN excluded.first_iteration < session_stats.first_iteration
+                                        THEN excluded.first_rating ELSE session_stats.first_rating END,
+                    first_iteration = least(session_stats.first_iteration, excluded.first_iteration),
+                    last_rating = CASE WHEN excluded.last_iteration >= session_stats.last_iteration
+                                       THEN excluded.last_rating ELSE session_stats.last_rating END,
+                    last_iteration = greatest(session_stats.last_iteration, excluded.last_iteration),
+                    iterations_to_target = least(session_stats.iterations_to_target, excluded.iterations_to_target),
+                    recommendation_rating = CASE
+                        WHEN excluded.recommendation_iteration >= COALESCE(session_stats.recommendation_iteration, 0)
+                        THEN excluded.recommendation_rating ELSE session_stats.recommendation_rating END,
+                    recommendation_iteration = greatest(session_stats.recommendation_iteration,
+                                                        excluded.recommendation_iteration)
+            """)
+            # Persona aggregates are rebuilt only for the personas this batch touched
+            conn.execute("""
+                CREATE OR REPLACE TEMP TABLE batch_personas AS
+                SELECT DISTINCT persona_id FROM batch_sessions
+            """)
+            conn.execute("DELETE FROM persona_stats WHERE persona_id IN (SELECT persona_id FROM batch_personas)")
+            conn.execute("""
+                INSERT INTO persona_stats
+                SELECT
+                    persona_id,
+                    any_value(persona_name),
+                    count(*),
+                    count(iterations_to_target),
+                    avg(iterations_to_target),
+                    avg(last_rating - first_rating),
+                    avg(recommendation_rating - last_rating),
+                    sum(parse_error_rows),
+                    sum(rows)
+                FROM session_stats
+                WHERE persona_id IN (SELECT persona_id FROM batch_personas)
+                GROUP BY persona_id
+            """)
+            rows = conn.execute("SELECT COALESCE(sum(rows), 0) FROM batch_sessions").fetchone()[0]
+            if record is not None:
+                record(rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _source_sql(self, relation: str, columns: Iterable[str]) -> str:
+        columns = set(columns)
+        if "recommened_rating" in columns:
+            flag = "COALESCE(TRY_CAST(parse_error AS BOOLEAN), false)" if "parse_error" in columns else "false"
+            return _RESPONSES_ROWS.format(source=relation, parse_error=flag)
+        if "recommendation_rating" in columns:
+            return _RESULT_ROWS.format(source=relation)
+        raise ValueError(f"Unrecognized result layout with columns {sorted(columns)}")
+
+    def ingest_file(self, path: str) -> int:
+        """Ingest one CSV or Parquet result file unless it was ingested before.
+
+        Files are treated as immutable; one that changed since it was ingested
+        is skipped with a warning because its rows are already counted.
+
+        Returns:
+            The number of rows ingested
+        """
+        stat = os.stat(path)
+        source = os.path.abspath(path)
+        seen = self._conn.execute(
+            "SELECT size, mtime_ns FROM ingested_sources WHERE source = ?", [source]
+        ).fetchone()
+        if seen is not None:
+            if seen != (stat.st_size, stat.st_mtime_ns):
+                print(f"Warning: {path} changed after it was ingested; rebuild the analytics database to include it")
+            return 0
+
+        if path.endswith(".parquet"):
+            relation = "read_parquet(?)"
+        else:
+            relation = "read_csv(?, header = true, all_varchar = true)"
+        columns = [row[0] for row in self._conn.execute(f"DESCRIBE SELECT * FROM {relation}", [path]).fetchall()]
+
+        def mark_ingested(rows: int) -> None:
+            self._conn.execute(
+                "INSERT INTO ingested_sources VALUES (?, ?, ?, NULL, ?)",
+                [source, stat.st_size, stat.st_mtime_ns, rows]
+            )
+        return self._merge(self._source_sql(relation, columns), [path], mark_ingested)
+
+    def ingest_store(self, path: str, batch_rows: int = STORE_BATCH_ROWS) -> int:
+        """Ingest the rows added to an embedded SQLite store since the last refresh.
+
+        Returns:
+            The number of rows ingested
+        """
+        import pyarrow as pa
+
+        source = f"sqlite:{os.path.abspath(path)}"
+        seen = self._conn.execute(
+            "SELECT last_row_id FROM ingested_sources WHERE source = ?", [source]
+        ).fetchone()
+        last_id = seen[0] if seen else 0
+        total = 0
+        store = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+        try:
+            # Stores written by older versions lack the parse_error flag
+            available = {row[1] for row in store.execute("PRAGMA table_info(persona_responses)")}
+            selected = [column if column in available else f"0 AS {column}" for column in _STORE_COLUMNS]
+            while True:
+                chunk = store.execute(
+                    f"SELECT {', '.join(selected)} FROM persona_responses WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_rows)
+                ).fetchall()
+                if not chunk:
+                    break
+                table = pa.table({name: list(values) for name, values in zip(_STORE_COLUMNS, zip(*chunk))})
+                last_id = chunk[-1][0]
+
+                def mark_ingested(rows: int) -> None:
+                    self._conn.execute(
+                        "INSERT INTO ingested_sources VALUES (?, NULL, NULL, ?, ?) ON CONFLICT (source) DO UPDATE SET "
+                        "last_row_id = excluded.last_row_id, rows = ingested_sources.rows + excluded.rows",
+                        [source, last_id, rows]
+                    )
+                self._conn.register("store_batch", table)
+                try:
+                    total += self._merge(self._source_sql("store_batch", _STORE_COLUMNS), (), mark_ingested)
+                finally:
+                    self._conn.unregister("store_batch")
+        finally:
+            store.close()
+        return total
+
+    def refresh(self, sources: Iterable[str]) -> Dict[str, int]:
+        """Ingest whatever is new in each source.
+
+        Args:
+            sources: Result files, directories of result files, or ".db"/".sqlite" embedded stores
+
+        Returns:
+            Rows ingested per source
+        """
+        ingested = {}
+        for source in sources:
+            if source.endswith((".db", ".sqlite", ".sqlite3")):
+                ingested[source] = self.ingest_store(source)
+                continue
+            for path in _result_files(source):
+                ingested[path] = self.ingest_file(path)
+        return ingested
+
+    def query(self, sql: str, params: Sequence = ()) -> List[Dict]:
+        """Run a query against the materialized tables and views and return dictionaries."""
+        cursor = self._conn.execute(sql, params)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def persona_metrics(self) -> List[Dict]:
+        """Success rate, iterations-to-target, rating delta, recommendation gap and parse errors per persona."""
+        return self.query("SELECT * FROM persona_metrics ORDER BY persona_id")
+
+    def session_metrics(self, persona_id=None) -> List[Dict]:
+        """The same metrics per session, optionally for one persona."""
+        if persona_id is None:
+            return self.query("SELECT * FROM session_metrics ORDER BY persona_id, session_id")
+        return self.query("SELECT * FROM session_metrics WHERE persona_id = ? ORDER BY session_id", [str(persona_id)])
+
+
+def print_persona_report(metrics: List[Dict]) -> None:
+    """Print persona metrics as a table."""
+    print(f"{'persona':>8} {'name':<16} {'sessions':>9} {'success':>8} {'iters':>6} "
+          f"{'delta':>7} {'rec gap':>8} {'parse err':>9}")
+    for m in metrics:
+        iterations = "-" if m['avg_iterations_to_target'] is None else f"{m['avg_iterations_to_target']:.2f}"
+        gap = "-" if m['avg_recommendation_gap'] is None else f"{m['avg_recommendation_gap']:+.2f}"
+        print(f"{m['persona_id']:>8} {str(m['persona_name'])[:16]:<16} {m['sessions']:>9} "
+              f"{m['success_rate']:>8.1%} {iterations:>6} {m['avg_rating_delta']:>+7.2f} {gap:>8} "
+              f"{m['parse_error_fraction']:>9.2%}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Convergence metrics over stored simulation results")
+    parser.add_argument("--db", default=DEFAULT_ANALYTICS_PATH, help="Analytics DuckDB file")
+    parser.add_argument("--target", type=float, default=TARGET_NORMALIZED_RATING,
+                        help="Normalized rating that counts as reaching the target")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    refresh_parser = subparsers.add_parser("refresh", help="Ingest new rows from result files, shard "
+                                                           "directories or --local-db stores")
+    refresh_parser.add_argument("sources", nargs="+")
+
+    subparsers.add_parser("personas", help="Print per-persona convergence metrics")
+
+    sessions_parser = subparsers.add_parser("sessions", help="Print per-session metrics as JSON lines")
+    sessions_parser.add_argument("--persona", default=None)
+
+    query_parser = subparsers.add_parser("query", help="Run SQL over session_stats, persona_stats and their "
+                                                       "session_metrics/persona_metrics views")
+    query_parser.add_argument("sql")
+
+    args = parser.parse_args(argv)
+    with ConvergenceAnalytics(args.db, args.target) as analytics:
+        if args.command == "refresh":
+            for source, rows in analytics.refresh(args.sources).items():
+                print(f"{source}: {rows} new rows")
+            print_persona_report(analytics.persona_metrics())
+        elif args.command == "personas":
+            print_persona_report(analytics.persona_metrics())
+        elif args.command == "sessions":
+            for row in analytics.session_metrics(args.persona):
+                print(json.dumps(row, default=str))
+        elif args.command == "query":
+            for row in analytics.query(args.sql):
+                print(json.dumps(row, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Default location of the article store
+DEFAULT_ARTICLE_STORE_PATH = "articles.db"
+
+# Longest chain of deltas before a version is stored whole again, bounding reconstruction work
+MAX_DELTA_CHAIN = 16
+# Reconstructed articles kept in memory
+DEFAULT_CACHE_ENTRIES = 256
+# zlib only looks back this far, so only the end of a longer parent helps as a dictionary
+_ZDICT_WINDOW = 32 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    hash TEXT PRIMARY KEY,
+    parent TEXT,
+    depth INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def article_hash(text: str) -> str:
+    """The content address of an article: a SHA-256 over its UTF-8 text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _compress(data: bytes, zdict: Optional[bytes] = None) -> bytes:
+    compressor = zlib.compressobj(9, zdict=zdict[-_ZDICT_WINDOW:]) if zdict else zlib.compressobj(9)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data: bytes, zdict: Optional[bytes] = None) -> bytes:
+    decompressor = zlib.decompressobj(zdict=zdict[-_ZDICT_WINDOW:]) if zdict else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+class ArticleStore:
+    """A content-addressed, compressed store of article versions.
+
+    Every distinct text is stored once under its SHA-256, so the seed article
+    every persona starts from, or a rewrite both agents remember, costs one
+    row however often it is put. A version with a parent is stored as a zlib
+    stream that uses the parent's text as its preset dictionary, which makes
+    an editor rewrite cost roughly what it changed; the first version of a
+    session, and every MAX_DELTA_CHAIN-th one after it, is compressed on its
+    own. Full text is rebuilt on demand along the parent chain, with recently
+    used versions kept in an LRU cache.
+
+    The store may be shared by every session of a run, from several threads,
+    and a file-backed store by several processes.
+    """
+
+    def __init__(self, path: str = DEFAULT_ARTICLE_STORE_PATH, max_chain: int = MAX_DELTA_CHAIN,
+                 cache_entries: int = DEFAULT_CACHE_ENTRIES) -> None:
+        """Open (and create if needed) the store.
+
+        Args:
+            path: Path of the SQLite file, or ":memory:" for a store that lives as long as the process
+            max_chain: Longest chain of deltas before a version is stored whole
+            cache_entries: Number of reconstructed articles kept in memory
+        """
+        self.path = path
+        self.max_chain = max_chain
+        self.cache_entries = cache_entries
+        self.puts = 0
+        self.dedup_hits = 0
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        # Depth of every version this process has seen, which doubles as the dedup check
+        self._depths: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def persistent(self) -> bool:
+        """Whether hashes stay resolvable after the process exits."""
+        return self.path != ":memory:"
+
+    def _remember(self, ref: str, text: str) -> None:
+        """Put a text in the LRU cache. Caller holds the lock."""
+        self._cache[ref] = text
+        self._cache.move_to_end(ref)
+        if len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    def _depth(self, ref: str) -> Optional[int]:
+        """Delta chain length of a stored version, or None if it is not stored. Caller holds the lock."""
+        depth = self._depths.get(ref)
+        if depth is None:
+            row = self._conn.execute("SELECT depth FROM articles WHERE hash = ?", (ref,)).fetchone()
+            if row is not None:
+                depth = self._depths[ref] = row[0]
+        return depth
+
+    def put(self, text: str, parent: Optional[str] = None) -> str:
+        """Store an article version, delta-compressed against its parent when there is one.
+
+        Args:
+            text: Full article text
+            parent: Hash of the version this one was derived from, such as the
+                article an editor rewrote
+
+        Returns:
+            The hash the article is stored under
+        """
+        ref = article_hash(text)
+        with self._lock:
+            self.puts += 1
+            if self._depth(ref) is not None:
+                self.dedup_hits += 1
+                self._remember(ref, text)
+                return ref
+
+            raw = text.encode("utf-8")
+            data, depth = _compress(raw), 0
+            parent_depth = self._depth(parent) if parent and parent != ref else None
+            if parent_depth is not None and parent_depth < self.max_chain:
+                delta = _compress(raw, self.get(parent).encode("utf-8"))
+                if len(delta) < len(data):
+                    data, depth = delta, parent_depth + 1
+            # Another process may have stored the same text meanwhile; either copy decodes identically
+            self._conn.execute(
+                "INSERT OR IGNORE INTO articles (hash, parent, depth, size, stored_size, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ref, parent if depth else None, depth, len(raw), len(data), data, time.time())
+            )
+            self._depths[ref] = depth
+            self._remember(ref, text)
+        return ref
+
+    def get(self, ref: str) -> str:
+        """Return the full text of a stored article.
+
+        Raises:
+            KeyError: If no article is stored under the hash
+        """
+        with self._lock:
+            text = self._cache.get(ref)
+            if text is not None:
+                self._cache.move_to_end(ref)
+                return text
+            row = self._conn.execute("SELECT parent, data FROM articles WHERE hash = ?", (ref,)).fetchone()
+            if row is None:
+                raise KeyError(f"No article stored under {ref}")
+            parent, data = row
+            zdict = self.get(parent).encode("utf-8") if parent else None
+            text = _decompress(data, zdict).decode("utf-8")
+            self._remember(ref, text)
+        return text
+
+    def __contains__(self, ref: str) -> bool:
+        with self._lock:
+            return self._depth(ref) is not None
+
+    def stats(self) -> Dict:
+        """Return dedup counters and the raw and stored size of every version."""
+        with self._lock:
+            versions, deltas, size, stored_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(depth > 0), 0), COALESCE(SUM(size), 0), "
+                "COALESCE(SUM(stored_size), 0) FROM articles"
+            ).fetchone()
+        return {
+            "puts": self.puts,
+            "dedup_hits": self.dedup_hits,
+            "versions": versions,
+            "deltas": deltas,
+            "bytes": size,
+            "stored_bytes": stored_size,
+            "compression_ratio": size / stored_size if stored_size else 0.0
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Content-addressed store of simulated article versions")
+    parser.add_argument("--db", default=DEFAULT_ARTICLE_STORE_PATH, help="Path of the SQLite store file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    get_parser = subparsers.add_parser("get", help="Print the full text of articles by hash")
+    get_parser.add_argument("hashes", nargs="+")
+    subparsers.add_parser("stats", help="Print the size and dedup statistics of the store")
+
+    args = parser.parse_args(argv)
+    store = ArticleStore(args.db)
+    try:
+        if args.command == "get":
+            for ref in args.hashes:
+                print(store.get(ref))
+        elif args.command == "stats":
+            print(json.dumps(store.stats(), indent=2))
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from rate_limiter import RateLimiter
+from simulation import Simulation, build_result, default_result_sink
+
+
+async def run_personas_async(
+    personas: List[Dict],
+    use_db: bool = True,
+    concurrency: int = 8,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    **simulation_kwargs
+) -> List[Dict]:
+    """Run a cohort of persona simulations concurrently.
+
+    At most `concurrency` sessions are in flight at once, and every LLM call
+    in the cohort draws from one shared RPM/TPM rate limiter, so wall-clock
+    time tracks the slowest session rather than the sum of all of them.
+
+    With a budget governor in `simulation_kwargs`, every session starts at
+    once and the governor's `concurrency` slots decide which of them runs
+    its next iteration, so the budget goes to the sessions expected to gain
+    the most per token while the others wait.
+
+    Args:
+        personas: Persona data dictionaries, one per session
+        use_db: Whether sessions should log to Supabase
+        concurrency: Maximum number of sessions running at the same time
+        requests_per_minute: Shared requests-per-minute limit, or None for no limit
+        tokens_per_minute: Shared tokens-per-minute limit, or None for no limit
+        **simulation_kwargs: Extra keyword arguments passed to each Simulation
+
+    Returns:
+        Result dictionaries in the same order as `personas`
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    governor = simulation_kwargs.get("governor")
+    if governor is not None:
+        governor.slots = concurrency
+    semaphore = asyncio.Semaphore(len(personas) if governor is not None else concurrency)
+    # Sessions must not each open their own fallback CSV file; they share one for the cohort
+    own_sink = default_result_sink(simulation_kwargs.get("sink"), use_db, simulation_kwargs.get("local_store"))
+    if own_sink:
+        simulation_kwargs["sink"] = own_sink
+    started = time.perf_counter()
+
+    async def run_one(index: int, persona_data: Dict) -> Dict:
+        async with semaphore:
+            name = persona_data['persona']['persona_name']
+            print(f"\nStarting persona {index + 1}/{len(personas)}: {name}")
+            # Simulation setup may open a database connection, so keep it off the event loop
+            sim = await asyncio.to_thread(Simulation, persona_data, use_db=use_db, **simulation_kwargs)
+            history, recommendation_rating, recommendation_reasoning = await sim.run_async(limiter)
+            print(f"Finished persona {index + 1}/{len(personas)}: {name} "
+                  f"(final rating {sim.user_agent.current_rating}/4)")
+            return build_result(index, persona_data, sim, history, recommendation_rating, recommendation_reasoning)
+
+    try:
+        results = await asyncio.gather(*(run_one(i, p) for i, p in enumerate(personas)))
+    finally:
+        if own_sink:
+            own_sink.close()
+            print(f"Wrote {own_sink.rows_written} result rows to {own_sink.path}")
+
+    elapsed = time.perf_counter() - started
+    print(f"\nCompleted {len(results)} sessions in {elapsed:.1f}s with concurrency {concurrency}")
+    return list(results)
@@ -0,0 +1,400 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from llm_backends import LLMBackend, OpenAIBackend, Completion
+from simulation import Simulation, build_result, default_result_sink
+
+# Directory that each batch run writes its request and results files under
+DEFAULT_BATCH_DIR = "batches"
+# The Batch API accepts at most this many requests per input file
+MAX_REQUESTS_PER_FILE = 50_000
+# Rounds a request may be sent in before its session fails
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds between status checks of a submitted batch
+DEFAULT_POLL_SECONDS = 60
+# Batch statuses after which a batch no longer changes
+FINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+def request_line(custom_id: str, model: str, messages: List[Dict], params: Dict) -> str:
+    """One line of a Batch API input file: a chat-completion request under its custom id."""
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": {"model": model, "messages": messages, **params}
+    }, ensure_ascii=False)
+
+
+def result_line(custom_id: str, model: str, completion: Optional[Completion] = None,
+                error: Optional[Exception] = None) -> str:
+    """One line of a Batch API output file, holding a chat completion or the error the request ended in."""
+    if completion is None:
+        return json.dumps({
+            "id": f"batch_req_{custom_id}",
+            "custom_id": custom_id,
+            "response": None,
+            "error": {"code": type(error).__name__, "message": str(error)}
+        }, ensure_ascii=False)
+    return json.dumps({
+        "id": f"batch_req_{custom_id}",
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "body": {
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": completion.text},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": completion.prompt_tokens,
+                    "completion_tokens": completion.completion_tokens,
+                    "total_tokens": completion.prompt_tokens + completion.completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": completion.cached_tokens}
+                }
+            }
+        },
+        "error": None
+    }, ensure_ascii=False)
+
+
+def parse_result_line(line: str) -> Tuple[str, Optional[Completion], Optional[str]]:
+    """Read one line of a Batch API output or error file.
+
+    Returns:
+        The request's custom id, and either its completion or why it failed
+    """
+    data = json.loads(line)
+    custom_id = data["custom_id"]
+    response = data.get("response") or {}
+    if data.get("error") or response.get("status_code") != 200:
+        error = data.get("error") or (response.get("body") or {}).get("error") or {}
+        return custom_id, None, error.get("message") or f"status {response.get('status_code')}"
+    body = response["body"]
+    usage = body.get("usage") or {}
+    return custom_id, Completion(
+        text=body["choices"][0]["message"]["content"],
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        completion_tokens=usage.get("completion_tokens") or 0,
+        cached_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    ), None
+
+
+class BatchExecutor:
+    """Turns a Batch API input file into its output file.
+
+    `contexts` maps custom ids to what the simulation knows about each call,
+    as LLMBackend.complete() takes it; the Batch API ignores it.
+    """
+
+    name = "base"
+
+    def run(self, requests_path: str, results_path: str, contexts: Optional[Dict[str, Dict]] = None) -> None:
+        raise NotImplementedError
+
+
+class LocalBatchExecutor(BatchExecutor):
+    """Processes batch files locally by sending each request through a backend.
+
+    With the offline backend this runs the whole batch pipeline, file
+    formats included, without network access.
+    """
+
+    name = "local"
+
+    def __init__(self, backend: LLMBackend) -> None:
+        self.backend = backend
+
+    def run(self, requests_path: str, results_path: str, contexts: Optional[Dict[str, Dict]] = None) -> None:
+        contexts = contexts or {}
+        with open(requests_path, encoding="utf-8") as requests, open(results_path, "w", encoding="utf-8") as results:
+            for line in requests:
+                request = json.loads(line)
+                body = dict(request["body"])
+                model, messages = body.pop("model"), body.pop("messages")
+                custom_id = request["custom_id"]
+                try:
+                    completion = self.backend.complete(model, messages, contexts.get(custom_id), **body)
+                    results.write(result_line(custom_id, model, completion) + "\n")
+                except Exception as e:
+                    results.write(result_line(custom_id, model, error=e) + "\n")
+
+
+class OpenAIBatchExecutor(BatchExecutor):
+    """Runs batch files through the OpenAI Batch API, waiting for each to finish.
+
+    Requests of an expired or cancelled batch that did not complete are
+    missing from the output file and are sent again in the next round.
+    """
+
+    name = "openai"
+
+    def __init__(self, backend: OpenAIBackend, poll_seconds: float = DEFAULT_POLL_SECONDS,
+                 completion_window: str = "24h") -> None:
+        self.backend = backend
+        self.poll_seconds = poll_seconds
+        self.completion_window = completion_window
+
+    def run(self, requests_path: str, results_path: str, contexts: Optional[Dict[str, Dict]] = None) -> None:
+        client = self.backend.client
+        with open(requests_path, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window
+        )
+        print(f"Submitted batch {batch.id} for {requests_path}")
+        while batch.status not in FINAL_BATCH_STATUSES:
+            time.sleep(self.poll_seconds)
+            batch = client.batches.retrieve(batch.id)
+        if batch.status == "failed":
+            raise RuntimeError(f"Batch {batch.id} for {requests_path} failed: {batch.errors}")
+        print(f"Batch {batch.id} {batch.status}: {batch.request_counts}")
+        with open(results_path, "w", encoding="utf-8") as results:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    text = client.files.content(file_id).text
+                    results.write(text if text.endswith("\n") or not text else text + "\n")
+
+
+def create_batch_executor(backend: LLMBackend, poll_seconds: float = DEFAULT_POLL_SECONDS) -> BatchExecutor:
+    """The Batch API for the OpenAI backend, the local stand-in for any other."""
+    if isinstance(backend, OpenAIBackend):
+        return OpenAIBatchExecutor(backend, poll_seconds)
+    return LocalBatchExecutor(backend)
+
+
+class _Request:
+    def __init__(self, model: str, messages: List[Dict], context: Optional[Dict], params: Dict,
+                 future: asyncio.Future) -> None:
+        self.model = model
+        self.messages = messages
+        self.context = context
+        self.params = params
+        self.future = future
+        self.attempts = 0
+
+
+class LockstepBatchBackend(LLMBackend):
+    """Collects the calls of a cohort's sessions into rounds sent as batch files.
+
+    Sessions run with run_async() on one event loop and each has at most one
+    call outstanding. Once every unfinished session is waiting on a call,
+    the calls are written out as one Batch API input file per model (split
+    at `max_requests_per_file`), the executor produces the output files, and
+    each call is answered from them. All sessions therefore move in
+    lockstep: iteration k's persona reactions of the whole cohort make up one
+    round, its editor rewrites the next, and the final recommendations are
+    the last. Failed requests go out again with the next round.
+    """
+
+    name = "batch"
+    async_only = True
+
+    def __init__(self, executor: BatchExecutor, batch_dir: str, sessions: int,
+                 max_requests_per_file: int = MAX_REQUESTS_PER_FILE,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+        """Set up the rounds of a cohort run.
+
+        Args:
+            executor: Runs each input file and writes its output file
+            batch_dir: Directory the round files are written to
+            sessions: Number of sessions that will send calls
+            max_requests_per_file: Most requests per input file
+            max_attempts: Rounds a request may be sent in before its call fails
+        """
+        self.executor = executor
+        self.batch_dir = batch_dir
+        self.sessions = sessions
+        self.max_requests_per_file = max_requests_per_file
+        self.max_attempts = max_attempts
+        self.rounds = 0
+        self.files = 0
+        self.requests = 0
+        self.failed_requests = 0
+        self._pending: List[_Request] = []
+        self._flushing = False
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def complete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        raise NotImplementedError("Batch rounds only collect calls made through acomplete() in run_async()")
+
+    async def acomplete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Request(model, messages, context, params, future))
+        self._maybe_flush()
+        return await future
+
+    def session_finished(self) -> None:
+        """Stop waiting for a session that will make no further calls."""
+        self.sessions -= 1
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if self._pending and not self._flushing and len(self._pending) >= self.sessions:
+            self._flushing = True
+            asyncio.get_running_loop().create_task(self._flush())
+
+    def _write_round(self, requests: List[_Request]) -> List[Tuple[str, str, Dict[str, Dict], Dict[str, _Request]]]:
+        """Write a round's input files, one model per file.
+
+        Returns:
+            For each file, its path, the path of its output file, the contexts
+            and the requests under their custom ids
+        """
+        by_model: Dict[str, List[_Request]] = {}
+        for request in requests:
+            by_model.setdefault(request.model, []).append(request)
+        files = []
+        for model, model_requests in by_model.items():
+            for part, start in enumerate(range(0, len(model_requests), self.max_requests_per_file)):
+                chunk = model_requests[start:start + self.max_requests_per_file]
+                safe_model = model.replace(":", "_").replace("/", "_")
+                stem = os.path.join(self.batch_dir, f"round-{self.rounds:04d}-{safe_model}-{part}")
+                ids = {f"r{self.rounds}-{model}-{part}-{i}": request for i, request in enumerate(chunk)}
+                with open(f"{stem}.jsonl", "w", encoding="utf-8") as f:
+                    for custom_id, request in ids.items():
+                        f.write(request_line(custom_id, request.model, request.messages, request.params) + "\n")
+                contexts = {custom_id: request.context for custom_id, request in ids.items() if request.context}
+                files.append((f"{stem}.jsonl", f"{stem}.results.jsonl", contexts, ids))
+        return files
+
+    @staticmethod
+    def _read_results(results_path: str) -> Dict[str, Tuple[Optional[Completion], Optional[str]]]:
+        results = {}
+        if os.path.exists(results_path):
+            with open(results_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        custom_id, completion, error = parse_result_line(line)
+                        results[custom_id] = (completion, error)
+        return results
+
+    async def _run_file(self, requests_path: str, results_path: str, contexts: Dict[str, Dict]) -> Dict:
+        try:
+            await asyncio.to_thread(self.executor.run, requests_path, results_path, contexts)
+        except Exception as e:
+            # The whole file goes out again next round
+            print(f"Batch {requests_path} failed: {e}")
+            return {}
+        return await asyncio.to_thread(self._read_results, results_path)
+
+    async def _flush(self) -> None:
+        requests, self._pending = self._pending, []
+        self.rounds += 1
+        try:
+            files = await asyncio.to_thread(self._write_round, requests)
+        except Exception as e:
+            # Without its input files the round cannot run; fail its calls rather than leave them waiting
+            for request in requests:
+                request.future.set_exception(e)
+            self._flushing = False
+            return
+        print(f"Batch round {self.rounds}: {len(requests)} requests in {len(files)} file(s)")
+        results = await asyncio.gather(*(self._run_file(path, results_path, contexts)
+                                         for path, results_path, contexts, _ in files))
+        self.files += len(files)
+        self.requests += len(requests)
+        retry = []
+        for (_, _, _, ids), file_results in zip(files, results):
+            for custom_id, request in ids.items():
+                request.attempts += 1
+                completion, error = file_results.get(custom_id, (None, "no result in the output file"))
+                if completion is not None:
+                    completion.retries = request.attempts - 1
+                    request.future.set_result(completion)
+                    continue
+                self.failed_requests += 1
+                if request.attempts >= self.max_attempts:
+                    request.future.set_exception(RuntimeError(
+                        f"Batch request {custom_id} failed after {request.attempts} attempts: {error}"
+                    ))
+                else:
+                    retry.append(request)
+        self._pending = retry + self._pending
+        self._flushing = False
+        self._maybe_flush()
+
+    def stats(self) -> Dict:
+        return {
+            "rounds": self.rounds,
+            "files": self.files,
+            "requests": self.requests,
+            "failed_requests": self.failed_requests
+        }
+
+
+async def run_personas_batch(
+    personas: List[Dict],
+    executor: BatchExecutor,
+    use_db: bool = True,
+    batch_dir: str = DEFAULT_BATCH_DIR,
+    max_requests_per_file: int = MAX_REQUESTS_PER_FILE,
+    **simulation_kwargs
+) -> List[Dict]:
+    """Run a cohort of persona simulations in lockstep rounds of batch files.
+
+    Latency per call is that of a whole batch, but a cohort of any size needs
+    only about two rounds per iteration plus one for the recommendations.
+    Beam search, streaming, speculation and budgets depend on interactive
+    calls and are not available.
+
+    Args:
+        personas: Persona data dictionaries, one per session
+        executor: Runs the batch files, e.g. from create_batch_executor()
+        use_db: Whether sessions should log to Supabase
+        batch_dir: Directory under which this run's request and results files are kept
+        max_requests_per_file: Most requests per input file
+        **simulation_kwargs: Extra keyword arguments passed to each Simulation; a `backend` is replaced
+
+    Returns:
+        Result dictionaries in the same order as `personas`
+    """
+    for option in ("stream", "speculate", "governor"):
+        if simulation_kwargs.get(option):
+            raise ValueError(f"batch mode cannot be combined with {option}")
+    if simulation_kwargs.get("beam_width", 1) > 1:
+        raise ValueError("batch mode cannot be combined with beam search")
+
+    run_dir = os.path.join(batch_dir, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    backend = LockstepBatchBackend(executor, run_dir, len(personas), max_requests_per_file)
+    simulation_kwargs["backend"] = backend
+    # Sessions must not each open their own fallback CSV file; they share one for the cohort
+    own_sink = default_result_sink(simulation_kwargs.get("sink"), use_db, simulation_kwargs.get("local_store"))
+    if own_sink:
+        simulation_kwargs["sink"] = own_sink
+    started = time.perf_counter()
+
+    async def run_one(index: int, persona_data: Dict) -> Dict:
+        try:
+            name = persona_data['persona']['persona_name']
+            print(f"\nStarting persona {index + 1}/{len(personas)}: {name}")
+            # Simulation setup may open a database connection, so keep it off the event loop
+            sim = await asyncio.to_thread(Simulation, persona_data, use_db=use_db, **simulation_kwargs)
+            history, recommendation_rating, recommendation_reasoning = await sim.run_async()
+            print(f"Finished persona {index + 1}/{len(personas)}: {name} "
+                  f"(final rating {sim.user_agent.current_rating}/4)")
+            return build_result(index, persona_data, sim, history, recommendation_rating, recommendation_reasoning)
+        finally:
+            backend.session_finished()
+
+    try:
+        results = await asyncio.gather(*(run_one(i, p) for i, p in enumerate(personas)))
+    finally:
+        if own_sink:
+            own_sink.close()
+            print(f"Wrote {own_sink.rows_written} result rows to {own_sink.path}")
+
+    elapsed = time.perf_counter() - started
+    print(f"\nCompleted {len(results)} sessions in {elapsed:.1f}s with batch files in {run_dir}: {backend.stats()}")
+    return list(results)
@@ -0,0 +1,450 @@
+"""Benchmarks for the simulation and synthetic-data hot paths.
+
+Run from the agent directory:
+
+    python benchmarks/run_benchmarks.py                  # compare against this host's baselines
+    python benchmarks/run_benchmarks.py --only prompt    # run a subset
+    python benchmarks/run_benchmarks.py --update-baseline
+
+Each benchmark reports throughput, latency percentiles and peak traced
+memory. A benchmark regresses when its throughput falls, or its peak memory
+grows, by more than the threshold relative to the stored baseline.
+
+Throughput only compares within one machine, so baselines.json keeps a set
+of baselines per host (host name and Python version). The file is
+host-local and not under version control: the first run on a host creates
+it, or adds the host's set, instead of comparing. Because a busy machine can slow a
+single run by more than the threshold, a benchmark counts as slower only
+when both its mean and median throughput fell, and one that looks regressed
+is rerun before it is reported. A recorded baseline is the slowest of as
+many runs.
+"""
+import os
+import io
+import sys
+import json
+import asyncio
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+from typing import Callable, Dict, List, Optional
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENT_DIR)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# Allowed relative slowdown / memory growth before a benchmark counts as a regression
+DEFAULT_THRESHOLD = 0.25
+# Minimum measuring time per benchmark
+MIN_SECONDS = 0.5
+# Seconds per streamed chunk in the paced offline runs
+PACED_CHUNK_DELAY = 0.0005
+# Milliseconds `import simulation` may add on top of a bare interpreter start
+IMPORT_BUDGET_MS = 250.0
+# Modules that must only be imported once a run actually needs them
+LAZY_MODULES = ("openai", "supabase", "dotenv", "pyarrow", "tiktoken")
+# Reruns of a benchmark that looks regressed before it is reported, and extra runs behind a recorded baseline
+CONFIRM_RUNS = 2
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the simulation's progress prints while measuring."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def measure(fn: Callable[[], object], items_per_call: int = 1, min_seconds: float = MIN_SECONDS,
+            min_calls: int = 3, max_calls: int = 100000) -> Dict:
+    """Time repeated calls of `fn`, then trace one extra call for peak memory.
+
+    Args:
+        fn: Zero-argument function to benchmark
+        items_per_call: Work items one call processes, used for throughput
+        min_seconds: Keep calling until at least this much time has passed
+        min_calls: Minimum number of timed calls
+        max_calls: Maximum number of timed calls
+
+    Returns:
+        Throughput, latency percentiles (microseconds per call) and peak memory (KiB)
+    """
+    samples = []
+    started = time.perf_counter()
+    with quiet():
+        while len(samples) < max_calls and (len(samples) < min_calls or time.perf_counter() - started < min_seconds):
+            call_started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - call_started)
+
+        # Keep the smaller of two traced peaks: a long-lived structure (say a
+        # backend's cache) that happens to resize during one call is not that call's cost
+        peaks = []
+        for _ in range(2):
+            tracemalloc.start()
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        peak = min(peaks)
+
+    total = sum(samples)
+    return {
+        "calls": len(samples),
+        "ops_per_sec": items_per_call * len(samples) / total if total else float("inf"),
+        "p50_us": percentile(samples, 0.50) * 1e6,
+        "p95_us": percentile(samples, 0.95) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "peak_kib": peak / 1024
+    }
+
+
+class NullSink:
+    """Result sink that drops rows, so end-to-end runs measure the simulation only."""
+    path = os.devnull
+    rows_written = 0
+
+    def write(self, row: Dict) -> None:
+        self.rows_written += 1
+
+    def close(self) -> None:
+        pass
+
+
+def simulation_benchmarks() -> Dict[str, Callable[[], Dict]]:
+    from simulation import Agent, Simulation, DEFAULT_ARTICLE, generate_diff_summary, load_personas
+    from llm_backends import OfflinePersonaBackend
+
+    personas = load_personas(os.path.join(AGENT_DIR, "data", "personas.json"))
+    persona = personas[0]
+    long_article = " ".join(article["article"] for p in personas for article in p.get("articles_read", []))
+    benchmarks = {}
+
+    for role in ("user", "editor"):
+        for memory_size in (0, 3, 10):
+            def bench(role=role, memory_size=memory_size):
+                agent = Agent(persona, role)
+                for i in range(memory_size):
+                    agent.add_to_memory(long_article[:1500], "Positive", 2.5 + i * 0.1)
+                return measure(lambda: agent.get_prompt(DEFAULT_ARTICLE))
+            benchmarks[f"prompt_{role}_memory{memory_size}"] = bench
+
+    responses = {
+        "user_valid": ("user", "REACTION: Positive\nRATING: 3.5/4\nREASONING: " + "The article cites data I trust. " * 8),
+        "user_malformed": ("user", "I think this article is fine and I would rate it about a three."),
+        "editor_valid": ("editor", "CHANGES_SUMMARY: Reframed around trusted sources.\n\nARTICLE: " + long_article[:2000]),
+        "editor_malformed": ("editor", long_article[:2000]),
+    }
+    for name, (role, response) in responses.items():
+        def bench(role=role, response=response):
+            agent = Agent(persona, role)
+            return measure(lambda: agent.process_response(response))
+        benchmarks[f"process_response_{name}"] = bench
+
+    json_responses = {
+        "user_json_valid": ("user", json.dumps({"reaction": "Positive", "rating": 3.5,
+                                                "reasoning": "The article cites data I trust. " * 8})),
+        "user_json_missing_field": ("user", json.dumps({"reaction": "Positive", "rating": 3.5})),
+        "editor_json_valid": ("editor", json.dumps({"changes_summary": "Reframed around trusted sources.",
+                                                    "article": long_article[:2000]})),
+    }
+    for name, (role, response) in json_responses.items():
+        def bench(role=role, response=response):
+            agent = Agent(persona, role, output_format="json")
+            return measure(lambda: agent.process_response(response))
+        benchmarks[f"process_response_{name}"] = bench
+
+    recommendations = {
+        "valid": "RECOMMENDATION_RATING: 3\nREASONING: " + "I would cautiously recommend it. " * 8,
+        "malformed": "Probably a three out of four overall.",
+    }
+    for name, response in recommendations.items():
+        def bench(response=response):
+            agent = Agent(persona, "user")
+            return measure(lambda: agent.process_recommendation_response(response))
+        benchmarks[f"process_recommendation_{name}"] = bench
+
+    sentences = [s.strip() + "." for s in long_article.split(".") if s.strip()]
+    for size in (4, 16, 64, 256):
+        old_text = " ".join(sentences[:size])
+        # Rewrite every third sentence, as an editor pass typically would
+        new_text = " ".join(s if i % 3 else s.upper() for i, s in enumerate(sentences[:size]))
+        def bench(old_text=old_text, new_text=new_text):
+            return measure(lambda: generate_diff_summary(old_text, new_text), max_calls=200)
+        benchmarks[f"diff_summary_{size}_sentences"] = bench
+        # Swap single words in a few sentences, the case a line diff handled quadratically
+        edited_text = " ".join(s.replace(" the ", " a ", 1) if i % 8 == 5 else s for i, s in enumerate(sentences[:size]))
+        def bench_word_edits(old_text=old_text, edited_text=edited_text):
+            return measure(lambda: generate_diff_summary(old_text, edited_text), max_calls=200)
+        benchmarks[f"diff_summary_{size}_sentences_word_edits"] = bench_word_edits
+
+    def bench_run():
+        backend = OfflinePersonaBackend()
+        sink = NullSink()
+        def run_cohort():
+            for persona_data in personas:
+                Simulation(persona_data, use_db=False, backend=backend, sink=sink).run()
+        return measure(run_cohort, items_per_call=len(personas))
+    benchmarks["simulation_run_offline_cohort"] = bench_run
+
+    def bench_structured():
+        # One response in five loses a field, so the run includes its re-asks
+        backend = OfflinePersonaBackend(format_error_rate=0.2)
+        sink = NullSink()
+        def run_cohort():
+            for persona_data in personas:
+                Simulation(persona_data, use_db=False, backend=backend, sink=sink, structured=True).run()
+        return measure(run_cohort, items_per_call=len(personas))
+    benchmarks["simulation_run_offline_cohort_structured"] = bench_structured
+
+    def bench_conversation():
+        # Prompts grow with every turn and the backend hashes each message prefix for its prompt cache
+        backend = OfflinePersonaBackend()
+        sink = NullSink()
+        def run_cohort():
+            for persona_data in personas:
+                Simulation(persona_data, use_db=False, backend=backend, sink=sink, prompt_layout="conversation").run()
+        return measure(run_cohort, items_per_call=len(personas))
+    benchmarks["simulation_run_offline_cohort_conversation"] = bench_conversation
+
+    def bench_budget():
+        # The cohort shares a budget of roughly half what it spends uncapped, so sessions compete for it
+        from async_runner import run_personas_async
+        from budget import BudgetGovernor
+        from telemetry import Telemetry
+        backend = OfflinePersonaBackend()
+        sink = NullSink()
+        def run_cohort():
+            telemetry = Telemetry()
+            governor = BudgetGovernor(max_tokens=100_000)
+            telemetry.add_listener(governor.charge)
+            asyncio.run(run_personas_async(personas, use_db=False, backend=backend, sink=sink,
+                                           telemetry=telemetry, governor=governor))
+        return measure(run_cohort, items_per_call=len(personas))
+    benchmarks["simulation_run_offline_cohort_budget"] = bench_budget
+
+    def bench_batch():
+        # Every round goes through JSONL request and results files processed by the local stand-in
+        from batch_runner import run_personas_batch, LocalBatchExecutor
+        executor = LocalBatchExecutor(OfflinePersonaBackend())
+        sink = NullSink()
+        def run_cohort():
+            with tempfile.TemporaryDirectory() as batch_dir:
+                asyncio.run(run_personas_batch(personas, executor, use_db=False, batch_dir=batch_dir, sink=sink))
+        return measure(run_cohort, items_per_call=len(personas))
+    benchmarks["simulation_run_offline_cohort_batch"] = bench_batch
+
+    for mode in ("", "stream", "speculate"):
+        def bench_paced(mode=mode):
+            # Simulated generation time, so streaming and speculation have calls to overlap
+            backend = OfflinePersonaBackend(chunk_delay=PACED_CHUNK_DELAY)
+            sink = NullSink()
+            options = {mode: True} if mode else {}
+            def run_paced():
+                for persona_data in personas[:3]:
+                    Simulation(persona_data, use_db=False, backend=backend, sink=sink, **options).run()
+            return measure(run_paced, items_per_call=3, min_calls=1, min_seconds=0)
+        benchmarks["simulation_run_offline_paced" + (f"_{mode}" if mode else "")] = bench_paced
+    return benchmarks
+
+
+def synthetic_benchmarks(max_rows: int) -> Dict[str, Callable[[], Dict]]:
+    import generate_synthetic_data as synthetic
+
+    benchmarks = {}
+    rows = 1000
+    while rows <= max_rows:
+        def bench_rows(rows=rows):
+            def generate_rows():
+                # The per-row work of generate_synthetic_data: article, reasoning and changes text
+                random.seed(0)
+                for i in range(rows):
+                    synthetic.generate_article()
+                    synthetic.generate_reasoning()
+                    if i % 7:
+                        synthetic.generate_changes_summary()
+            return measure(generate_rows, items_per_call=rows, min_calls=1)
+        benchmarks[f"synthetic_rows_{rows}"] = bench_rows
+
+        def bench_progressions(rows=rows):
+            # Sessions average roughly six rows each
+            sessions = max(1, rows // 6)
+            def generate_progressions():
+                random.seed(0)
+                for i in range(sessions):
+                    succeed = i % 100 < synthetic.SUCCESS_PERCENTAGE
+                    initial = round(random.uniform(synthetic.RATING_MIN, synthetic.MAX_INITIAL_RATING), 1)
+                    synthetic.calculate_realistic_progression(initial, synthetic.TARGET_RATING, succeed, 1, 7)
+            return measure(generate_progressions, items_per_call=sessions, min_calls=1)
+        benchmarks[f"synthetic_progressions_{rows}_rows"] = bench_progressions
+
+        def bench_vectorized(rows=rows):
+            import numpy as np
+            import synthetic_engine
+            # Sessions average roughly 6.75 rows each
+            sessions = max(1, int(rows / 6.75))
+            return measure(lambda: synthetic_engine.generate_batch(np.random.default_rng(0), sessions),
+                           items_per_call=rows, min_calls=1)
+        benchmarks[f"synthetic_vectorized_rows_{rows}"] = bench_vectorized
+        rows *= 10
+
+    def bench_full():
+        def generate_file():
+            with tempfile.TemporaryDirectory() as directory:
+                cwd = os.getcwd()
+                os.chdir(directory)
+                try:
+                    synthetic.generate_synthetic_data()
+                finally:
+                    os.chdir(cwd)
+        return measure(generate_file, min_calls=3)
+    benchmarks["generate_synthetic_data_default"] = bench_full
+    return benchmarks
+
+
+def _time_interpreter(code: str, runs: int) -> List[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=AGENT_DIR, check=True, capture_output=True)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def check_import(runs: int = 7) -> Dict:
+    """Time `import simulation` in fresh interpreters and check it has no side effects.
+
+    Returns:
+        Median import cost in milliseconds over a bare interpreter start, any
+        output the import printed and any heavy modules it loaded eagerly
+    """
+    probe = ("import sys, simulation; "
+             f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", probe], cwd=AGENT_DIR, check=True,
+                            capture_output=True, text=True)
+    lines = result.stdout.splitlines()
+    eager = [m for m in (lines[-1] if lines else "").split(",") if m]
+    baseline = percentile(_time_interpreter("pass", runs), 0.5)
+    with_import = percentile(_time_interpreter("import simulation", runs), 0.5)
+    return {
+        "import_ms": max(0.0, with_import - baseline) * 1000,
+        "output": lines[:-1],
+        "eager_modules": eager
+    }
+
+
+def host_key() -> str:
+    """The machine a set of baselines belongs to."""
+    return f"{platform.node() or 'unknown'}/python{sys.version_info.major}.{sys.version_info.minor}"
+
+
+def compare(name: str, result: Dict, baseline: Optional[Dict], threshold: float) -> List[str]:
+    """Describe the ways a result regressed against its baseline."""
+    if not baseline:
+        return []
+    problems = []
+    # A few stalled calls drag the mean down but leave the median alone
+    if (result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - threshold)
+            and result["p50_us"] * (1 - threshold) > baseline["p50_us"]):
+        problems.append(f"throughput {result['ops_per_sec']:.1f}/s vs baseline {baseline['ops_per_sec']:.1f}/s")
+    # Ignore memory noise on tiny allocations
+    if result["peak_kib"] > max(64.0, baseline["peak_kib"] * (1 + threshold)):
+        problems.append(f"peak memory {result['peak_kib']:.0f} KiB vs baseline {baseline['peak_kib']:.0f} KiB")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and synthetic-data hot paths")
+    parser.add_argument("--only", default=None, help="Run benchmarks whose name contains this text")
+    parser.add_argument("--max-rows", type=int, default=100000,
+                        help="Largest synthetic-data size (use 1000000 for the full 10^3-10^6 sweep)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed relative regression before failing")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to compare against")
+    parser.add_argument("--host", default=host_key(),
+                        help="Name the baselines are stored under (default: host name and Python version)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--confirm-runs", type=int, default=CONFIRM_RUNS,
+                        help="Reruns of a benchmark that looks regressed before it is reported")
+    parser.add_argument("--json", default=None, metavar="PATH", help="Also write the results to this file")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="Maximum milliseconds `import simulation` may take")
+    args = parser.parse_args(argv)
+
+    import_check = check_import()
+    import_problems = []
+    if import_check["import_ms"] > args.import_budget_ms:
+        import_problems.append(f"takes {import_check['import_ms']:.0f} ms, budget {args.import_budget_ms:.0f} ms")
+    if import_check["output"]:
+        import_problems.append(f"prints {len(import_check['output'])} lines")
+    if import_check["eager_modules"]:
+        import_problems.append(f"eagerly imports {', '.join(import_check['eager_modules'])}")
+    print(f"import simulation: {import_check['import_ms']:.1f} ms (budget {args.import_budget_ms:.0f} ms)"
+          f"{'  REGRESSION' if import_problems else ''}")
+
+    with quiet():
+        benchmarks = {**simulation_benchmarks(), **synthetic_benchmarks(args.max_rows)}
+    if args.only:
+        benchmarks = {name: bench for name, bench in benchmarks.items() if args.only in name}
+
+    hosts = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            hosts = json.load(f)
+    baselines = hosts.get(args.host, {})
+    if not baselines:
+        print(f"No baselines for {args.host} in {args.baseline}; recording this run as its baseline")
+        args.update_baseline = True
+
+    results = {}
+    regressions = {}
+    print(f"{'benchmark':42} {'ops/s':>12} {'p50 us':>11} {'p95 us':>11} {'p99 us':>11} {'peak KiB':>10}")
+    for name, bench in benchmarks.items():
+        if args.update_baseline:
+            # Record the slowest of a few runs, so the gate only fires beyond the machine's own spread
+            result = min((bench() for _ in range(args.confirm_runs + 1)), key=lambda run: run["ops_per_sec"])
+            problems = compare(name, result, baselines.get(name), args.threshold)
+        else:
+            result = bench()
+            problems = compare(name, result, baselines.get(name), args.threshold)
+            for _ in range(args.confirm_runs if problems else 0):
+                # A real regression shows up again; a run slowed down by a busy machine usually does not
+                result = bench()
+                problems = compare(name, result, baselines.get(name), args.threshold)
+                if not problems:
+                    break
+        results[name] = result
+        if problems:
+            regressions[name] = problems
+        flag = "  REGRESSION" if problems else ""
+        print(f"{name:42} {result['ops_per_sec']:12.1f} {result['p50_us']:11.1f} {result['p95_us']:11.1f} "
+              f"{result['p99_us']:11.1f} {result['peak_kib']:10.1f}{flag}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({**results, "import_simulation": import_check}, f, indent=2)
+
+    if args.update_baseline:
+        hosts[args.host] = {**baselines, **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(hosts, f, indent=2, sort_keys=True)
+        print(f"Updated {len(results)} baselines of {args.host} in {args.baseline}")
+        return 0
+
+    if import_problems:
+        regressions["import_simulation"] = import_problems
+    for name, problems in regressions.items():
+        print(f"REGRESSION {name}: {'; '.join(problems)}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
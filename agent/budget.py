@@ -0,0 +1,275 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from typing import Dict, List, Optional, Sequence
+
+# USD per million prompt and completion tokens of each model
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4": (30.00, 60.00)
+}
+# Share of the prompt price charged for tokens served from the provider's prompt cache
+CACHED_PROMPT_DISCOUNT = 0.5
+# Normalized rating gain assumed for an iteration before a session has shown its own
+PRIOR_STEP = 0.1
+# Floor of the expected gain, so stalled sessions still run once better ones are done
+MIN_STEP = 0.005
+# Weight of the latest gain in a session's moving average
+STEP_SMOOTHING = 0.5
+# Reservations grow to this multiple of the largest iteration a session has actually cost
+GROWTH_MARGIN = 1.25
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Cost in USD of a call; models without a listed price cost nothing.
+
+    `cached_tokens` are the part of the prompt served from the prompt cache,
+    charged at CACHED_PROMPT_DISCOUNT of the prompt price.
+    """
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    prompt = prompt_tokens - cached_tokens + cached_tokens * CACHED_PROMPT_DISCOUNT
+    return (prompt * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def expected_step(ratings: Sequence[float]) -> float:
+    """Expected normalized gain of a session's next iteration from its live ratings.
+
+    Uses an exponential moving average of the gains between consecutive
+    ratings, PRIOR_STEP while there are none, and never less than MIN_STEP.
+    """
+    step = None
+    for previous, current in zip(ratings, ratings[1:]):
+        gain = (current - previous) / 3  # 1-4 scale to 0-1 scale
+        step = gain if step is None else STEP_SMOOTHING * gain + (1 - STEP_SMOOTHING) * step
+    return max(MIN_STEP, PRIOR_STEP if step is None else step)
+
+
+class _Session:
+    def __init__(self, reserve_tokens: int, reserve_cost: float) -> None:
+        self.reserve_tokens = reserve_tokens
+        self.reserve_cost = reserve_cost
+        # Reservation of the iteration in flight, if any
+        self.in_flight = False
+        self.iteration_tokens = 0
+        self.iteration_cost = 0.0
+        self.spent_at_admission = (0, 0.0)
+        # Largest iteration the session has actually cost so far
+        self.largest_tokens = 0
+        self.largest_cost = 0.0
+        self.spent_tokens = 0
+        self.spent_cost = 0.0
+        self.iterations = 0
+
+
+class BudgetGovernor:
+    """Caps the tokens, cost and wall-clock time of a cohort run.
+
+    Every session reserves its final recommendation call when it opens, so
+    any session that started can always finish. Each iteration is then
+    admitted only if it fits next to everything spent and reserved, which
+    keeps spending under the ceiling as long as a reservation covers the
+    iteration; reservations grow with the largest iteration seen.
+
+    At most `slots` iterations run at once. When a slot frees up, it goes to
+    the waiting session with the highest expected gain per token: the
+    share of its remaining gap to the target rating that its next iteration
+    is expected to close, divided by what the iteration is expected to cost.
+    Sessions that keep waiting are paused; once the budget can no longer
+    cover their next iteration they are told to finish.
+
+    Sessions are keyed by their session id. Call charge() with every call
+    record, for instance as a telemetry listener. Thread-safe.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None,
+                 max_seconds: Optional[float] = None, slots: int = 8) -> None:
+        """Set the run's ceilings.
+
+        Args:
+            max_tokens: Total prompt and completion tokens, or None for no cap
+            max_cost: Total USD at MODEL_PRICES, or None for no cap
+            max_seconds: Seconds after which no further iterations are admitted, or None
+            slots: Iterations allowed in flight at once
+        """
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_seconds = max_seconds
+        self.slots = slots
+        self.started = time.monotonic()
+        self.spent_tokens = 0
+        self.spent_cost = 0.0
+        self.admitted = 0
+        self.denied = 0
+        self.skipped = 0
+        self._in_flight = 0
+        self._sessions: Dict[object, _Session] = {}
+        self._waiting: List = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def _committed(self) -> tuple:
+        """Tokens and cost spent plus everything still reserved. Caller holds the lock."""
+        tokens = self.spent_tokens
+        cost = self.spent_cost
+        for session in self._sessions.values():
+            tokens += session.reserve_tokens + session.iteration_tokens
+            cost += session.reserve_cost + session.iteration_cost
+        return tokens, cost
+
+    def _fits(self, tokens: int, cost: float) -> bool:
+        """Whether another reservation stays under every ceiling. Caller holds the lock."""
+        committed_tokens, committed_cost = self._committed()
+        if self.max_tokens is not None and committed_tokens + tokens > self.max_tokens:
+            return False
+        if self.max_cost is not None and committed_cost + cost > self.max_cost:
+            return False
+        return True
+
+    def _out_of_time(self) -> bool:
+        return self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds
+
+    def open_session(self, key, reserve_tokens: int, reserve_cost: float) -> bool:
+        """Register a session and reserve its recommendation call.
+
+        Returns:
+            False if the budget cannot cover even that, in which case the session should not start
+        """
+        with self._lock:
+            if self._out_of_time() or not self._fits(reserve_tokens, reserve_cost):
+                self.skipped += 1
+                return False
+            self._sessions[key] = _Session(reserve_tokens, reserve_cost)
+            return True
+
+    def _reservation(self, session: _Session, tokens: int, cost: float) -> tuple:
+        return (max(tokens, int(session.largest_tokens * GROWTH_MARGIN)),
+                max(cost, session.largest_cost * GROWTH_MARGIN))
+
+    def _grant(self, session: _Session, tokens: int, cost: float) -> None:
+        """Caller holds the lock."""
+        session.in_flight = True
+        session.iteration_tokens, session.iteration_cost = tokens, cost
+        session.iterations += 1
+        session.spent_at_admission = (session.spent_tokens, session.spent_cost)
+        self._in_flight += 1
+        self.admitted += 1
+
+    async def admit(self, key, ratings: Sequence[float], target: float, tokens: int, cost: float) -> bool:
+        """Wait until the session may run its next iteration.
+
+        Args:
+            key: Session registered with open_session()
+            ratings: The session's ratings so far on the 1-4 scale
+            target: Normalized target rating
+            tokens: Estimated tokens of the iteration
+            cost: Estimated USD of the iteration
+
+        Returns:
+            True to run the iteration, False if the session should finish
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            session = self._sessions[key]
+            tokens, cost = self._reservation(session, tokens, cost)
+            current = (ratings[-1] - 1) / 3 if ratings else 0.0
+            gap = max(target - current, 1e-6)
+            priority = min(expected_step(ratings), gap) / gap / max(tokens, 1)
+            heapq.heappush(self._waiting, (-priority, next(self._order), key, tokens, cost, future))
+            self._dispatch()
+        return await future
+
+    def admit_now(self, key, tokens: int, cost: float) -> bool:
+        """Admit an iteration without waiting, for sessions that run one after another.
+
+        Returns:
+            True to run the iteration, False if the session should finish
+        """
+        with self._lock:
+            session = self._sessions[key]
+            tokens, cost = self._reservation(session, tokens, cost)
+            if self._out_of_time() or not self._fits(tokens, cost):
+                self.denied += 1
+                return False
+            self._grant(session, tokens, cost)
+            return True
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the best waiting sessions; deny those the budget cannot cover. Caller holds the lock."""
+        while self._waiting and self._in_flight < self.slots:
+            _, _, key, tokens, cost, future = self._waiting[0]
+            session = self._sessions[key]
+            if self._out_of_time():
+                admitted = False
+            elif self._fits(tokens, cost):
+                admitted = True
+            elif self._in_flight:
+                # Iterations in flight may settle below their reservations; wait for them
+                return
+            else:
+                admitted = False
+            heapq.heappop(self._waiting)
+            if admitted:
+                self._grant(session, tokens, cost)
+            else:
+                self.denied += 1
+            future.get_loop().call_soon_threadsafe(_resolve, future, admitted)
+
+    def _release(self, session: _Session) -> None:
+        """End a session's iteration in flight. Caller holds the lock."""
+        if session.in_flight:
+            spent_tokens, spent_cost = session.spent_at_admission
+            session.largest_tokens = max(session.largest_tokens, session.spent_tokens - spent_tokens)
+            session.largest_cost = max(session.largest_cost, session.spent_cost - spent_cost)
+            session.in_flight = False
+            session.iteration_tokens, session.iteration_cost = 0, 0.0
+            self._in_flight -= 1
+
+    def settle(self, key) -> None:
+        """Release the reservation of a session's finished iteration and pass its slot on."""
+        with self._lock:
+            self._release(self._sessions[key])
+            self._dispatch()
+
+    def close_session(self, key) -> None:
+        """Release everything a finished session still holds, including an unsettled iteration."""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self._release(session)
+                self._dispatch()
+
+    def charge(self, record) -> None:
+        """Add the usage of a completed call to the spend of the run and of its session."""
+        tokens = record.prompt_tokens + record.completion_tokens
+        cost = call_cost(record.model, record.prompt_tokens, record.completion_tokens, record.cached_tokens)
+        with self._lock:
+            self.spent_tokens += tokens
+            self.spent_cost += cost
+            session = self._sessions.get(record.session_id)
+            if session is not None:
+                session.spent_tokens += tokens
+                session.spent_cost += cost
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "spent_tokens": self.spent_tokens,
+                "spent_cost": round(self.spent_cost, 6),
+                "max_tokens": self.max_tokens,
+                "max_cost": self.max_cost,
+                "elapsed_seconds": round(time.monotonic() - self.started, 3),
+                "iterations_admitted": self.admitted,
+                "iterations_denied": self.denied,
+                "sessions_skipped": self.skipped
+            }
+
+
+def _resolve(future: asyncio.Future, admitted: bool) -> None:
+    if not future.done():
+        future.set_result(admitted)
@@ -0,0 +1,130 @@
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Default location of the checkpoint journal
+DEFAULT_CHECKPOINT_PATH = "simulation_checkpoints.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    session_key TEXT PRIMARY KEY,
+    persona_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    phase TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    state_json TEXT NOT NULL,
+    result_json TEXT,
+    saves INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_checkpoints_status ON checkpoints (status);
+"""
+
+
+def session_key_for(persona_id, article: Optional[str], seed: Optional[int],
+                    beam_width: int = 1, beam_keep: int = 1) -> str:
+    """Build the deterministic key of a session in the checkpoint journal.
+
+    Re-running the same (persona, article, seed, beam) combination maps to the
+    same key, which is what lets a restarted run find its earlier progress.
+    """
+    key = json.dumps([str(persona_id), article or "", seed, beam_width, beam_keep])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class CheckpointJournal:
+    """A durable SQLite journal of in-flight simulation state.
+
+    Each session has one row holding a snapshot of both agents after its
+    latest completed LLM call. Every save is a single transaction in WAL mode
+    with synchronous=FULL, so after a crash the row holds either the previous
+    or the new snapshot, never a mix, and a resumed run repeats no call whose
+    result was journaled.
+    """
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH) -> None:
+        """Open (and create if needed) the journal database.
+
+        Args:
+            path: Path of the SQLite journal file
+        """
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            yield conn
+        finally:
+            conn.close()
+
+    def save(self, session_key: str, persona_id, phase: str, iteration: int, state: Dict) -> None:
+        """Journal the state of a session after a completed call.
+
+        Args:
+            session_key: Key from session_key_for()
+            persona_id: Persona the session belongs to
+            phase: Which call the snapshot follows ("user", "editor", "round" or "target")
+            iteration: Iteration the snapshot belongs to
+            state: JSON-serializable session state
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO checkpoints (session_key, persona_id, status, phase, iteration, state_json, "
+                "result_json, saves, created_at, updated_at) VALUES (?, ?, 'running', ?, ?, ?, NULL, 1, ?, ?) "
+                "ON CONFLICT (session_key) DO UPDATE SET status = 'running', phase = excluded.phase, "
+                "iteration = excluded.iteration, state_json = excluded.state_json, result_json = NULL, "
+                "saves = saves + 1, updated_at = excluded.updated_at",
+                (session_key, str(persona_id), phase, iteration, json.dumps(state), now, now)
+            )
+
+    def complete(self, session_key: str, persona_id, iteration: int, state: Dict, result: Dict) -> None:
+        """Mark a session as finished, storing its final state and result."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO checkpoints (session_key, persona_id, status, phase, iteration, state_json, "
+                "result_json, saves, created_at, updated_at) VALUES (?, ?, 'completed', 'done', ?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (session_key) DO UPDATE SET status = 'completed', phase = 'done', "
+                "iteration = excluded.iteration, state_json = excluded.state_json, "
+                "result_json = excluded.result_json, saves = saves + 1, updated_at = excluded.updated_at",
+                (session_key, str(persona_id), iteration, json.dumps(state), json.dumps(result), now, now)
+            )
+
+    def load(self, session_key: str) -> Optional[Dict]:
+        """Return the latest checkpoint of a session, or None if it was never journaled.
+
+        The returned dictionary has the keys status, phase, iteration, state
+        and result (None until the session is completed).
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, phase, iteration, state_json, result_json FROM checkpoints WHERE session_key = ?",
+                (session_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, phase, iteration, state_json, result_json = row
+        return {
+            "status": status,
+            "phase": phase,
+            "iteration": iteration,
+            "state": json.loads(state_json),
+            "result": json.loads(result_json) if result_json else None
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Count journaled sessions by status."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM checkpoints GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
@@ -0,0 +1,183 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+# Default location of the on-disk cache
+DEFAULT_CACHE_PATH = "completion_cache.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions (last_access);
+"""
+
+
+class CacheMissError(Exception):
+    """Raised in cache-only mode when a completion is not in the cache."""
+
+
+def completion_key(model: str, messages: List[Dict], params: Optional[Dict] = None) -> str:
+    """Build the content address of a completion request.
+
+    The key is a SHA-256 over the model, the sampling parameters and the
+    messages, serialized canonically so byte-identical prompts always collide.
+    """
+    payload = json.dumps(
+        {"model": model, "params": params or {}, "messages": messages},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """An on-disk, content-addressed cache of chat completion responses.
+
+    Entries are evicted least-recently-used first once the cache grows past
+    `max_bytes`, and are ignored once older than `ttl_seconds`.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None, cache_only: bool = False) -> None:
+        """Open (and create if needed) the cache database.
+
+        Args:
+            path: Path of the SQLite cache file
+            max_bytes: Maximum total size of cached responses, or None for no cap
+            ttl_seconds: Lifetime of new entries, or None for entries that never expire
+            cache_only: Raise CacheMissError on a miss instead of calling the API
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.cache_only = cache_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(SCHEMA)
+        self._size = self._total_size()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, model: str, messages: List[Dict], params: Optional[Dict] = None) -> Optional[str]:
+        """Look up a cached response.
+
+        Args:
+            model: Model name of the request
+            messages: Chat messages of the request
+            params: Extra sampling parameters of the request
+
+        Returns:
+            The cached response text, or None on a miss
+
+        Raises:
+            CacheMissError: On a miss when the cache is in cache-only mode
+        """
+        key = completion_key(model, messages, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at, size FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._size -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+
+        if row is None:
+            if self.cache_only:
+                raise CacheMissError(f"No cached completion for {model} request {key[:12]}")
+            return None
+        return row[0]
+
+    def put(self, model: str, messages: List[Dict], params: Optional[Dict], response: str) -> None:
+        """Store a response, evicting least-recently-used entries if the cache is over its cap.
+
+        Args:
+            model: Model name of the request
+            messages: Chat messages of the request
+            params: Extra sampling parameters of the request
+            response: Response text to cache
+        """
+        key = completion_key(model, messages, params)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            # Overwriting an entry only grows the cache by the difference in size
+            old = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, size, created_at, last_access, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now, expires_at)
+            )
+            self._size += size - (old[0] if old else 0)
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drop expired entries, then the least recently used ones, until under the cap. Caller holds the lock."""
+        self._conn.execute("DELETE FROM completions WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        # Other processes may share the file, so start from the real size rather than our running total
+        self._size = self._total_size()
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+                if self._size <= self.max_bytes:
+                    break
+
+    def purge_expired(self) -> int:
+        """Delete every expired entry.
+
+        Returns:
+            The number of entries removed
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM completions WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )
+            self._size = self._total_size()
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and the current size of the cache."""
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self._size
+        }
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,47 @@
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+@lru_cache(maxsize=None)
+def load_environment() -> None:
+    """Load variables from .env into the process environment, once, on first use."""
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        # python-dotenv is optional when the variables are already exported
+        return
+    load_dotenv()
+
+
+def get_env(name: str) -> Optional[str]:
+    """Read a setting, loading .env first if that has not happened yet."""
+    load_environment()
+    return os.getenv(name)
+
+
+def get_supabase_credentials() -> Tuple[Optional[str], Optional[str]]:
+    """Return the (SUPABASE_URL, SUPABASE_KEY) pair, either of which may be None."""
+    return get_env("SUPABASE_URL"), get_env("SUPABASE_KEY")
+
+
+def create_supabase_client(url: str, key: str):
+    """Create a Supabase client, importing the SDK only when a client is actually needed."""
+    from supabase import create_client
+    return create_client(url, key)
+
+
+def print_environment_diagnostics() -> None:
+    """Print where settings are read from and which credentials are present (values redacted)."""
+    load_environment()
+    # Debug: Print the current working directory and check if .env exists
+    print(f"Current working directory: {os.getcwd()}")
+    print(f".env file exists: {os.path.exists('.env')}")
+
+    # Debug: Check if Supabase environment variables exist (redacting actual values)
+    supabase_url, supabase_key = get_supabase_credentials()
+    print(f"SUPABASE_URL exists: {supabase_url is not None}")
+    print(f"SUPABASE_KEY exists: {supabase_key is not None}")
+    if supabase_url and supabase_key:
+        print(f"Supabase URL format looks valid: {'http' in supabase_url.lower()}")
+        print(f"Supabase key length: {len(supabase_key)}")
@@ -0,0 +1,464 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Default location of the shared queue database
+DEFAULT_QUEUE_PATH = "simulation_jobs.db"
+# How long a lease is valid without a heartbeat
+DEFAULT_LEASE_SECONDS = 120
+# How many times a job may be leased before it is marked as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    persona_id TEXT NOT NULL,
+    persona_json TEXT NOT NULL,
+    article TEXT,
+    seed INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    heartbeat_at REAL,
+    result_json TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_lease ON jobs (status, lease_expires_at);
+"""
+
+
+def job_id_for(persona_id, article: Optional[str], seed: Optional[int]) -> str:
+    """Build the deterministic id of a (persona, article, seed) simulation.
+
+    Enqueuing the same combination twice therefore maps to the same job.
+    """
+    key = json.dumps([str(persona_id), article or "", seed])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass
+class Job:
+    """A leased simulation job.
+
+    `attempt` doubles as a fencing token: only the holder of the latest lease
+    can heartbeat, complete or fail the job.
+    """
+    job_id: str
+    persona_data: Dict
+    article: Optional[str]
+    seed: Optional[int]
+    attempt: int
+    worker_id: str
+
+
+class JobQueue:
+    """A shared SQLite queue of persona simulations with leases and heartbeats."""
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+        """Open (and create if needed) the queue database.
+
+        Args:
+            path: Path of the SQLite file shared by all workers
+            lease_seconds: Seconds a lease stays valid without a heartbeat
+            max_attempts: Leases allowed per job before it is marked as failed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, persona_data: Dict, article: Optional[str] = None, seed: Optional[int] = None) -> Optional[str]:
+        """Add a simulation job unless the same one is already queued or done.
+
+        Args:
+            persona_data: Persona dictionary as stored in personas.json
+            article: Seed article for the session, or None for the default article
+            seed: Sampling seed forwarded to the LLM calls
+
+        Returns:
+            The job id if a new job was added, otherwise None
+        """
+        persona_id = persona_data["persona"].get("persona_id", persona_data["persona"]["persona_name"])
+        job_id = job_id_for(persona_id, article, seed)
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, persona_id, persona_json, article, seed, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, str(persona_id), json.dumps(persona_data), article, seed, now, now)
+            )
+        return job_id if cursor.rowcount else None
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> int:
+        """Re-queue (or fail) jobs whose worker stopped heartbeating. Caller holds the write lock."""
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', lease_owner = NULL, error = 'lease expired too many times', "
+            "updated_at = ? WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+            (now, now, self.max_attempts)
+        )
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires_at < ?",
+            (now, now)
+        )
+        return cursor.rowcount
+
+    def requeue_expired(self) -> int:
+        """Return jobs with expired leases to the queue.
+
+        Returns:
+            The number of jobs re-queued
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                count = self._expire_leases(conn, time.time())
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        """Atomically take the oldest queued job.
+
+        Args:
+            worker_id: Identifier of the leasing worker
+
+        Returns:
+            The leased job, or None if the queue is empty
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE takes the write lock up front so two workers can never lease the same row
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(conn, now)
+                row = conn.execute(
+                    "SELECT job_id, persona_json, article, seed, attempts FROM jobs "
+                    "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job_id, persona_json, article, seed, attempts = row
+                conn.execute(
+                    "UPDATE jobs SET status = 'leased', lease_owner = ?, attempts = ?, lease_expires_at = ?, "
+                    "heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                    (worker_id, attempts + 1, now + self.lease_seconds, now, now, job_id)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return Job(job_id, json.loads(persona_json), article, seed, attempts + 1, worker_id)
+
+    def _update_leased(self, job: Job, assignments: str, params: tuple) -> bool:
+        """Apply an update only while the caller still holds the job's current lease."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} "
+                "WHERE job_id = ? AND status = 'leased' AND lease_owner = ? AND attempts = ?",
+                params + (job.job_id, job.worker_id, job.attempt)
+            )
+        return cursor.rowcount == 1
+
+    def holds(self, job: Job) -> bool:
+        """Whether the caller's lease on a job is current and unexpired.
+
+        Workers check this before every paid call and logged row, so one whose
+        lease lapsed stops before the next holder's session can overlap it.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE job_id = ? AND status = 'leased' AND lease_owner = ? AND attempts = ? "
+                "AND lease_expires_at > ?",
+                (job.job_id, job.worker_id, job.attempt, time.time())
+            ).fetchone()
+        return row is not None
+
+    def heartbeat(self, job: Job) -> bool:
+        """Extend the lease on a running job.
+
+        Returns:
+            False if the lease was lost and the worker must stop the job
+        """
+        now = time.time()
+        return self._update_leased(
+            job, "lease_expires_at = ?, heartbeat_at = ?, updated_at = ?",
+            (now + self.lease_seconds, now, now)
+        )
+
+    def complete(self, job: Job, result: Dict) -> bool:
+        """Mark a job as done and store its result.
+
+        Returns:
+            False if the lease was lost, in which case the result is discarded
+        """
+        return self._update_leased(
+            job, "status = 'done', lease_owner = NULL, result_json = ?, updated_at = ?",
+            (json.dumps(result), time.time())
+        )
+
+    def fail(self, job: Job, error: str) -> bool:
+        """Release a job after an error, re-queuing it while attempts remain.
+
+        Returns:
+            False if the lease was already lost
+        """
+        status = "failed" if job.attempt >= self.max_attempts else "queued"
+        return self._update_leased(
+            job, "status = ?, lease_owner = NULL, lease_expires_at = NULL, error = ?, updated_at = ?",
+            (status, error, time.time())
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Count jobs by status."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class _Heartbeat(threading.Thread):
+    """Background thread that keeps a lease alive and stops the simulation if it is lost."""
+
+    def __init__(self, queue: JobQueue, job: Job, sim) -> None:
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job = job
+        self.sim = sim
+        self.lost = False
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        renewed = time.monotonic()
+        while not self._done.wait(interval):
+            try:
+                held = self.queue.heartbeat(self.job)
+            except sqlite3.Error as e:
+                # A locked or briefly unreachable queue file; the lease holds until it expires
+                print(f"Heartbeat for job {self.job.job_id} failed: {e}")
+                if time.monotonic() - renewed + interval < self.queue.lease_seconds:
+                    continue
+                # The next attempt would come too late, so another worker may take the job over
+                held = False
+            if not held:
+                print(f"Lost lease on job {self.job.job_id}, stopping session")
+                self.lost = True
+                self.sim.request_stop()
+                return
+            renewed = time.monotonic()
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+def run_worker(queue: JobQueue, worker_id: Optional[str] = None, use_db: bool = True,
+               poll_interval: float = 5.0, drain: bool = False, **simulation_kwargs) -> int:
+    """Lease and run jobs until stopped, or until the queue is empty when `drain` is set.
+
+    Args:
+        queue: The shared job queue
+        worker_id: Unique worker name, generated from the host name if omitted
+        use_db: Whether sessions should log to Supabase
+        poll_interval: Seconds to wait before polling an empty queue again
+        drain: Exit once no queued or leased jobs remain
+        **simulation_kwargs: Extra keyword arguments passed to each Simulation
+
+    Returns:
+        The number of jobs this worker completed
+    """
+    from simulation import Simulation, SimulationAborted, default_result_sink
+
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    completed = 0
+    print(f"Worker {worker_id} started on {queue.path}")
+    # Jobs of this worker share one fallback CSV file instead of opening one each
+    own_sink = default_result_sink(simulation_kwargs.get("sink"), use_db, simulation_kwargs.get("local_store"),
+                                   owner=worker_id)
+    if own_sink:
+        simulation_kwargs["sink"] = own_sink
+    try:
+        while True:
+            job = queue.lease(worker_id)
+            if job is None:
+                stats = queue.stats()
+                if drain and not stats.get("queued") and not stats.get("leased"):
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            persona_name = job.persona_data["persona"]["persona_name"]
+            print(f"Worker {worker_id} running job {job.job_id} ({persona_name}, seed={job.seed}, attempt {job.attempt})")
+            heartbeat = None
+
+            def fence() -> bool:
+                try:
+                    return queue.holds(job)
+                except sqlite3.Error as e:
+                    # Unreadable for a moment; the heartbeat stops the session if the lease really lapses
+                    print(f"Lease check for job {job.job_id} failed: {e}")
+                    return not (heartbeat and heartbeat.lost)
+            try:
+                # Setup may fail too (e.g. a database connection); the job must not stay leased
+                sim = Simulation(job.persona_data, use_db=use_db, article=job.article, seed=job.seed,
+                                 fence=fence, **simulation_kwargs)
+                heartbeat = _Heartbeat(queue, job, sim)
+                heartbeat.start()
+                history, recommendation_rating, recommendation_reasoning = sim.run()
+            except SimulationAborted:
+                continue
+            except Exception as e:
+                print(f"Job {job.job_id} failed: {e}")
+                queue.fail(job, str(e))
+                continue
+            finally:
+                if heartbeat:
+                    heartbeat.stop()
+
+            result = {
+                "session_id": sim.user_agent.session_id,
+                "final_rating": sim.user_agent.current_rating,
+                "iterations": len(history),
+                "recommendation_rating": recommendation_rating,
+                "recommendation_reasoning": recommendation_reasoning,
+                "stop_reason": sim.stop_reason
+            }
+            # complete() only applies while this worker still holds the lease, so a job that
+            # expired and was taken over keeps the other worker's result
+            if not heartbeat.lost and queue.complete(job, result):
+                completed += 1
+            else:
+                print(f"Discarding result of job {job.job_id}: lease was lost")
+    finally:
+        if own_sink:
+            own_sink.close()
+            print(f"Wrote {own_sink.rows_written} result rows to {own_sink.path}")
+
+    print(f"Worker {worker_id} finished after completing {completed} jobs")
+    return completed
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Shared job queue for persona simulations")
+    parser.add_argument("--db", default=DEFAULT_QUEUE_PATH, help="Path of the shared SQLite queue file")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    from simulation import add_session_arguments
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Add (persona, article, seed) jobs to the queue")
+    enqueue_parser.add_argument("--personas", default="personas.json", help="Personas JSON file")
+    enqueue_parser.add_argument("--article-file", action="append", default=[],
+                                help="Text file with a seed article (repeatable, default article if omitted)")
+    enqueue_parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+
+    work_parser = subparsers.add_parser("work", help="Run a worker that leases and executes jobs")
+    work_parser.add_argument("--worker-id", default=None)
+    work_parser.add_argument("--poll-interval", type=float, default=5.0)
+    work_parser.add_argument("--drain", action="store_true", help="Exit when the queue is empty")
+    work_parser.add_argument("--max-iterations", type=int, default=10)
+    work_parser.add_argument("--beam-width", type=int, default=1, metavar="N",
+                             help="Editor candidates per round")
+    work_parser.add_argument("--beam-keep", type=int, default=1, metavar="K",
+                             help="Best candidates per round that carry forward into memory in beam mode")
+    # The same session options as the simulation command line; give each worker its own --results file
+    add_session_arguments(work_parser)
+    work_parser.add_argument("--local-db", default=None, metavar="PATH",
+                             help="Write rows to this embedded SQLite database, shared safely by all workers")
+    work_parser.add_argument("--article-store", default=None, metavar="PATH",
+                             help="Store article versions deduplicated across workers in this SQLite file; "
+                                  "rows then hold article hashes")
+
+    subparsers.add_parser("status", help="Show job counts by status")
+    subparsers.add_parser("requeue-expired", help="Return jobs with expired leases to the queue")
+
+    args = parser.parse_args(argv)
+    queue = JobQueue(args.db, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+
+    if args.command == "enqueue":
+        from simulation import load_personas
+        personas = load_personas(args.personas)
+        articles = []
+        for path in args.article_file:
+            with open(path, "r") as f:
+                articles.append(f.read().strip())
+        added = 0
+        for persona_data in personas:
+            for article in articles or [None]:
+                for seed in args.seeds:
+                    if queue.enqueue(persona_data, article, seed):
+                        added += 1
+        print(f"Enqueued {added} new jobs")
+    elif args.command == "work":
+        from config import get_supabase_credentials
+        from result_sinks import open_sink
+        from telemetry import Telemetry
+        from simulation import session_kwargs, open_cache, finish_run
+        use_db = all(get_supabase_credentials())
+        telemetry = Telemetry()
+        if args.metrics_port:
+            telemetry.serve(args.metrics_port)
+        simulation_kwargs = {
+            **session_kwargs(args),
+            "telemetry": telemetry,
+            "max_iterations": args.max_iterations,
+            "beam_width": args.beam_width,
+            "beam_keep": min(args.beam_keep, args.beam_width)
+        }
+        cache = open_cache(args)
+        if cache:
+            simulation_kwargs["cache"] = cache
+        sink = open_sink(args.results) if args.results else None
+        if sink:
+            simulation_kwargs["sink"] = sink
+        local_store = None
+        if args.local_db:
+            from local_store import LocalResponseStore
+            local_store = LocalResponseStore(args.local_db)
+            simulation_kwargs["local_store"] = local_store
+        article_store = None
+        if args.article_store:
+            from article_store import ArticleStore
+            article_store = ArticleStore(args.article_store)
+            simulation_kwargs["article_store"] = article_store
+        try:
+            run_worker(queue, args.worker_id, use_db=use_db, poll_interval=args.poll_interval,
+                       drain=args.drain, **simulation_kwargs)
+        finally:
+            finish_run(cache, None, sink, telemetry, args.metrics_json, local_store=local_store,
+                       article_store=article_store)
+    elif args.command == "requeue-expired":
+        print(f"Re-queued {queue.requeue_expired()} jobs")
+
+    print(json.dumps(queue.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
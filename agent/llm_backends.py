@@ -0,0 +1,433 @@
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from config import get_env
+from structured_output import schema_fields
+
+# Rough characters-per-token ratio used by backends that do not report usage
+CHARS_PER_TOKEN = 4
+# Words per chunk when the offline backend streams a response
+OFFLINE_CHUNK_WORDS = 3
+# Provider-side prompt caching as OpenAI applies it: only prompts of at least this
+# many tokens are cached, and cached prefixes are counted in blocks of this size
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+# Request prefixes the offline backend remembers for its simulated prompt cache
+OFFLINE_PROMPT_CACHE_ENTRIES = 65536
+
+
+@dataclass
+class Completion:
+    """Text and usage returned by a backend for one chat-completion call."""
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    ttfb_seconds: Optional[float] = None
+    retries: int = 0
+    # Prompt tokens served from the provider's prompt cache, part of prompt_tokens
+    cached_tokens: int = 0
+
+
+class CompletionStream:
+    """Iterator over the text chunks of a streamed completion.
+
+    `completion` holds the full text and usage once the stream is exhausted.
+    """
+
+    def __init__(self, chunks: Iterator[str]) -> None:
+        """Wrap a generator that yields text chunks and returns a Completion."""
+        self._chunks = chunks
+        self.completion: Optional[Completion] = None
+
+    def __iter__(self) -> "CompletionStream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._chunks)
+        except StopIteration as stop:
+            if self.completion is None:
+                self.completion = stop.value
+            raise
+
+
+class LLMBackend:
+    """Interface used by Simulation for user, editor and recommendation calls.
+
+    `context` carries what the simulation knows about the call: its role
+    ("user", "editor" or "recommendation"), the persona, the current rating,
+    the current article, the iteration and, for structured-output follow-ups,
+    `reask`. Network backends ignore it.
+    """
+
+    name = "base"
+    # Backends that can only answer acomplete(), which run() and the streamed
+    # and speculative paths of run_async() do not use
+    async_only = False
+
+    def complete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        raise NotImplementedError
+
+    async def acomplete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        """Async variant of complete; runs the sync call in a worker thread unless overridden."""
+        return await asyncio.to_thread(self.complete, model, messages, context, **params)
+
+    def stream(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> CompletionStream:
+        """Stream a completion as text chunks; backends without streaming yield the whole text at once."""
+        def chunks():
+            completion = self.complete(model, messages, context, **params)
+            yield completion.text
+            return completion
+        return CompletionStream(chunks())
+
+
+def _cached_tokens(usage) -> int:
+    """Prompt tokens the API reports as served from its prompt cache."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+
+class OpenAIBackend(LLMBackend):
+    """Chat completions through the OpenAI API. Clients are created on first use."""
+
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str] = None) -> None:
+        self.api_key = api_key
+        self._client = None
+        self._async_client = None
+
+    def _resolve_api_key(self) -> str:
+        api_key = self.api_key or get_env("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "OPENAI_API_KEY not found in environment variables. "
+                "Please make sure you have a .env file with OPENAI_API_KEY=your_key_here "
+                "in the same directory as this script."
+            )
+        return api_key
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self._resolve_api_key())
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=self._resolve_api_key())
+        return self._async_client
+
+    @staticmethod
+    def _to_completion(parsed, ttfb: float, retries: int) -> Completion:
+        usage = getattr(parsed, "usage", None)
+        return Completion(
+            text=parsed.choices[0].message.content,
+            prompt_tokens=(usage.prompt_tokens or 0) if usage else 0,
+            completion_tokens=(usage.completion_tokens or 0) if usage else 0,
+            ttfb_seconds=ttfb,
+            retries=retries,
+            cached_tokens=_cached_tokens(usage)
+        )
+
+    def complete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        started = time.perf_counter()
+        # The streaming-response wrapper returns as soon as headers arrive, which gives us TTFB
+        with self.client.chat.completions.with_streaming_response.create(
+            model=model,
+            messages=messages,
+            **params
+        ) as raw:
+            ttfb = time.perf_counter() - started
+            parsed = raw.parse()
+            retries = raw.retries_taken
+        return self._to_completion(parsed, ttfb, retries)
+
+    async def acomplete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        started = time.perf_counter()
+        async with self.async_client.chat.completions.with_streaming_response.create(
+            model=model,
+            messages=messages,
+            **params
+        ) as raw:
+            ttfb = time.perf_counter() - started
+            parsed = await raw.parse()
+            retries = raw.retries_taken
+        return self._to_completion(parsed, ttfb, retries)
+
+    def stream(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> CompletionStream:
+        def chunks():
+            started = time.perf_counter()
+            raw = self.client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params
+            )
+            retries = raw.retries_taken
+            ttfb = None
+            usage = None
+            parts = []
+            with raw.parse() as events:
+                for event in events:
+                    # With include_usage the last event carries usage and no choices
+                    if event.usage:
+                        usage = event.usage
+                    if not event.choices:
+                        continue
+                    delta = event.choices[0].delta.content
+                    if delta:
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                        parts.append(delta)
+                        yield delta
+            return Completion(
+                text="".join(parts),
+                prompt_tokens=(usage.prompt_tokens or 0) if usage else 0,
+                completion_tokens=(usage.completion_tokens or 0) if usage else 0,
+                ttfb_seconds=ttfb,
+                retries=retries,
+                cached_tokens=_cached_tokens(usage)
+            )
+        return CompletionStream(chunks())
+
+
+# Numeric weight of each trust level found in persona trust_levels values
+TRUST_WEIGHTS = {"very high": 1.0, "high": 0.85, "moderate": 0.5, "medium": 0.5, "low": 0.15, "very low": 0.0}
+
+
+def _trust_weight(level) -> Optional[float]:
+    """Weight of a trust level such as "Moderate (for specific issues)", or None if unrecognized."""
+    text = str(level).lower()
+    # Check longer phrases first so "very low" does not count as "low"
+    for phrase in sorted(TRUST_WEIGHTS, key=len, reverse=True):
+        if phrase in text:
+            return TRUST_WEIGHTS[phrase]
+    return None
+
+
+def trust_score(persona: Dict) -> float:
+    """Average trust of a persona on a 0-1 scale, from its beliefs_attitudes.trust_levels."""
+    levels = persona.get("beliefs_attitudes", {}).get("trust_levels", {})
+    scores = [weight for weight in map(_trust_weight, levels.values()) if weight is not None]
+    return sum(scores) / len(scores) if scores else 0.5
+
+
+def _most_trusted_source(persona: Dict) -> str:
+    levels = persona.get("beliefs_attitudes", {}).get("trust_levels", {})
+    if not levels:
+        return "trusted local health professionals"
+    best = max(levels, key=lambda source: _trust_weight(levels[source]) or 0.0)
+    return best.replace("_", " ")
+
+
+def _unit_hash(*parts) -> float:
+    """Deterministic pseudo-random number in [0, 1) derived from the given values."""
+    digest = hashlib.blake2b("\x1f".join(str(part) for part in parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+class OfflinePersonaBackend(LLMBackend):
+    """A fast, deterministic backend that never touches the network.
+
+    Ratings move from the persona's current rating by an amount driven by its
+    average trust level, with a small jitter derived from a hash of the
+    persona and article, so the same session always produces the same
+    responses. Responses follow the exact REACTION/RATING/REASONING,
+    CHANGES_SUMMARY/ARTICLE and RECOMMENDATION_RATING formats the agents parse,
+    or are JSON objects with the fields of the request's response_format.
+
+    Usage reports cached tokens the way a provider's prompt cache would: the
+    longest run of leading messages sent before with the same model, for
+    prompts of at least PROMPT_CACHE_MIN_TOKENS, in whole blocks.
+    """
+
+    name = "offline"
+
+    def __init__(self, base_step: float = 0.1, trust_step: float = 0.3, jitter: float = 0.15,
+                 chunk_delay: float = 0.0, format_error_rate: float = 0.0) -> None:
+        """Configure how quickly simulated personas move.
+
+        Args:
+            base_step: Rating change per iteration for a persona with no trust
+            trust_step: Extra rating change per iteration at full trust
+            jitter: Maximum deterministic noise added to each change
+            chunk_delay: Seconds to wait per streamed chunk, to simulate generation time
+            format_error_rate: Share of JSON responses that leave out one field, to exercise
+                re-asks; follow-up requests are always answered in full
+        """
+        self.base_step = base_step
+        self.trust_step = trust_step
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.format_error_rate = format_error_rate
+        self._prompt_prefixes: "OrderedDict[int, None]" = OrderedDict()
+        self._prefix_lock = threading.Lock()
+
+    def complete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        completion = self._respond(model, messages, context, params)
+        if self.chunk_delay:
+            time.sleep(self.chunk_delay * len(self._chunks(completion.text)))
+        return completion
+
+    def _respond(self, model: str, messages: List[Dict], context: Optional[Dict], params: Dict) -> Completion:
+        context = context or {}
+        role = context.get("role", "user")
+        persona = context.get("persona", {})
+        if role == "editor":
+            # Unseeded beam candidates still sample different rewrites, as a real model's would
+            seed = params["seed"] if params.get("seed") is not None else context.get("candidate", 0)
+            fields = self._editor_fields(persona, context, seed)
+        elif role == "recommendation":
+            fields = self._recommendation_fields(persona, context)
+        else:
+            fields = self._user_fields(persona, context)
+        requested = schema_fields(params)
+        if requested is None:
+            text = self._format_text(role, fields)
+        else:
+            # A first request (not a follow-up) may lose a field, as a real model's output sometimes does
+            draw = _unit_hash(persona.get("persona_id"), role, context.get("article", ""), context.get("iteration"),
+                              params.get("seed"))
+            if not context.get("reask") and draw < self.format_error_rate:
+                dropped = requested[int(draw / self.format_error_rate * len(requested))]
+                requested = [field for field in requested if field != dropped]
+            text = json.dumps({field: fields[field] for field in requested})
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        return Completion(
+            text=text,
+            prompt_tokens=prompt_chars // CHARS_PER_TOKEN,
+            completion_tokens=len(text) // CHARS_PER_TOKEN,
+            ttfb_seconds=0.0,
+            cached_tokens=self._cached_tokens(model, messages, prompt_chars // CHARS_PER_TOKEN)
+        )
+
+    def _cached_tokens(self, model: str, messages: List[Dict], prompt_tokens: int) -> int:
+        """Remember the request's message prefixes and count the tokens of the longest one seen before."""
+        # Chained built-in hashes: a string caches its own hash, so resent messages cost next to nothing
+        key = hash(model)
+        prefixes = []
+        for message in messages:
+            content = message.get("content") or ""
+            key = hash((key, message["role"], content))
+            prefixes.append((key, len(content)))
+        cached_chars = chars = 0
+        with self._prefix_lock:
+            for key, length in prefixes:
+                chars += length
+                if key in self._prompt_prefixes:
+                    self._prompt_prefixes.move_to_end(key)
+                    cached_chars = chars
+                else:
+                    self._prompt_prefixes[key] = None
+            while len(self._prompt_prefixes) > OFFLINE_PROMPT_CACHE_ENTRIES:
+                self._prompt_prefixes.popitem(last=False)
+        if prompt_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return cached_chars // CHARS_PER_TOKEN // PROMPT_CACHE_BLOCK_TOKENS * PROMPT_CACHE_BLOCK_TOKENS
+
+    async def acomplete(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> Completion:
+        return self.complete(model, messages, context, **params)
+
+    def stream(self, model: str, messages: List[Dict], context: Optional[Dict] = None, **params) -> CompletionStream:
+        """Stream the response a few words at a time, as a network backend would."""
+        def chunks():
+            completion = self._respond(model, messages, context, params)
+            for chunk in self._chunks(completion.text):
+                if self.chunk_delay:
+                    time.sleep(self.chunk_delay)
+                yield chunk
+            return completion
+        return CompletionStream(chunks())
+
+    @staticmethod
+    def _chunks(text: str) -> List[str]:
+        words = text.split(" ")
+        return [" ".join(words[start:start + OFFLINE_CHUNK_WORDS]) + (" " if start + OFFLINE_CHUNK_WORDS < len(words) else "")
+                for start in range(0, len(words), OFFLINE_CHUNK_WORDS)]
+
+    def _next_rating(self, persona: Dict, context: Dict) -> float:
+        current = float(context.get("current_rating", 2.5))
+        noise = (_unit_hash(persona.get("persona_id"), context.get("article", ""), context.get("iteration")) * 2 - 1) * self.jitter
+        change = self.base_step + self.trust_step * trust_score(persona) + noise
+        return round(max(1.0, min(4.0, current + change)), 1)
+
+    @staticmethod
+    def _format_text(role: str, fields: Dict) -> str:
+        """Render response fields in the labelled-section text format of a role."""
+        if role == "editor":
+            return f"CHANGES_SUMMARY: {fields['changes_summary']}\n\nARTICLE: {fields['article']}"
+        if role == "recommendation":
+            return f"RECOMMENDATION_RATING: {fields['recommendation_rating']}\nREASONING: {fields['reasoning']}"
+        return f"REACTION: {fields['reaction']}\nRATING: {fields['rating']}\nREASONING: {fields['reasoning']}"
+
+    def _user_fields(self, persona: Dict, context: Dict) -> Dict:
+        current = float(context.get("current_rating", 2.5))
+        rating = self._next_rating(persona, context)
+        beliefs = persona.get("beliefs_attitudes", {})
+        concerns = beliefs.get("specific_concerns_narratives") or ["the long-term effects"]
+        concern = concerns[int(_unit_hash(persona.get("persona_id"), context.get("iteration")) * len(concerns))]
+        reaction = "Positive" if rating >= current else "Negative"
+        name = persona.get("persona_name", "This persona")
+        return {
+            "reaction": reaction,
+            "rating": rating,
+            "reasoning": (
+                f"As {name}, I read this article through the lens of my own experience. "
+                f"{beliefs.get('key_motivator', 'My main priority is my own health')} shapes how I weigh the claims. "
+                f"I still have questions about {concern.rstrip('.').lower()}. "
+                f"The article's framing {'speaks to' if reaction == 'Positive' else 'does not address'} the sources I trust most. "
+                f"Overall my view has moved from {current} to {rating}."
+            )
+        }
+
+    def _editor_fields(self, persona: Dict, context: Dict, seed: int = 0) -> Dict:
+        article = context.get("article", "")
+        source = _most_trusted_source(persona)
+        beliefs = persona.get("beliefs_attitudes", {})
+        concerns = beliefs.get("specific_concerns_narratives") or ["long-term safety"]
+        # Different seeds address different concerns, so sampled rewrites differ
+        concern = concerns[(int(context.get("iteration", 0)) + seed) % len(concerns)].rstrip(".")
+        addition = f"Information from {source} directly addresses concerns such as {concern.lower()}."
+        return {
+            "changes_summary": (
+                f"Added a passage grounded in {source}, which this reader trusts most. "
+                f"Addressed the concern about {concern.lower()} explicitly."
+            ),
+            "article": f"{article} {addition}"
+        }
+
+    def _recommendation_fields(self, persona: Dict, context: Dict) -> Dict:
+        current = float(context.get("current_rating", 2.5))
+        rating = round(max(1.0, min(4.0, current + (trust_score(persona) - 0.5) * 0.5)), 1)
+        return {
+            "recommendation_rating": rating,
+            "reasoning": (
+                f"Having read these articles, my acceptance rating is {current}/4. "
+                f"My level of trust in the institutions behind the information shapes whether I would pass it on. "
+                f"I would {'encourage' if rating >= 2.5 else 'not push'} friends and family with similar values to get vaccinated."
+            )
+        }
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "offline": OfflinePersonaBackend
+}
+
+
+def create_backend(name: str) -> LLMBackend:
+    """Create a backend by name ("openai" or "offline")."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]()
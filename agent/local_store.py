@@ -0,0 +1,230 @@
+import csv
+import json
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+from write_behind import WriteBehindWriter
+
+# Default location of the embedded results database
+DEFAULT_LOCAL_DB_PATH = "persona_responses.db"
+
+# Columns written per row, matching the hosted table including its misspelled recommened columns
+RESPONSE_COLUMNS = [
+    'session_id', 'iteration', 'persona_id', 'persona_name', 'current_rating',
+    'normalized_current_rating', 'reaction', 'article', 'recommened_rating',
+    'normalized_recommened_rating', 'reason', 'is_fact', 'is_real', 'editor_changes', 'kind', 'parse_error'
+]
+
+# Identifies a row: each iteration of a session logs one "reaction" row and the
+# session ends with one "final" row, so re-logging a row after a resume or a
+# replayed batch is a no-op. The hosted table needs the same key and the parse_error flag:
+#   ALTER TABLE persona_responses_duplicate ADD COLUMN kind text NOT NULL DEFAULT 'reaction';
+#   ALTER TABLE persona_responses_duplicate ADD COLUMN parse_error boolean NOT NULL DEFAULT false;
+#   CREATE UNIQUE INDEX persona_responses_duplicate_row_key
+#       ON persona_responses_duplicate (session_id, iteration, kind);
+RESPONSE_KEY = ('session_id', 'iteration', 'kind')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persona_responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    session_id TEXT NOT NULL,
+    iteration INTEGER NOT NULL CHECK (iteration BETWEEN 1 AND 10),
+    persona_id INTEGER NOT NULL,
+    persona_name TEXT NOT NULL,
+    current_rating REAL NOT NULL,
+    normalized_current_rating REAL NOT NULL,
+    reaction TEXT NOT NULL CHECK (reaction IN ('Positive', 'Negative')),
+    article TEXT NOT NULL DEFAULT '',
+    recommened_rating REAL,
+    normalized_recommened_rating REAL,
+    reason TEXT NOT NULL DEFAULT '',
+    is_fact INTEGER NOT NULL DEFAULT 1,
+    is_real INTEGER NOT NULL DEFAULT 1,
+    editor_changes TEXT NOT NULL DEFAULT '',
+    kind TEXT NOT NULL DEFAULT 'reaction' CHECK (kind IN ('reaction', 'final')),
+    parse_error INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_persona_responses_session_id ON persona_responses (session_id);
+CREATE INDEX IF NOT EXISTS idx_persona_responses_persona_id ON persona_responses (persona_id);
+CREATE INDEX IF NOT EXISTS idx_persona_responses_iteration ON persona_responses (iteration);
+"""
+
+ROW_KEY_INDEX = (
+    f"CREATE UNIQUE INDEX IF NOT EXISTS idx_persona_responses_row_key ON persona_responses ({', '.join(RESPONSE_KEY)})"
+)
+
+# Rows already stored are skipped; CHECK and NOT NULL violations still fail the batch
+_INSERT = (
+    f"INSERT INTO persona_responses ({', '.join(RESPONSE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in RESPONSE_COLUMNS)}) "
+    f"ON CONFLICT ({', '.join(RESPONSE_KEY)}) DO NOTHING"
+)
+
+
+def _to_flag(value) -> int:
+    """Store booleans as 0/1, accepting the "True"/"False" strings found in CSV exports."""
+    if isinstance(value, str):
+        return int(value.strip().lower() in ("true", "t", "1", "yes"))
+    return int(bool(value))
+
+
+def _to_number(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+class LocalResponseStore:
+    """An embedded SQLite database with the same `persona_responses` schema as Supabase.
+
+    Rows submitted by a run are buffered by a write-behind writer and inserted
+    in batches, one transaction each, so simulations never wait on disk I/O.
+    The file is in WAL mode and batches take the write lock with BEGIN
+    IMMEDIATE, so several worker processes can write to the same database
+    while others read it.
+    """
+
+    def __init__(self, path: str = DEFAULT_LOCAL_DB_PATH, batch_size: int = 200,
+                 flush_interval: float = 1.0) -> None:
+        """Open (and create if needed) the database and start the background writer.
+
+        Args:
+            path: Path of the SQLite database file
+            batch_size: Number of buffered rows that triggers an insert
+            flush_interval: Maximum seconds a row waits in the buffer
+        """
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        self._writer = WriteBehindWriter(self.insert_batch, batch_size=batch_size, flush_interval=flush_interval,
+                                         spill_path=f"{path}.spill.jsonl")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """Add the columns and row key a database created by an older version lacks."""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(persona_responses)")]
+        if 'parse_error' not in columns:
+            # Older rows only mark failures in their text columns
+            conn.execute("ALTER TABLE persona_responses ADD COLUMN parse_error INTEGER NOT NULL DEFAULT 0")
+        if 'kind' not in columns:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("ALTER TABLE persona_responses ADD COLUMN kind TEXT NOT NULL DEFAULT 'reaction' "
+                         "CHECK (kind IN ('reaction', 'final'))")
+            # Only the final row of a simulated session carries a recommendation
+            conn.execute("UPDATE persona_responses SET kind = 'final' WHERE recommened_rating IS NOT NULL")
+            # Keep the first copy of rows an earlier resume logged twice
+            conn.execute(f"DELETE FROM persona_responses WHERE id NOT IN "
+                         f"(SELECT min(id) FROM persona_responses GROUP BY {', '.join(RESPONSE_KEY)})")
+            conn.execute("COMMIT")
+        conn.execute(ROW_KEY_INDEX)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Write statistics of the background writer."""
+        return self._writer.stats
+
+    def insert_batch(self, rows: List[Dict]) -> None:
+        """Insert rows in a single transaction, skipping rows whose key is already stored."""
+        values = [
+            (
+                row['session_id'], int(row['iteration']), int(row['persona_id']), row['persona_name'],
+                float(row['current_rating']), float(row['normalized_current_rating']), row['reaction'],
+                row.get('article') or "", _to_number(row.get('recommened_rating')),
+                _to_number(row.get('normalized_recommened_rating')), row.get('reason') or "",
+                _to_flag(row.get('is_fact', True)), _to_flag(row.get('is_real', True)),
+                row.get('editor_changes') or "", row.get('kind') or "reaction",
+                _to_flag(row.get('parse_error', False))
+            )
+            for row in rows
+        ]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(_INSERT, values)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def submit(self, row: Dict) -> None:
+        """Queue a row for a batched insert without blocking."""
+        self._writer.submit(row)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted row has been written."""
+        return self._writer.flush(timeout)
+
+    def close(self) -> None:
+        """Write out the remaining rows and stop the background writer."""
+        self._writer.close()
+
+    def query(self, sql: str, params: Sequence = ()) -> List[Dict]:
+        """Run a read query and return the rows as dictionaries."""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def session_rows(self, session_id: str) -> List[Dict]:
+        """All rows of one session in iteration order."""
+        return self.query("SELECT * FROM persona_responses WHERE session_id = ? ORDER BY iteration, id", (session_id,))
+
+    def import_csv(self, path: str, batch_size: int = 5000) -> int:
+        """Load a CSV in the persona_responses layout, such as generated synthetic data.
+
+        Returns:
+            The number of rows imported
+        """
+        imported = 0
+        with open(path, newline='') as f:
+            batch = []
+            for row in csv.DictReader(f):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self.insert_batch(batch)
+                    imported += len(batch)
+                    batch = []
+            if batch:
+                self.insert_batch(batch)
+                imported += len(batch)
+        return imported
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Embedded persona_responses database for local runs")
+    parser.add_argument("--db", default=DEFAULT_LOCAL_DB_PATH, help="Path of the SQLite database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Load persona_responses CSV files")
+    import_parser.add_argument("files", nargs="+")
+
+    query_parser = subparsers.add_parser("query", help="Run a SQL query and print the rows as JSON lines")
+    query_parser.add_argument("sql")
+
+    args = parser.parse_args(argv)
+    store = LocalResponseStore(args.db)
+    try:
+        if args.command == "import":
+            for path in args.files:
+                print(f"Imported {store.import_csv(path)} rows from {path}")
+        elif args.command == "query":
+            for row in store.query(args.sql):
+                print(json.dumps(row))
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
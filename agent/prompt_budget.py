@@ -0,0 +1,117 @@
+import re
+import json
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List
+
+# Tokenizer used when tiktoken is available
+DEFAULT_ENCODING = "o200k_base"
+# Average characters per token, used when no tokenizer can be loaded
+APPROX_CHARS_PER_TOKEN = 4
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(])')
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Common words ignored when scoring sentences for extractive summaries
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "been", "but", "by", "can", "for", "from", "has",
+    "have", "in", "is", "it", "its", "may", "more", "of", "on", "or", "that", "the", "their",
+    "this", "to", "was", "were", "which", "will", "with"
+}
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    """Load the local tokenizer once, or return None if tiktoken is unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the local tokenizer, falling back to a character estimate."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most `max_tokens` tokens, marking the cut with an ellipsis."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is None:
+        cut = text[:max_tokens * APPROX_CHARS_PER_TOKEN]
+    else:
+        cut = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    # Prefer ending on a word boundary
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + "..."
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences on terminal punctuation."""
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text.strip()) if sentence.strip()]
+
+
+def extractive_summary(text: str, max_tokens: int) -> str:
+    """Shorten text to a token budget by keeping its most informative sentences.
+
+    Sentences are scored by the frequency of their content words across the
+    whole text; the first sentence gets a bonus since news articles lead with
+    the key claim. Selected sentences keep their original order. Falls back to
+    truncation when not even one sentence fits.
+
+    Args:
+        text: Text to summarize
+        max_tokens: Maximum tokens of the summary
+
+    Returns:
+        The summary, or the original text if it already fits
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    sentences = split_sentences(text)
+    frequencies = Counter(word for word in _WORD.findall(text.lower()) if word not in STOPWORDS)
+    scored = []
+    for index, sentence in enumerate(sentences):
+        words = [word for word in _WORD.findall(sentence.lower()) if word not in STOPWORDS]
+        score = sum(frequencies[word] for word in words) / (len(words) or 1)
+        if index == 0:
+            score *= 1.5
+        scored.append((score, index, count_tokens(sentence)))
+
+    selected = []
+    used = 0
+    for score, index, tokens in sorted(scored, key=lambda item: (-item[0], item[1])):
+        if used + tokens <= max_tokens:
+            selected.append(index)
+            used += tokens
+
+    if not selected:
+        return truncate_to_tokens(text, max_tokens)
+    return " ".join(sentences[index] for index in sorted(selected))
+
+
+def _drop_empty(value):
+    if isinstance(value, dict):
+        return {key: _drop_empty(item) for key, item in value.items() if item not in ("", None, [], {})}
+    if isinstance(value, list):
+        return [_drop_empty(item) for item in value if item not in ("", None, [], {})]
+    return value
+
+
+def minify_persona(persona: Dict) -> str:
+    """Render a persona as minified JSON without empty fields."""
+    return json.dumps(_drop_empty(persona), separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from typing import Optional
+
+# Rough characters-per-token ratio used to estimate prompt size before a call
+CHARS_PER_TOKEN = 4
+# Completion tokens reserved per call until the real usage is known
+DEFAULT_COMPLETION_TOKENS = 500
+
+
+def estimate_tokens(prompt: str, completion_tokens: int = DEFAULT_COMPLETION_TOKENS) -> int:
+    """Estimate the tokens a chat completion will consume.
+
+    Args:
+        prompt: The prompt text that will be sent
+        completion_tokens: Tokens reserved for the completion
+
+    Returns:
+        The estimated total token count for the call
+    """
+    return len(prompt) // CHARS_PER_TOKEN + completion_tokens
+
+
+class RateLimiter:
+    """Async token-bucket limiter for requests-per-minute and tokens-per-minute quotas."""
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None) -> None:
+        """Initialize the limiter with per-minute quotas.
+
+        Args:
+            requests_per_minute: Maximum requests per minute, or None for no limit
+            tokens_per_minute: Maximum tokens per minute, or None for no limit
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """Top up both buckets for the time elapsed since the last refill."""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute,
+                self._request_allowance + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute,
+                self._token_allowance + elapsed * self.tokens_per_minute / 60
+            )
+
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until both buckets can cover one request of the given size."""
+        wait = 0.0
+        if self.requests_per_minute and self._request_allowance < 1:
+            wait = max(wait, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_allowance < tokens:
+            wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens: int) -> int:
+        """Wait until a request of the given token size fits within both quotas.
+
+        The lock is held while waiting so callers are admitted in arrival order.
+
+        Args:
+            tokens: Estimated tokens the request will consume
+
+        Returns:
+            The number of tokens actually reserved for the request
+        """
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket would never fit
+            tokens = min(tokens, self.tokens_per_minute)
+
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self._request_allowance -= 1
+            if self.tokens_per_minute:
+                self._token_allowance -= tokens
+        return tokens
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Correct the token bucket once the real usage of a call is known.
+
+        Args:
+            estimated_tokens: Tokens reserved by acquire() for the request
+            actual_tokens: Tokens reported by the API, or None if unavailable
+        """
+        if not self.tokens_per_minute or actual_tokens is None:
+            return
+        self._token_allowance = min(
+            self.tokens_per_minute,
+            self._token_allowance + estimated_tokens - actual_tokens
+        )
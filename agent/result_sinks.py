@@ -0,0 +1,205 @@
+import os
+import csv
+import threading
+from typing import Dict, List, Optional
+
+# Columns of a simulation result row, in the order they are written
+RESULT_COLUMNS = [
+    'session_id', 'iteration', 'persona_id', 'persona_name', 'current_rating',
+    'normalized_current_rating', 'reaction', 'article', 'recommendation_rating',
+    'normalized_recommendation_rating', 'recommendation_reasoning', 'stop_reason', 'stopping_policy'
+]
+
+# Low-cardinality or heavily repeated columns stored dictionary-encoded in Arrow/Parquet
+DICTIONARY_COLUMNS = ['session_id', 'persona_id', 'persona_name', 'reaction', 'article', 'stop_reason',
+                      'stopping_policy']
+
+
+class ResultSink:
+    """Destination for simulation result rows shared by every session of a run.
+
+    Sinks are thread-safe so concurrent sessions can write to the same one.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.rows_written = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def write(self, row: Dict) -> None:
+        """Append one result row."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Result sink {self.path} is closed")
+            self._write(row)
+            self.rows_written += 1
+
+    def close(self) -> None:
+        """Flush buffered rows and release the underlying file."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._close()
+
+    def _write(self, row: Dict) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CsvSink(ResultSink):
+    """Writes rows through a single buffered CSV writer kept open for the whole run."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(RESULT_COLUMNS)
+
+    def _write(self, row: Dict) -> None:
+        self._writer.writerow(["" if row.get(column) is None else row.get(column) for column in RESULT_COLUMNS])
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class ArrowSink(ResultSink):
+    """Writes rows as Parquet row groups or Arrow IPC record batches.
+
+    Rows are buffered and written `row_group_size` at a time. Session, persona,
+    reaction and article columns are dictionary-encoded so the full article
+    text repeated on every iteration row is stored once. The Arrow IPC file
+    format (`.arrow`) can be memory-mapped by readers for zero-copy access.
+    """
+
+    def __init__(self, path: str, file_format: str = "parquet", row_group_size: int = 1000) -> None:
+        """Open the output file.
+
+        Args:
+            path: Output file path
+            file_format: Either "parquet" or "arrow"
+            row_group_size: Rows buffered before a row group / record batch is written
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("pyarrow is required for Parquet/Arrow result sinks: pip install pyarrow") from e
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError(f"Unknown result file format: {file_format}")
+
+        super().__init__(path)
+        self._pa = pa
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self._buffer: List[Dict] = []
+        self.schema = pa.schema([
+            ('session_id', pa.dictionary(pa.int32(), pa.string())),
+            ('iteration', pa.int32()),
+            ('persona_id', pa.dictionary(pa.int32(), pa.string())),
+            ('persona_name', pa.dictionary(pa.int32(), pa.string())),
+            ('current_rating', pa.float64()),
+            ('normalized_current_rating', pa.float64()),
+            ('reaction', pa.dictionary(pa.int32(), pa.string())),
+            ('article', pa.dictionary(pa.int32(), pa.string())),
+            ('recommendation_rating', pa.float64()),
+            ('normalized_recommendation_rating', pa.float64()),
+            ('recommendation_reasoning', pa.string()),
+            ('stop_reason', pa.dictionary(pa.int32(), pa.string())),
+            ('stopping_policy', pa.dictionary(pa.int32(), pa.string())),
+        ])
+        # Arrow IPC files allow dictionaries to grow between batches but not to be replaced,
+        # so each dictionary column keeps one append-only dictionary for the whole file
+        self._dictionaries: Dict[str, Dict[str, int]] = {column: {} for column in DICTIONARY_COLUMNS}
+
+        if file_format == "parquet":
+            self._writer = pq.ParquetWriter(path, self.schema, use_dictionary=DICTIONARY_COLUMNS, compression="zstd")
+        else:
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = pa.ipc.new_file(
+                self._sink, self.schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            )
+
+    def _write(self, row: Dict) -> None:
+        self._buffer.append(row)
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _dictionary_array(self, column: str, values: List[Optional[str]]):
+        pa = self._pa
+        dictionary = self._dictionaries[column]
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            index = dictionary.get(value)
+            if index is None:
+                index = dictionary[value] = len(dictionary)
+            indices.append(index)
+        # Dicts keep insertion order, which is also index order
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, pa.int32()), pa.array(list(dictionary), pa.string())
+        )
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        pa = self._pa
+        arrays = []
+        for field in self.schema:
+            values = [row.get(field.name) for row in self._buffer]
+            if field.name in self._dictionaries:
+                values = [None if v is None else str(v) for v in values]
+                if self.file_format == "parquet":
+                    # Parquet stores a dictionary per row group, so a per-batch one is enough
+                    arrays.append(pa.array(values, pa.string()).dictionary_encode().cast(field.type))
+                else:
+                    arrays.append(self._dictionary_array(field.name, values))
+            else:
+                arrays.append(pa.array(values, field.type))
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self._buffer = []
+
+    def _close(self) -> None:
+        self._flush()
+        self._writer.close()
+        if self.file_format == "arrow":
+            self._sink.close()
+
+
+def open_sink(path: str, row_group_size: int = 1000) -> ResultSink:
+    """Open a result sink, choosing the format from the file extension.
+
+    `.parquet` writes Parquet, `.arrow`/`.feather` writes an Arrow IPC file and
+    anything else writes CSV.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return ArrowSink(path, "parquet", row_group_size)
+    if extension in (".arrow", ".feather"):
+        return ArrowSink(path, "arrow", row_group_size)
+    return CsvSink(path)
+
+
+def read_results(path: str):
+    """Load a Parquet or Arrow result file as a pyarrow Table.
+
+    Arrow IPC files are memory-mapped, so columns are read without copying.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".arrow", ".feather"):
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return pq.read_table(path, memory_map=True)
@@ -1,56 +1,130 @@
 import os
 import json
-import csv
+import argparse
+import time
+import asyncio
 import uuid
-import difflib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Tuple, Optional, List
-from openai import OpenAI
-from dotenv import load_dotenv
-from supabase import create_client, Client
-
-# Load environment variables
-load_dotenv()
-
-# Debug: Print the current working directory and check if .env exists
-print(f"Current working directory: {os.getcwd()}")
-print(f".env file exists: {os.path.exists('.env')}")
-
-# Debug: Check if Supabase environment variables exist (redacting actual values)
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-print(f"SUPABASE_URL exists: {supabase_url is not None}")
-print(f"SUPABASE_KEY exists: {supabase_key is not None}")
-if supabase_url and supabase_key:
-    print(f"Supabase URL format looks valid: {'http' in supabase_url.lower()}")
-    print(f"Supabase key length: {len(supabase_key)}")
-
-# Get API key and validate
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError(
-        "OPENAI_API_KEY not found in environment variables. "
-        "Please make sure you have a .env file with OPENAI_API_KEY=your_key_here "
-        "in the same directory as this script."
-    )
+from typing import Callable, Dict, Tuple, Optional, List, Sequence
+from rate_limiter import RateLimiter, estimate_tokens, CHARS_PER_TOKEN, DEFAULT_COMPLETION_TOKENS
+from completion_cache import CompletionCache
+from write_behind import WriteBehindWriter, supabase_inserter
+from result_sinks import ResultSink, CsvSink, open_sink
+from prompt_budget import count_tokens, extractive_summary, minify_persona
+from telemetry import Telemetry, CallRecord
+from config import get_supabase_credentials, create_supabase_client, print_environment_diagnostics
+from llm_backends import LLMBackend, OpenAIBackend, Completion, BACKENDS, create_backend
+from stream_parser import ReactionStreamParser
+from checkpoint import CheckpointJournal, DEFAULT_CHECKPOINT_PATH, session_key_for
+from local_store import LocalResponseStore, RESPONSE_KEY
+from text_diff import TextDiff, diff_texts
+from article_store import ArticleStore, article_hash
+from budget import BudgetGovernor, GROWTH_MARGIN, call_cost
+from stopping import StoppingPolicy, parse_policy, describe_policies, first_stop
+from structured_output import OUTPUT_FORMATS, response_format, format_instructions, reask_prompt, parse_fields, to_json
+
+# Table that simulation results are written to
+SUPABASE_TABLE = "persona_responses_duplicate"
+
+# Backend used when a Simulation is not given one; the OpenAI client is created on first call
+default_backend = OpenAIBackend()
+
+# Models used for each kind of call
+USER_MODEL = "gpt-4o-mini"
+EDITOR_MODEL = "gpt-4o-mini"
+RECOMMENDATION_MODEL = "gpt-4"
+
+# Prompt formats an Agent can render
+PROMPT_MODES = ("full", "compact")
+# How prompts are laid out as chat messages: each call as one fresh message, or a
+# system prefix that never changes during a session followed by the session's
+# conversation, so that only each call's new content is appended
+PROMPT_LAYOUTS = ("single", "conversation")
+# Default prompt token budget in compact mode
+DEFAULT_TOKEN_BUDGET = 1500
+# Follow-up calls per response asking for the fields it lacked in structured-output mode
+DEFAULT_MAX_REASKS = 1
+
+# Task descriptions shared by both prompt layouts
+USER_TASK = """Take on the persona provided in the JSON object and react to a new news article related to COVID-19. This involves reading and analyzing the article, then formulating a response based on the persona's traits and prior beliefs, especially regarding vaccinations.
+
+You will receive:
+1. A JSON object detailing a persona.
+2. A set of articles already in the persona's knowledge base. 
+3. A new article for analysis.
+
+Your task is to:
+- Read the provided news article carefully.
+- Based on the persona's details, react either positively or negatively to the article.
+- Update the persona's vaccination acceptance score accordingly.
+- Provide a detailed reasoning for your reaction (5-10 sentences within 1 paragraph), considering the persona's educational background, personality traits, socioeconomic status, marital status, prior beliefs/experiences, and vaccination acceptance score."""
+EDITOR_TASK = "Improve the article by reacting to a user's response to an article by incorporating details from the user persona and the article to create an enhanced version that achieves a higher score."
+EDITOR_STEPS = """Your task is to:
+1. Understand the User Persona: Focus on {persona_name}'s perspective on vaccines, concerns, trusted sources, and core values.
+2. Analyze the Existing Response: The current article hasn't resonated well with the user.
+3. Extract Key Points from the Article: Keep factual information but present it differently.
+4. Reformulate the Response: Rewrite the article to better appeal to this user, considering their specific trust levels, concerns, and values.
+5. Ensure Consistency and Coherence: The article should still be factual but framed to better align with their worldview and information preferences."""
+RECOMMENDATION_TASK = """Take on the persona provided in the JSON object and determine how likely you would be to recommend COVID-19 vaccination to friends and family with similar backgrounds and values.
 
-# Supabase connection parameters from environment variables
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
+Based on all the articles you've read and your persona's evolution throughout this experience, provide a recommendation rating."""
+RECOMMENDATION_SCALE = """Where on the scale from 1 to 4:
+1 = Would strongly advise against vaccination
+2 = Would probably not recommend vaccination
+3 = Would cautiously recommend vaccination
+4 = Would strongly recommend vaccination
+"""
 
-# Initialize OpenAI client
-client = OpenAI(api_key=api_key)
+# Reply format sections of the prompts in the labelled-section text format
+TEXT_FORMAT_INSTRUCTIONS = {
+    "user": """Format your response EXACTLY as follows:
+REACTION: [Positive/Negative]
+RATING: [number between 1 and 4]
+REASONING: [5-10 sentences explaining your reaction based on your persona]""",
+    "editor": """Return TWO distinct sections as follows:
+
+CHANGES_SUMMARY: [A brief 2-3 sentence summary of what specific changes you are making to the article and why]
+
+ARTICLE: [The full improved article text]""",
+    "recommendation": """Format your response EXACTLY as follows:
+RECOMMENDATION_RATING: [number between 1 and 4]
+REASONING: [5-10 sentences explaining your recommendation likelihood based on your persona]"""
+}
+# Earlier replies replayed in the conversation layout, in the labelled-section text format
+TEXT_REPLY_FORMATS = {
+    "user": "REACTION: {reaction}\nRATING: {rating}\nREASONING: {reasoning}",
+    "editor": "CHANGES_SUMMARY: {changes_summary}\n\nARTICLE: {article}"
+}
 
 class Agent:
     """A class representing an agent that can interact with articles and provide feedback."""
 
-    def __init__(self, persona_data: Dict, role: str) -> None:
+    def __init__(self, persona_data: Dict, role: str, prompt_mode: str = "full", token_budget: Optional[int] = None,
+                 article_store: Optional[ArticleStore] = None, output_format: str = "text",
+                 prompt_layout: str = "single") -> None:
         """Initialize the Agent with persona data and role.
 
         Args:
             persona_data: Dictionary containing persona information
             role: Either "user" or "editor"
+            prompt_mode: "full" for the original prompt format, "compact" for token-lean prompts
+            token_budget: Maximum prompt tokens in compact mode (DEFAULT_TOKEN_BUDGET if omitted)
+            article_store: Store that memory articles are kept in, memory holding only their hashes
+            output_format: "text" for labelled sections, "json" for a JSON object per response
+            prompt_layout: "single" for one fresh message per call, "conversation" for a stable
+                system prefix followed by the session's earlier exchanges
         """
+        if prompt_mode not in PROMPT_MODES:
+            raise ValueError(f"prompt_mode must be one of {PROMPT_MODES}, got {prompt_mode!r}")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}")
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"prompt_layout must be one of {PROMPT_LAYOUTS}, got {prompt_layout!r}")
+        if prompt_layout == "conversation" and prompt_mode == "compact":
+            # Earlier turns must be replayed byte for byte, so there is no context to trim
+            raise ValueError("the conversation prompt layout cannot be combined with compact prompts")
         # Extract persona from the new format
         self.persona = persona_data["persona"]
         self.articles_read = persona_data.get("articles_read", [])
@@ -71,10 +145,94 @@ class Agent:
             self.current_rating = stance_map.get(initial_stance, 2.5)
         else:
             self.current_rating = float(initial_stance)
+        self.initial_rating = self.current_rating
             
         self.history: List[Tuple[str, str, float]] = []
         self.memory: List[Tuple[str, Optional[str], Optional[float]]] = []  # Store previous interactions
+        self.article_store = article_store
         self.recommendation_rating: Optional[float] = None
+        
+        self.prompt_mode = prompt_mode
+        self.output_format = output_format
+        self.prompt_layout = prompt_layout
+        # Finished exchanges of the conversation layout as (prompt, reply) pairs
+        self.turns: List[Tuple[str, str]] = []
+        self.token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+        # The persona never changes during a session, so render it once
+        self._persona_json = json.dumps(self.persona, indent=2)
+        self._persona_compact = minify_persona(self.persona)
+        self.last_prompt_stats: Optional[Dict] = None
+        self.prompt_tokens_saved = 0
+        # Whether the last processed response fell back to the error default
+        self.last_parse_failed = False
+
+    def _persona_text(self, compact: bool) -> str:
+        return self._persona_compact if compact else self._persona_json
+
+    def _format_instructions(self, kind: str) -> str:
+        """The prompt section describing the reply format of a kind of response."""
+        if self.output_format == "json":
+            return format_instructions(kind)
+        return TEXT_FORMAT_INSTRUCTIONS[kind]
+
+    def _editor_steps(self) -> str:
+        return EDITOR_STEPS.format(persona_name=self.persona["persona_name"])
+
+    def _context_article(self, text: str, context_tokens: Optional[int]) -> str:
+        """Render a memory or knowledge-base article, shortened when a token allowance is given."""
+        if context_tokens is None:
+            return text
+        return extractive_summary(text, context_tokens)
+
+    def recent_memory(self, count: int = 3) -> List[Tuple[str, Optional[str], Optional[float]]]:
+        """The last `count` memory entries, with article hashes resolved to full text."""
+        entries = self.memory[-count:]
+        if self.article_store is None:
+            return entries
+        return [(self.article_store.get(article), reaction, rating) for article, reaction, rating in entries]
+
+    def _build_prompt(self, render, context_items: int) -> str:
+        """Render a prompt in the agent's prompt mode.
+
+        In compact mode the memory and knowledge-base articles share whatever
+        the token budget leaves after the fixed parts of the prompt, and the
+        savings against the full format are recorded in `last_prompt_stats`.
+        The persona, instructions and the article under review are never cut,
+        so a budget smaller than those leaves the context articles empty.
+
+        Args:
+            render: Function (compact, context_tokens) -> prompt text
+            context_items: Number of memory/knowledge-base articles in the prompt
+
+        Returns:
+            The prompt text
+        """
+        if self.prompt_mode == "full":
+            return render(False, None)
+
+        full_tokens = count_tokens(render(False, None))
+        context_tokens = None
+        prompt = render(True, None)
+        prompt_tokens = count_tokens(prompt)
+        if prompt_tokens > self.token_budget and context_items:
+            fixed_tokens = count_tokens(render(True, 0))
+            context_tokens = max(0, (self.token_budget - fixed_tokens) // context_items)
+            prompt = render(True, context_tokens)
+            prompt_tokens = count_tokens(prompt)
+            # Labels and sentence boundaries can overshoot slightly; shrink once more if so
+            overflow = prompt_tokens - self.token_budget
+            if overflow > 0 and context_tokens:
+                context_tokens = max(0, context_tokens - -(-overflow // context_items))
+                prompt = render(True, context_tokens)
+                prompt_tokens = count_tokens(prompt)
+
+        self.last_prompt_stats = {
+            "prompt_tokens": prompt_tokens,
+            "full_prompt_tokens": full_tokens,
+            "tokens_saved": full_tokens - prompt_tokens
+        }
+        self.prompt_tokens_saved += full_tokens - prompt_tokens
+        return prompt
 
     def get_prompt(self, article: Optional[str] = None) -> str:
         """Generate a prompt for the agent based on its role and the article.
@@ -85,39 +243,35 @@ class Agent:
         Returns:
             A formatted prompt string
         """
+        if self.role == "user":
+            context_items = len(self.memory[-3:]) + len(self.articles_read[:2])
+        else:
+            context_items = len(self.memory[-3:])
+        return self._build_prompt(lambda compact, context_tokens: self._render_prompt(article, compact, context_tokens), context_items)
+
+    def _render_prompt(self, article: Optional[str], compact: bool, context_tokens: Optional[int]) -> str:
         if self.role == "user":
             # Create memory context
             memory_context = ""
             if self.memory:
                 memory_context = "\nPrevious interactions:\n"
-                for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.memory[-3:], 1):
-                    memory_context += f"\nInteraction {i}:\nArticle: {prev_article}\nReaction: {prev_reaction}\nRating: {prev_rating}\n"
+                for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.recent_memory(), 1):
+                    memory_context += f"\nInteraction {i}:\nArticle: {self._context_article(prev_article, context_tokens)}\nReaction: {prev_reaction}\nRating: {prev_rating}\n"
 
             # Add previously read articles context
             articles_context = ""
             if self.articles_read:
                 articles_context = "\nArticles already in persona's knowledge base:\n"
                 for i, article_info in enumerate(self.articles_read[:2], 1):  # Limit to first 2 articles
-                    articles_context += f"\nArticle {i}: {article_info['article']}\n"
-
-            return f"""Take on the persona provided in the JSON object and react to a new news article related to COVID-19. This involves reading and analyzing the article, then formulating a response based on the persona's traits and prior beliefs, especially regarding vaccinations.
+                    articles_context += f"\nArticle {i}: {self._context_article(article_info['article'], context_tokens)}\n"
 
-You will receive:
-1. A JSON object detailing a persona.
-2. A set of articles already in the persona's knowledge base. 
-3. A new article for analysis.
-
-Your task is to:
-- Read the provided news article carefully.
-- Based on the persona's details, react either positively or negatively to the article.
-- Update the persona's vaccination acceptance score accordingly.
-- Provide a detailed reasoning for your reaction (5-10 sentences within 1 paragraph), considering the persona's educational background, personality traits, socioeconomic status, marital status, prior beliefs/experiences, and vaccination acceptance score.
+            return f"""{USER_TASK}
 
 Current Session ID: {self.session_id}
 Current Rating: {self.current_rating}/4
 
 Your persona details:
-{json.dumps(self.persona, indent=2)}
+{self._persona_text(compact)}
 {articles_context}
 {memory_context}
 
@@ -126,45 +280,124 @@ Please read the following article and provide your reaction:
 Article:
 {article}
 
-Format your response EXACTLY as follows:
-REACTION: [Positive/Negative]
-RATING: [number between 1 and 4]
-REASONING: [5-10 sentences explaining your reaction based on your persona]"""
+{self._format_instructions('user')}"""
 
         else:  # editor
             # Create memory context for editor
             memory_context = ""
             if self.memory:
                 memory_context = "\nPrevious article versions and user reactions:\n"
-                for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.memory[-3:], 1):
-                    memory_context += f"\nVersion {i}:\nArticle: {prev_article}\nUser Reaction: {prev_reaction}\nRating: {prev_rating}\n"
+                for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.recent_memory(), 1):
+                    memory_context += f"\nVersion {i}:\nArticle: {self._context_article(prev_article, context_tokens)}\nUser Reaction: {prev_reaction}\nRating: {prev_rating}\n"
 
-            return f"""Improve the article by reacting to a user's response to an article by incorporating details from the user persona and the article to create an enhanced version that achieves a higher score.
+            return f"""{EDITOR_TASK}
 
 Current Session ID: {self.session_id}
 Current User Rating: {self.current_rating}/4
 
 User Persona:
-{json.dumps(self.persona, indent=2)}
+{self._persona_text(compact)}
 {memory_context}
 
 Previous article:
 {article}
 
-Your task is to:
-1. Understand the User Persona: Focus on {self.persona["persona_name"]}'s perspective on vaccines, concerns, trusted sources, and core values.
-2. Analyze the Existing Response: The current article hasn't resonated well with the user.
-3. Extract Key Points from the Article: Keep factual information but present it differently.
-4. Reformulate the Response: Rewrite the article to better appeal to this user, considering their specific trust levels, concerns, and values.
-5. Ensure Consistency and Coherence: The article should still be factual but framed to better align with their worldview and information preferences.
+{self._editor_steps()}
 
-Return TWO distinct sections as follows:
+{self._format_instructions('editor')}
 
-CHANGES_SUMMARY: [A brief 2-3 sentence summary of what specific changes you are making to the article and why]
+The goal is to increase the user's vaccine acceptance rating above their current level of {self.current_rating}/4."""
 
-ARTICLE: [The full improved article text]
+    def get_messages(self, article: Optional[str] = None) -> List[Dict]:
+        """The chat messages of a call about `article` in the agent's prompt layout.
 
-The goal is to increase the user's vaccine acceptance rating above their current level of {self.current_rating}/4."""
+        The single layout sends get_prompt() as one user message. The
+        conversation layout sends the system prefix, every finished exchange
+        of the session in order, and a new user turn holding only the article
+        (and, for the editor, the latest reaction), so each call's messages
+        begin with the whole of the previous call's.
+        """
+        if self.prompt_layout == "single":
+            return [{"role": "user", "content": self.get_prompt(article)}]
+        messages = [{"role": "system", "content": self.system_prompt()}]
+        for prompt, reply in self.turns:
+            messages.append({"role": "user", "content": prompt})
+            messages.append({"role": "assistant", "content": reply})
+        messages.append({"role": "user", "content": self._render_turn(article)})
+        return messages
+
+    def system_prompt(self) -> str:
+        """The instructions, persona and reply format of the conversation layout.
+
+        Nothing in it changes during a session, or between sessions of the
+        same persona, so provider-side prompt caching can reuse it.
+        """
+        if self.role == "user":
+            articles_context = ""
+            if self.articles_read:
+                articles_context = "\nArticles already in persona's knowledge base:\n"
+                for i, article_info in enumerate(self.articles_read[:2], 1):  # Limit to first 2 articles
+                    articles_context += f"\nArticle {i}: {article_info['article']}\n"
+
+            return f"""{USER_TASK}
+
+Each new article arrives in its own message. Your earlier replies in this conversation are the persona's reactions to the previous articles.
+
+Initial Rating: {self.initial_rating}/4
+
+Your persona details:
+{self._persona_json}
+{articles_context}
+{self._format_instructions('user')}"""
+
+        return f"""{EDITOR_TASK}
+
+Each message gives you the article to improve and how the user reacted to your previous version. Your earlier replies in this conversation are your previous versions.
+
+User Persona:
+{self._persona_json}
+
+{self._editor_steps()}
+
+{self._format_instructions('editor')}"""
+
+    def _render_turn(self, article: Optional[str]) -> str:
+        """The user turn of the conversation layout that asks about `article`."""
+        if self.role == "user":
+            return f"Please read the following article and provide your reaction:\n\nArticle:\n{article}"
+
+        feedback = ""
+        rating = self.initial_rating
+        if self.memory:
+            last_article, reaction, rating = self.recent_memory(1)[0]
+            feedback = f"User Reaction: {reaction}\nRating: {rating}\n\n"
+            if article == last_article:
+                # The article is the one in the last reply, so it need not be sent again
+                return f"""{feedback}Improve the article from your last reply.
+
+The goal is to increase the user's vaccine acceptance rating above their current level of {rating}/4."""
+        return f"""{feedback}Previous article:
+{article}
+
+The goal is to increase the user's vaccine acceptance rating above their current level of {rating}/4."""
+
+    def _render_reply(self, fields: Dict) -> str:
+        if self.output_format == "json":
+            return to_json(self.role, fields)
+        return TEXT_REPLY_FORMATS[self.role].format(**fields)
+
+    def add_turn(self, article: str, reply: Dict) -> None:
+        """Add a finished exchange about `article` to the conversation layout's history.
+
+        Must be called before the exchange is added to memory, which the
+        editor's turn is rendered from.
+
+        Args:
+            article: The article the call was about
+            reply: The parsed response fields, replayed in the agent's output format
+        """
+        if self.prompt_layout == "conversation":
+            self.turns.append((self._render_turn(article), self._render_reply(reply)))
 
     def process_response(self, response: str) -> Tuple[str, Optional[float], str]:
         """Process the response from the agent based on its role.
@@ -175,6 +408,8 @@ The goal is to increase the user's vaccine acceptance rating above their current
         Returns:
             A tuple containing (reaction/article, rating, reasoning/changes_summary)
         """
+        if self.output_format == "json":
+            return self._process_json_response(response)
         if self.role == "user":
             try:
                 # Extract reaction
@@ -193,8 +428,10 @@ The goal is to increase the user's vaccine acceptance rating above their current
                     print(f"Warning: Rating {rating} out of bounds, clamping to valid range")
                     rating = max(1, min(4, rating))
                 
+                self.last_parse_failed = False
                 return reaction, rating, reasoning
             except Exception as e:
+                self.last_parse_failed = True
                 print(f"Error processing response: {e}")
                 print(f"Raw response: {response}")
                 # Return default values in case of error
@@ -204,59 +441,128 @@ The goal is to increase the user's vaccine acceptance rating above their current
                 # Extract article and changes summary
                 changes_summary = response.split("CHANGES_SUMMARY:")[1].split("ARTICLE:")[0].strip()
                 article = response.split("ARTICLE:")[1].strip()
+                self.last_parse_failed = False
                 return article, None, changes_summary
             except Exception as e:
+                self.last_parse_failed = True
                 print(f"Error processing editor response: {e}")
                 print(f"Raw response: {response}")
                 # Return the raw response as article if parsing fails
                 return response.strip(), None, "Error extracting changes summary"
 
+    def _process_json_response(self, response: str) -> Tuple[str, Optional[float], str]:
+        """JSON variant of process_response; fields that did not parse fall back to the same defaults."""
+        fields, missing = parse_fields(self.role, response)
+        self.last_parse_failed = bool(missing)
+        if missing:
+            print(f"Missing or invalid {self.role} response fields {missing}")
+            print(f"Raw response: {response}")
+        if self.role == "user":
+            return (fields.get("reaction", "Error processing response"), fields.get("rating", self.current_rating),
+                    fields.get("reasoning", "Error in response format"))
+        return fields.get("article", response.strip()), None, fields.get("changes_summary", "Error extracting changes summary")
+
     def add_to_memory(self, article: str, reaction: Optional[str] = None, rating: Optional[float] = None) -> None:
         """Add an interaction to the agent's memory.
 
+        With an article store, the entry holds the article's hash and the text
+        is stored as a delta against the previous entry's article.
+
         Args:
             article: The article text
             reaction: The reaction to the article (optional)
             rating: The rating given to the article (optional)
         """
+        if self.article_store is not None:
+            article = self.article_store.put(article, self.memory[-1][0] if self.memory else None)
         self.memory.append((article, reaction, rating))
 
+    def checkpoint_state(self) -> Dict:
+        """Return the mutable session state of the agent as JSON-serializable data."""
+        return {
+            "session_id": self.session_id,
+            "current_rating": self.current_rating,
+            "recommendation_rating": self.recommendation_rating,
+            "prompt_tokens_saved": self.prompt_tokens_saved,
+            "history": [list(entry) for entry in self.history],
+            "memory": [list(entry) for entry in self.memory],
+            "turns": [list(turn) for turn in self.turns]
+        }
+
+    def restore_checkpoint(self, state: Dict) -> None:
+        """Restore session state saved by checkpoint_state()."""
+        self.session_id = state["session_id"]
+        self.current_rating = state["current_rating"]
+        self.recommendation_rating = state["recommendation_rating"]
+        self.prompt_tokens_saved = state["prompt_tokens_saved"]
+        self.history = [tuple(entry) for entry in state["history"]]
+        self.memory = [tuple(entry) for entry in state["memory"]]
+        self.turns = [tuple(turn) for turn in state.get("turns", [])]
+
     def get_recommendation_prompt(self) -> str:
         """Create prompt for asking about likelihood to recommend vaccination to others.
 
         Returns:
             A formatted prompt string
         """
+        return self._build_prompt(self._render_recommendation_prompt, len(self.memory[-3:]))
+
+    def _render_recommendation_prompt(self, compact: bool, context_tokens: Optional[int]) -> str:
         # Create memory context
         memory_context = ""
         if self.memory:
             memory_context = "\nYour previous interactions with articles:\n"
-            for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.memory[-3:], 1):
-                memory_context += f"\nInteraction {i}:\nArticle: {prev_article}\nYour Reaction: {prev_reaction}\nYour Rating: {prev_rating}\n"
+            for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.recent_memory(), 1):
+                memory_context += f"\nInteraction {i}:\nArticle: {self._context_article(prev_article, context_tokens)}\nYour Reaction: {prev_reaction}\nYour Rating: {prev_rating}\n"
         
-        return f"""Take on the persona provided in the JSON object and determine how likely you would be to recommend COVID-19 vaccination to friends and family with similar backgrounds and values.
-
-Based on all the articles you've read and your persona's evolution throughout this experience, provide a recommendation rating.
+        return f"""{RECOMMENDATION_TASK}
 
 Your persona details:
-{json.dumps(self.persona, indent=2)}
+{self._persona_text(compact)}
 {memory_context}
 
 Your current vaccination acceptance rating is: {self.current_rating}/4
 
-Format your response EXACTLY as follows:
-RECOMMENDATION_RATING: [number between 1 and 4]
-REASONING: [5-10 sentences explaining your recommendation likelihood based on your persona]
+{self._format_instructions('recommendation')}
 
-Where on the scale from 1 to 4:
-1 = Would strongly advise against vaccination
-2 = Would probably not recommend vaccination
-3 = Would cautiously recommend vaccination
-4 = Would strongly recommend vaccination
-"""
+{RECOMMENDATION_SCALE}"""
+
+    def get_recommendation_messages(self) -> List[Dict]:
+        """The chat messages of the recommendation call.
+
+        The conversation layout puts the instructions, persona and reply
+        format in a system message ahead of the session-specific part.
+        """
+        if self.prompt_layout == "single":
+            return [{"role": "user", "content": self.get_recommendation_prompt()}]
+        system = f"""{RECOMMENDATION_TASK}
+
+Your persona details:
+{self._persona_json}
+
+{self._format_instructions('recommendation')}
+
+{RECOMMENDATION_SCALE}"""
+        memory_context = ""
+        if self.memory:
+            memory_context = "Your previous interactions with articles:\n"
+            for i, (prev_article, prev_reaction, prev_rating) in enumerate(self.recent_memory(), 1):
+                memory_context += f"\nInteraction {i}:\nArticle: {prev_article}\nYour Reaction: {prev_reaction}\nYour Rating: {prev_rating}\n\n"
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"{memory_context}Your current vaccination acceptance rating is: {self.current_rating}/4"}
+        ]
 
     def process_recommendation_response(self, response: str) -> Tuple[float, str]:
         """Process the recommendation response to extract rating and reasoning."""
+        if self.output_format == "json":
+            fields, missing = parse_fields("recommendation", response)
+            self.last_parse_failed = bool(missing)
+            if missing:
+                print(f"Missing or invalid recommendation response fields {missing}")
+                print(f"Raw response: {response}")
+            return (fields.get("recommendation_rating", self.current_rating),
+                    fields.get("reasoning", "Error in response format"))
         try:
             # Extract rating
             rating_str = response.split("RECOMMENDATION_RATING:")[1].split("REASONING:")[0].strip()
@@ -271,49 +577,139 @@ Where on the scale from 1 to 4:
                 print(f"Warning: Recommendation rating {rating} out of bounds, clamping to valid range")
                 rating = max(1, min(4, rating))
             
+            self.last_parse_failed = False
             return rating, reasoning
         except Exception as e:
+            self.last_parse_failed = True
             print(f"Error processing recommendation response: {e}")
             print(f"Raw response: {response}")
             # Return default values in case of error
             return self.current_rating, "Error in response format"
 
+# Seed article every session starts from unless another one is supplied
+DEFAULT_ARTICLE = """Recent studies have shown that COVID-19 vaccines continue to provide strong protection against severe illness and hospitalization. The latest data from health authorities indicates that vaccinated individuals are significantly less likely to experience severe symptoms or require hospitalization compared to unvaccinated individuals. This protection is particularly important for older adults and those with underlying health conditions."""
+
 def generate_diff_summary(old_text: str, new_text: str) -> str:
     """Generate a summary of differences between two texts."""
-    diff = difflib.ndiff(old_text.splitlines(), new_text.splitlines())
-    changes = []
-    
-    for line in diff:
-        if line.startswith('- '):
-            changes.append(f"Removed: {line[2:]}")
-        elif line.startswith('+ '):
-            changes.append(f"Added: {line[2:]}")
-    
-    return "\n".join(changes[:5]) + ("\n..." if len(changes) > 5 else "")
+    return diff_texts(old_text, new_text).summary()
+
+def default_results_path(owner: Optional[str] = None) -> str:
+    """Name of the CSV file rows go to when no result sink, database or local store is given.
+
+    `owner`, such as a session or worker id, keeps files started in the same second apart.
+    """
+    stem = f"simulation_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}" + (f"_{owner}" if owner else "")
+    path, n = f"{stem}.csv", 1
+    while os.path.exists(path):
+        path, n = f"{stem}_{n}.csv", n + 1
+    return path
+
+def default_result_sink(sink: Optional[ResultSink], use_db: bool, local_store: Optional[LocalResponseStore] = None,
+                        owner: Optional[str] = None) -> Optional[ResultSink]:
+    """A CSV sink for a whole run whose sessions would otherwise each fall back to a file of their own.
+
+    Returns None if the run already has somewhere to put its rows; a returned
+    sink belongs to the caller, which closes it once every session is done.
+    """
+    if sink is not None or use_db or local_store is not None:
+        return None
+    return CsvSink(default_results_path(owner))
+
+def _messages_text(messages: List[Dict]) -> str:
+    """All text of a chat request, for estimating its tokens."""
+    return "".join(message["content"] for message in messages)
+
+class SimulationAborted(Exception):
+    """Raised when a running simulation is asked to stop before its next LLM call."""
 
 class Simulation:
-    def __init__(self, persona_data: Dict, max_iterations: int = 10, target_rating: float = 0.8, use_db: bool = True):
-        self.user_agent = Agent(persona_data, "user")
-        self.editor_agent = Agent(persona_data, "editor")
+    def __init__(self, persona_data: Dict, max_iterations: int = 10, target_rating: float = 0.8, use_db: bool = True,
+                 article: Optional[str] = None, seed: Optional[int] = None,
+                 cache: Optional[CompletionCache] = None,
+                 supabase_writer: Optional[WriteBehindWriter] = None,
+                 sink: Optional[ResultSink] = None, prompt_mode: str = "full",
+                 token_budget: Optional[int] = None, telemetry: Optional[Telemetry] = None,
+                 backend: Optional[LLMBackend] = None, stream: bool = False, speculate: bool = False,
+                 beam_width: int = 1, beam_keep: int = 1,
+                 checkpoint: Optional[CheckpointJournal] = None, resume: bool = False,
+                 local_store: Optional[LocalResponseStore] = None,
+                 article_store: Optional[ArticleStore] = None, structured: bool = False,
+                 max_reasks: int = DEFAULT_MAX_REASKS, governor: Optional[BudgetGovernor] = None,
+                 stopping_policies: Sequence[StoppingPolicy] = (), prompt_layout: str = "single",
+                 fence: Optional[Callable[[], bool]] = None):
+        # With an article store, rows and agent memory hold article hashes instead of full text
+        self.article_store = article_store
+        # Ask for JSON responses and re-ask for just the fields a response lacked
+        self.structured = structured
+        self.max_reasks = max_reasks
+        output_format = "json" if structured else "text"
+        self.user_agent = Agent(persona_data, "user", prompt_mode, token_budget, article_store, output_format,
+                                prompt_layout)
+        self.editor_agent = Agent(persona_data, "editor", prompt_mode, token_budget, article_store, output_format,
+                                  prompt_layout)
         self.max_iterations = max_iterations
         self.target_rating = target_rating
         self.use_db = use_db
-        self.current_article = """Recent studies have shown that COVID-19 vaccines continue to provide strong protection against severe illness and hospitalization. The latest data from health authorities indicates that vaccinated individuals are significantly less likely to experience severe symptoms or require hospitalization compared to unvaccinated individuals. This protection is particularly important for older adults and those with underlying health conditions."""
+        self.seed = seed
+        self.cache = cache
+        self.supabase_writer = supabase_writer
+        self.stop_requested = False
+        # Asked before every paid call and logged row; returning False aborts the session like
+        # request_stop(), e.g. once a queue worker's lease on the session's job was taken over
+        self.fence = fence
+        self.telemetry = telemetry or Telemetry()
+        self.backend = backend or default_backend
+        if self.backend.async_only and (stream or speculate):
+            raise ValueError(f"the {self.backend.name} backend cannot be combined with "
+                             f"{'stream' if stream else 'speculate'}")
+        # Stream user responses and move on as soon as the reaction and rating arrive
+        self.stream = stream
+        self._reasoning_threads: List[threading.Thread] = []
+        # Start each editor rewrite while the persona is still evaluating the article
+        self.speculate = speculate
+        self.speculation_stats = {"hits": 0, "discarded": 0, "seconds_saved": 0.0}
+        self._speculation_pool: Optional[ThreadPoolExecutor] = None
+        # Beam search: candidate rewrites per round, and how many carry forward
+        if not 1 <= beam_keep <= beam_width:
+            raise ValueError(f"beam_keep must be between 1 and beam_width ({beam_width}), got {beam_keep}")
+        self.beam_width = beam_width
+        self.beam_keep = beam_keep
+        self._beam: List[str] = []
+        # Editing rounds it took to reach the target rating, or None if it was never reached
+        self.rounds_to_target: Optional[int] = None
+        # Policies that end a session early once more iterations look unlikely to pay off
+        self.stopping_policies = list(stopping_policies)
+        # Why the session stopped iterating: "target", "max_iterations", "budget" or a policy's reason
+        self.stop_reason: Optional[str] = None
+        # Similarity and edit counts of every editor rewrite against the article it replaced
+        self.article_edits: List[Dict] = []
+        self.iteration = 0
+        self._last_call: Optional[CallRecord] = None
+        self.current_article = article or DEFAULT_ARTICLE
+        # Journal state after every completed call; with resume, continue from the journal
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.persona_id = persona_data["persona"].get("persona_id", persona_data["persona"]["persona_name"])
+        # Shared token/cost/time budget of the run, which admits every iteration
+        self.governor = governor
+        self.initial_rating = self.user_agent.current_rating
+        self.checkpoint_key = session_key_for(self.persona_id, article, seed, beam_width, beam_keep)
         
         # Set up Supabase connection if enabled
         self.supabase = None
         if self.use_db:
+            supabase_url, supabase_key = get_supabase_credentials()
             if supabase_url and supabase_key:
                 try:
-                    self.supabase = create_client(supabase_url, supabase_key)
+                    self.supabase = create_supabase_client(supabase_url, supabase_key)
                     print("Successfully connected to Supabase")
                     
                     # Test if the table exists by trying to get a single row
                     try:
-                        test_result = self.supabase.table("persona_responses_duplicates").select("*").limit(1).execute()
+                        test_result = self.supabase.table(SUPABASE_TABLE).select("*").limit(1).execute()
                         print(f"Table test query successful: got {len(test_result.data)} rows")
                     except Exception as table_error:
-                        print(f"Error accessing table 'persona_responses_duplicates': {table_error}")
+                        print(f"Error accessing table '{SUPABASE_TABLE}': {table_error}")
                         print("Table might not exist or permissions might be incorrect")
                         
                 except Exception as e:
@@ -324,203 +720,863 @@ class Simulation:
                 print("Supabase URL or key missing, falling back to CSV output")
                 self.use_db = False
         
-        # Initialize CSV as fallback or if DB is disabled
-        if not self.use_db:
-            self.output_file = f"simulation_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            self._initialize_csv()
-
-    def _initialize_csv(self):
-        with open(self.output_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'session_id', 'iteration', 'persona_id', 'persona_name', 'current_rating',
-                'normalized_current_rating', 'reaction', 'article', 'recommendation_rating',
-                'normalized_recommendation_rating', 'recommendation_reasoning'
-            ])
-
-    def _log_to_supabase(self, iteration: int, reaction: str, rating: float, article: str, recommended_rating: float = None, recommendation_reasoning: str = None):
-        """Log iteration results to Supabase"""
+        # Rows in the persona_responses schema also go to the embedded database if one was given
+        self.local_store = local_store
+        # Rows queued for Supabase and the local store, journaled so a resumed session can re-log them
+        self._logged_rows: List[Dict] = []
+        # Whether a response parsed since the last row fell back to defaults; the next row is flagged
+        self._parse_failed_since_row = False
+        self._parse_lock = threading.Lock()
+        
+        # Rows go to the run's shared result sink if one was given; otherwise
+        # fall back to a CSV file of our own when no database is in use
+        self.sink = sink
+        self._owns_sink = False
+        if self.sink is None and not self.use_db and self.local_store is None:
+            # Sessions starting in the same second must not share (and truncate) one file
+            self.sink = CsvSink(default_results_path(self.user_agent.session_id))
+            self._owns_sink = True
+        if self.sink is not None:
+            self.output_file = self.sink.path
+
+    def _close_owned_sink(self) -> None:
+        if self._owns_sink:
+            self.sink.close()
+
+    def _row_article(self, article: Optional[str]) -> Optional[str]:
+        """The value a result row stores for an article: its text, or its hash with an article store."""
+        if self.article_store is None or not article:
+            return article
+        return self.article_store.put(article)
+
+    def _store_revision(self, article: str, derived_from: str) -> None:
+        """Store a rewrite as a delta against the article it was rewritten from."""
+        if self.article_store is not None:
+            self.article_store.put(article, self.article_store.put(derived_from))
+
+    def _response_row(self, iteration: int, reaction: str, rating: float, article: str,
+                      recommended_rating: float = None, recommendation_reasoning: str = None,
+                      kind: str = "reaction", parse_error: bool = False) -> Dict:
+        """Build a row in the persona_responses schema shared by Supabase and the local store"""
+        # Calculate normalized ratings (1-4 scale to 0-1 scale)
+        normalized_rating = (rating - 1) / 3
+        normalized_recommended = (recommended_rating - 1) / 3 if recommended_rating else None
+        
+        # Ensure reaction is either 'Positive' or 'Negative'
+        # The schema constraint requires exactly these values
+        formatted_reaction = "Positive" if reaction.lower().startswith("positive") else "Negative"
+        
+        # Create data object matching the table schema exactly
+        # Note the misspelled column names in the actual schema (recommened instead of recommended)
+        data = {
+            "session_id": self.user_agent.session_id,  # Add session_id to fix null constraint error
+            "persona_id": self.user_agent.persona.get("persona_id", 0),
+            "persona_name": self.user_agent.persona["persona_name"],
+            "iteration": min(max(1, iteration), 10),  # Constrained to 1-10 in schema
+            "current_rating": rating,
+            "normalized_current_rating": normalized_rating,
+            "recommened_rating": recommended_rating,  # Note: misspelled in schema 
+            "normalized_recommened_rating": normalized_recommended,  # Note: misspelled in schema
+            "reaction": formatted_reaction,
+            "reason": recommendation_reasoning or "",
+            "article": self._row_article(article) or "",
+            "is_fact": True,  # Required field
+            "is_real": True,  # Required field
+            "editor_changes": "",  # Optional field
+            # Together with session_id and iteration the row's unique key, so re-logging it is a no-op
+            "kind": kind,
+            # A user, editor or recommendation response behind this row could not be parsed
+            "parse_error": parse_error
+        }
+        return data
+
+    def _log_response(self, iteration: int, reaction: str, rating: float, article: str,
+                      recommended_rating: float = None, recommendation_reasoning: str = None,
+                      kind: str = "reaction"):
+        """Queue a persona_responses row for Supabase and the local store"""
+        if not (self.use_db or self.local_store):
+            return
+        with self._parse_lock:
+            parse_error, self._parse_failed_since_row = self._parse_failed_since_row, False
+        data = self._response_row(iteration, reaction, rating, article, recommended_rating, recommendation_reasoning,
+                                  kind, parse_error)
+        self._logged_rows.append(data)
+        self._submit_row(data)
+
+    def _submit_row(self, data: Dict) -> None:
+        if self.use_db:
+            self._log_to_supabase(data)
+        if self.local_store:
+            # Batched by the store's write-behind writer
+            self.local_store.submit(data)
+
+    def _log_to_supabase(self, data: Dict):
+        """Queue a row for a batched background insert into Supabase"""
         if not self.supabase:
             print("Supabase client is not initialized, skipping database logging")
             return
         
-        try:
-            print(f"Attempting to log to Supabase, iteration {iteration}")
-            # Calculate normalized ratings (1-4 scale to 0-1 scale)
-            normalized_rating = (rating - 1) / 3
-            normalized_recommended = (recommended_rating - 1) / 3 if recommended_rating else None
-            
-            # Ensure reaction is either 'Positive' or 'Negative'
-            # The schema constraint requires exactly these values
-            formatted_reaction = "Positive" if reaction.lower().startswith("positive") else "Negative"
-            
-            # Create data object matching the table schema exactly
-            # Note the misspelled column names in the actual schema (recommened instead of recommended)
-            data = {
-                "session_id": self.user_agent.session_id,  # Add session_id to fix null constraint error
-                "persona_id": self.user_agent.persona.get("persona_id", 0),
-                "persona_name": self.user_agent.persona["persona_name"],
-                "iteration": min(max(1, iteration), 10),  # Constrained to 1-10 in schema
-                "current_rating": rating,
-                "normalized_current_rating": normalized_rating,
-                "recommened_rating": recommended_rating,  # Note: misspelled in schema 
-                "normalized_recommened_rating": normalized_recommended,  # Note: misspelled in schema
-                "reaction": formatted_reaction,
-                "reason": recommendation_reasoning or "",
-                "article": article or "",
-                "is_fact": True,  # Required field
-                "is_real": True,  # Required field
-                "editor_changes": ""  # Optional field
-            }
-            
-            print(f"Data prepared: {json.dumps(data, indent=2)[:200]}...")
-            
-            # Insert into Supabase
-            print(f"Inserting into table: persona_responses_duplicate")
-            result = self.supabase.table("persona_responses_duplicate").insert(data).execute()
-            
-            print(f"Supabase insert result: {result}")
-            
-            # Check for errors
-            if hasattr(result, 'error') and result.error:
-                raise Exception(result.error)
-                
-        except Exception as e:
-            print(f"Supabase error when logging: {e}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            traceback.print_exc()
-            # If Supabase fails, log to CSV as backup
-            if not hasattr(self, 'output_file'):
-                self.output_file = f"backup_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                self._initialize_csv()
-            self._log_to_csv(iteration, reaction, rating, article, recommended_rating, recommendation_reasoning)
-
-    def _log_to_csv(self, iteration: int, reaction: str, rating: float, article: str, 
-                   recommendation_rating: float = None, recommendation_reasoning: str = None):
-        """Log iteration results to CSV file"""
+        # The writer batches rows, retries failed inserts and spills to disk,
+        # so the simulation loop never waits on the database
+        if self.supabase_writer is None:
+            self.supabase_writer = WriteBehindWriter(
+                supabase_inserter(self.supabase, SUPABASE_TABLE, ",".join(RESPONSE_KEY))
+            )
+        self.supabase_writer.submit(data)
+
+    def _log_to_sink(self, iteration: int, reaction: str, rating: float, article: str, 
+                    recommendation_rating: float = None, recommendation_reasoning: str = None):
+        """Log iteration results to the result sink"""
         normalized_rating = (rating - 1) / 3  # Convert 1-4 scale to 0-1 scale
         normalized_recommendation = (recommendation_rating - 1) / 3 if recommendation_rating else None
         
-        with open(self.output_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                self.user_agent.session_id,
-                iteration,
-                self.user_agent.persona.get("persona_id", "unknown"),
-                self.user_agent.persona["persona_name"],
-                rating,
-                normalized_rating,
-                reaction,
-                article,
-                recommendation_rating if recommendation_rating else "",
-                normalized_recommendation if normalized_recommendation else "",
-                recommendation_reasoning if recommendation_reasoning else ""
-            ])
+        self.sink.write({
+            'session_id': self.user_agent.session_id,
+            'iteration': iteration,
+            'persona_id': self.user_agent.persona.get("persona_id", "unknown"),
+            'persona_name': self.user_agent.persona["persona_name"],
+            'current_rating': rating,
+            'normalized_current_rating': normalized_rating,
+            'reaction': reaction,
+            'article': self._row_article(article),
+            'recommendation_rating': recommendation_rating,
+            'normalized_recommendation_rating': normalized_recommendation,
+            'recommendation_reasoning': recommendation_reasoning,
+            # Only the final row of a session carries why it stopped
+            'stop_reason': self.stop_reason,
+            'stopping_policy': describe_policies(self.stopping_policies) if self.stop_reason else None
+        })
 
-    def run(self):
+    def request_stop(self) -> None:
+        """Ask the simulation to abort before it makes its next LLM call."""
+        self.stop_requested = True
+
+    def _completion_params(self) -> Dict:
+        """Extra parameters sent with every chat completion in this session."""
+        return {"seed": self.seed} if self.seed is not None else {}
+
+    def _request_params(self, kind: str, params: Optional[Dict] = None) -> Dict:
+        """Parameters of a call: the session's, or the given ones, plus the response schema in structured mode."""
+        params = self._completion_params() if params is None else params
+        if self.structured:
+            params = {**params, "response_format": response_format(kind)}
+        return params
+
+    def _reask_request(self, kind: str, messages: List[Dict], params: Dict, response: str,
+                       missing: List[str]) -> Tuple[List[Dict], Dict]:
+        """Messages and parameters of a follow-up that asks only for the missing fields."""
+        messages = [*messages, {"role": "assistant", "content": response},
+                    {"role": "user", "content": reask_prompt(kind, missing)}]
+        return messages, {**params, "response_format": response_format(kind, missing)}
+
+    def _merge_reask(self, kind: str, fields: Dict, missing: List[str], record: CallRecord,
+                     answer: str) -> List[str]:
+        """Take the re-asked fields from a follow-up's answer and record the follow-up.
+
+        Returns:
+            The fields that are still missing
+        """
+        answered, _ = parse_fields(kind, answer)
+        fields.update((field, answered[field]) for field in missing if field in answered)
+        missing = [field for field in missing if field not in fields]
+        record.reask = True
+        record.parse_failed = bool(missing)
+        self.telemetry.record(record)
+        return missing
+
+    def _complete_fields(self, kind: str, model: str, messages: List[Dict], params: Dict, response: str,
+                         record: CallRecord, context: Dict, limiter: Optional[RateLimiter] = None,
+                         loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+        """Parse a structured response and re-ask for the fields it lacked.
+
+        `record` keeps whether the response itself parsed, which is what the
+        parse-failure rate counts; each follow-up is recorded as a call of its
+        own. Fields still missing after `max_reasks` follow-ups are left to the
+        agent's error defaults.
+
+        Args:
+            limiter: Rate limiter of the event loop `loop`, when called from a worker thread of run_async
+
+        Returns:
+            The response merged with the re-asked fields, as JSON
+        """
+        fields, missing = parse_fields(kind, response)
+        record.parse_failed = bool(missing)
+        for _ in range(self.max_reasks if missing else 0):
+            print(f"Re-asking {kind} call for missing fields {missing}")
+            reask_messages, reask_params = self._reask_request(kind, messages, params, response, missing)
+            reask_record = self._new_call_record(kind, model)
+            reserved = 0
+            if limiter:
+                reserved = asyncio.run_coroutine_threadsafe(
+                    limiter.acquire(estimate_tokens(_messages_text(reask_messages))), loop
+                ).result()
+            self._check_stop()
+            started = time.perf_counter()
+            completion = self.backend.complete(model, reask_messages, {**context, "reask": True}, **reask_params)
+            self._fill_call_record(reask_record, started, completion)
+            if limiter:
+                loop.call_soon_threadsafe(limiter.reconcile, reserved, completion.prompt_tokens + completion.completion_tokens)
+            missing = self._merge_reask(kind, fields, missing, reask_record, completion.text)
+            if not missing:
+                break
+        return to_json(kind, fields)
+
+    async def _acomplete_fields(self, kind: str, model: str, messages: List[Dict], params: Dict, response: str,
+                                record: CallRecord, context: Dict, limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _complete_fields that waits for rate-limit capacity before each follow-up."""
+        fields, missing = parse_fields(kind, response)
+        record.parse_failed = bool(missing)
+        for _ in range(self.max_reasks if missing else 0):
+            print(f"Re-asking {kind} call for missing fields {missing}")
+            reask_messages, reask_params = self._reask_request(kind, messages, params, response, missing)
+            reask_record = self._new_call_record(kind, model)
+            reserved = await limiter.acquire(estimate_tokens(_messages_text(reask_messages))) if limiter else 0
+            self._check_stop()
+            started = time.perf_counter()
+            completion = await self.backend.acomplete(model, reask_messages, {**context, "reask": True}, **reask_params)
+            self._fill_call_record(reask_record, started, completion)
+            if limiter:
+                limiter.reconcile(reserved, completion.prompt_tokens + completion.completion_tokens)
+            missing = self._merge_reask(kind, fields, missing, reask_record, completion.text)
+            if not missing:
+                break
+        return to_json(kind, fields)
+
+    def _check_stop(self) -> None:
+        if not self.stop_requested and self.fence is not None and not self.fence():
+            self.stop_requested = True
+        if self.stop_requested:
+            raise SimulationAborted(f"Session {self.user_agent.session_id} was stopped")
+
+    def _cache_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Messages used as the cache key, with the random per-session ids masked out.
+
+        The session id is the only part of an otherwise identical prompt that
+        changes between reruns, so leaving it in would make every lookup miss.
+        """
+        masked = []
+        for message in messages:
+            content = message["content"]
+            for session_id in (self.user_agent.session_id, self.editor_agent.session_id):
+                content = content.replace(session_id, "<session>")
+            masked.append({**message, "content": content})
+        return masked
+
+    def _new_call_record(self, kind: str, model: str) -> CallRecord:
+        return CallRecord(
+            session_id=self.user_agent.session_id,
+            persona_id=str(self.user_agent.persona.get("persona_id", "unknown")),
+            persona_name=self.user_agent.persona["persona_name"],
+            iteration=self.iteration,
+            kind=kind,
+            model=model
+        )
+
+    def _call_context(self, kind: str) -> Dict:
+        """What the backend may know about a call besides its messages."""
+        return {
+            "role": kind,
+            "persona": self.user_agent.persona,
+            "current_rating": self.user_agent.current_rating,
+            "article": self.current_article,
+            "iteration": self.iteration
+        }
+
+    @staticmethod
+    def _fill_call_record(record: CallRecord, started: float, completion: Optional[Completion] = None) -> None:
+        record.latency_seconds = time.perf_counter() - started
+        if completion is not None:
+            record.prompt_tokens = completion.prompt_tokens
+            record.completion_tokens = completion.completion_tokens
+            record.ttfb_seconds = completion.ttfb_seconds
+            record.retries = completion.retries
+            record.cached_tokens = completion.cached_tokens
+
+    def _finish_call_record(self, record: CallRecord, started: float, completion: Optional[Completion] = None) -> None:
+        """Fill in latency, TTFB, retries and token usage, then hand the record to telemetry."""
+        self._fill_call_record(record, started, completion)
+        self._last_call = self.telemetry.record(record)
+
+    def _note_parse_result(self, record: Optional[CallRecord], parse_failed: bool) -> None:
+        """Record the outcome of parsing a response in its call record and in the session's next row."""
+        # A structured response was already judged before any re-ask filled it in
+        if record is not None and record.parse_failed is None:
+            record.parse_failed = parse_failed
+        if parse_failed:
+            # A streamed reasoning may fail after its row was queued; the next row carries it then
+            with self._parse_lock:
+                self._parse_failed_since_row = True
+
+    def _mark_parse_result(self, parse_failed: bool) -> None:
+        """Attach the outcome of parsing the last response to its call record."""
+        self._note_parse_result(self._last_call, parse_failed)
+
+    def _complete(self, kind: str, model: str, messages: List[Dict],
+                  context: Optional[Dict] = None) -> Tuple[str, CallRecord]:
+        """Send a chat completion, serving it from the cache when possible.
+
+        Returns:
+            The response text and its filled-in call record, not yet handed to telemetry
+        """
+        params = self._request_params(kind)
+        record = self._new_call_record(kind, model)
+        started = time.perf_counter()
+        if self.cache:
+            cache_messages = self._cache_messages(messages)
+            cached = self.cache.get(model, cache_messages, params)
+            if cached is not None:
+                record.cache_hit = True
+                self._fill_call_record(record, started)
+                return cached, record
+        
+        context = context or self._call_context(kind)
+        completion = self.backend.complete(model, messages, context, **params)
+        self._fill_call_record(record, started, completion)
+        response = completion.text
+        if self.structured:
+            response = self._complete_fields(kind, model, messages, params, response, record, context)
+        
+        if self.cache:
+            self.cache.put(model, cache_messages, params, response)
+        return response, record
+
+    async def _acomplete(self, kind: str, model: str, messages: List[Dict], limiter: Optional[RateLimiter] = None,
+                         context: Optional[Dict] = None, params: Optional[Dict] = None,
+                         cache_tag: Optional[Dict] = None) -> Tuple[str, CallRecord]:
+        """Async variant of _complete that waits for rate-limit capacity before sending.
+
+        `cache_tag` holds extra cache-key fields that are not sent with the
+        request, such as the beam candidate a rewrite was sampled for.
+        """
+        params = self._request_params(kind, params)
+        record = self._new_call_record(kind, model)
+        started = time.perf_counter()
+        if self.cache:
+            cache_messages = self._cache_messages(messages)
+            cache_params = {**params, **cache_tag} if cache_tag else params
+            cached = self.cache.get(model, cache_messages, cache_params)
+            if cached is not None:
+                record.cache_hit = True
+                self._fill_call_record(record, started)
+                return cached, record
+        
+        reserved = await limiter.acquire(estimate_tokens(_messages_text(messages))) if limiter else 0
+        self._check_stop()
+        # Rate-limit waits are not part of the call's latency
+        started = time.perf_counter()
+        context = context or self._call_context(kind)
+        completion = await self.backend.acomplete(model, messages, context, **params)
+        self._fill_call_record(record, started, completion)
+        if limiter:
+            limiter.reconcile(reserved, completion.prompt_tokens + completion.completion_tokens)
+        response = completion.text
+        if self.structured:
+            response = await self._acomplete_fields(kind, model, messages, params, response, record, context, limiter)
+        
+        if self.cache:
+            self.cache.put(model, cache_messages, cache_params, response)
+        return response, record
+
+    def _chat(self, kind: str, model: str, messages: List[Dict]) -> str:
+        """Send a chat completion and return the response text.
+
+        Responses are served from the completion cache when one is configured.
+        Every call is recorded in the session's telemetry.
+
+        Args:
+            kind: "user", "editor" or "recommendation"
+            model: Model to call
+            messages: Chat messages, as rendered by the agent
+        """
+        self._check_stop()
+        response, record = self._complete(kind, model, messages)
+        self._last_call = self.telemetry.record(record)
+        return response
+
+    async def _achat(self, kind: str, model: str, messages: List[Dict], limiter: Optional[RateLimiter] = None) -> str:
+        """Async variant of _chat that waits for rate-limit capacity before sending."""
+        self._check_stop()
+        response, record = await self._acomplete(kind, model, messages, limiter)
+        self._last_call = self.telemetry.record(record)
+        return response
+
+    def _stream_user_reaction(self, iteration: int, messages: List[Dict], limiter: Optional[RateLimiter] = None,
+                              loop: Optional[asyncio.AbstractEventLoop] = None) -> Tuple[str, float, float]:
+        """Stream the user call and apply its reaction as soon as the rating has arrived.
+
+        The reasoning keeps streaming in a background thread that fills in the
+        history entry, the call's telemetry and the cache once it completes;
+        _join_reasoning waits for it, as does journaling a checkpoint. Falls back to the whole response when
+        the header cannot be parsed early.
+
+        Args:
+            iteration: Zero-based iteration index
+            messages: User call messages
+            limiter: Rate limiter of the event loop `loop`, when called from run_async
+
+        Returns:
+            A tuple containing (reaction, rating, normalized rating)
+        """
+        self._check_stop()
+        params = self._request_params("user")
+        record = self._new_call_record("user", USER_MODEL)
+        started = time.perf_counter()
+        cache_messages = None
+        if self.cache:
+            cache_messages = self._cache_messages(messages)
+            cached = self.cache.get(USER_MODEL, cache_messages, params)
+            if cached is not None:
+                record.cache_hit = True
+                self._finish_call_record(record, started)
+                return self._apply_user_response(iteration, cached)
+        
+        reserved = 0
+        if limiter:
+            reserved = asyncio.run_coroutine_threadsafe(limiter.acquire(estimate_tokens(_messages_text(messages))), loop).result()
+            self._check_stop()
+            started = time.perf_counter()
+        context = self._call_context("user")
+        stream = self.backend.stream(USER_MODEL, messages, context, **params)
+        parser = ReactionStreamParser(structured=self.structured)
+        for chunk in stream:
+            if parser.feed(chunk):
+                break
+        record.header_seconds = time.perf_counter() - started
+        
+        def finish() -> Tuple[Completion, str]:
+            for chunk in stream:
+                parser.feed(chunk)
+            completion = stream.completion
+            if limiter:
+                loop.call_soon_threadsafe(limiter.reconcile, reserved, completion.prompt_tokens + completion.completion_tokens)
+            response = completion.text
+            if self.structured:
+                response = self._complete_fields("user", USER_MODEL, messages, params, response, record, context,
+                                                 limiter, loop)
+            if self.cache:
+                self.cache.put(USER_MODEL, cache_messages, params, response)
+            return completion, response
+        
+        if parser.rating is None:
+            completion, response = finish()
+            record.header_seconds = None
+            self._finish_call_record(record, started, completion)
+            return self._apply_user_response(iteration, response)
+        
+        self.user_agent.last_parse_failed = False
+        entry = len(self.user_agent.history)
+        reaction, rating = parser.reaction, parser.rating
+        article = self.current_article
+        
+        def finish_reasoning() -> None:
+            completion, response = finish()
+            reasoning = parse_fields("user", response)[0].get("reasoning") if self.structured else parser.reasoning()
+            self._note_parse_result(record, reasoning is None)
+            self._fill_call_record(record, started, completion)
+            self.telemetry.record(record)
+            self.user_agent.history[entry] = (reaction, rating, reasoning or "Error in response format")
+            # No other user call starts before this thread is joined, so the turn lands in order
+            self.user_agent.add_turn(article, {"reaction": reaction, "rating": rating,
+                                               "reasoning": reasoning or "Error in response format"})
+            print(f"Reasoning (iteration {iteration + 1}): {reasoning}")
+        
+        # The history entry must exist before the reasoning thread can fill it in
+        result = self._record_user_reaction(iteration, reaction, rating, None)
+        thread = threading.Thread(target=finish_reasoning, name="reasoning-stream", daemon=True)
+        thread.start()
+        self._reasoning_threads.append(thread)
+        return result
+
+    def _join_reasoning(self) -> None:
+        """Wait until every reasoning still streaming in the background has arrived."""
+        for thread in self._reasoning_threads:
+            thread.join()
+        self._reasoning_threads = []
+
+    def _start_speculation(self):
+        """Start this iteration's editor rewrite alongside the user call.
+
+        The editor prompt is rendered from the article, the editor's memory
+        and its rating, none of which the user call changes, so the rewrite
+        is only wasted when the session ends at this iteration.
+
+        Returns:
+            The future of the editor call
+        """
+        self._check_stop()
+        if self._speculation_pool is None:
+            self._speculation_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative-editor")
+        messages = self.editor_agent.get_messages(self.current_article)
+        return self._speculation_pool.submit(self._complete, "editor", EDITOR_MODEL, messages, self._call_context("editor"))
+
+    def _discard_speculation(self, future, outcome: str) -> None:
+        """Drop a speculative rewrite; its call is still recorded once it finishes."""
+        self.speculation_stats["discarded"] += 1
+
+        def record_discarded(done) -> None:
+            if done.cancelled() or done.exception() is not None:
+                return
+            _, record = done.result()
+            record.speculation = outcome
+            self.telemetry.record(record)
+        future.add_done_callback(record_discarded)
+
+    def _keep_speculation(self, record: CallRecord, waited: float) -> None:
+        """Record a speculation hit; the time saved is the call time not spent waiting."""
+        record.speculation = "hit"
+        record.seconds_saved = max(0.0, record.latency_seconds - waited)
+        self.speculation_stats["hits"] += 1
+        self.speculation_stats["seconds_saved"] += record.seconds_saved
+        self._last_call = self.telemetry.record(record)
+
+    def _resolve_speculation(self, future, ended: Optional[str]) -> Optional[str]:
+        """Keep the speculative rewrite unless the session ends at this iteration.
+
+        Args:
+            future: The speculative editor call started for this iteration
+            ended: "target_reached" or "stopped" when the session needs no rewrite this iteration
+
+        Returns:
+            The editor response, or None when it was discarded
+        """
+        if ended:
+            self._discard_speculation(future, ended)
+            return None
+        waiting_since = time.perf_counter()
+        response, record = future.result()
+        self._keep_speculation(record, time.perf_counter() - waiting_since)
+        return response
+
+    async def _aresolve_speculation(self, task: asyncio.Task, ended: Optional[str]) -> Optional[str]:
+        """Async variant of _resolve_speculation for speculations started as tasks."""
+        if ended:
+            self._discard_speculation(task, ended)
+            return None
+        waiting_since = time.perf_counter()
+        response, record = await task
+        self._keep_speculation(record, time.perf_counter() - waiting_since)
+        return response
+
+    def _close_speculation(self) -> None:
+        if self._speculation_pool is not None:
+            # A discarded rewrite may still be in flight; it records itself when done
+            self._speculation_pool.shutdown(wait=False)
+            self._speculation_pool = None
+
+    def _checkpoint_state(self, pending: Optional[Tuple] = None) -> Dict:
+        state = {
+            "article": self.current_article,
+            "beam": self._beam,
+            "rounds_to_target": self.rounds_to_target,
+            "stop_reason": self.stop_reason,
+            "article_edits": self.article_edits,
+            "pending": list(pending) if pending else None,
+            "rows": self._logged_rows,
+            "parse_failed_since_row": self._parse_failed_since_row,
+            "user": self.user_agent.checkpoint_state(),
+            "editor": self.editor_agent.checkpoint_state()
+        }
+        if self.article_store is not None and not self.article_store.persistent:
+            # Memory holds hashes that an in-memory store forgets on exit, so journal their text too
+            refs = {entry[0] for agent in (self.user_agent, self.editor_agent) for entry in agent.memory}
+            state["articles"] = [self.article_store.get(ref) for ref in sorted(refs)]
+        return state
+
+    def _save_checkpoint(self, phase: str, iteration: int, pending: Optional[Tuple] = None) -> None:
+        """Journal the session after a completed call so a restarted run never repeats it.
+
+        Args:
+            phase: "user" after a reaction, "editor" after a rewrite; in beam mode "rewrites"
+                after a round's rewrites, "round" after its scores, and "target" after the
+                round that reached the target rating or "stopped" after one a stopping policy ended
+            iteration: Iteration the session continues from
+            pending: Results the next step builds on: the (reaction, rating, normalized
+                rating) the editor has not answered yet, or the unscored beam candidates
+        """
+        if self.checkpoint is not None:
+            # Journal complete history entries rather than ones still waiting on streamed reasoning
+            self._join_reasoning()
+            self.checkpoint.save(self.checkpoint_key, self.persona_id, phase, iteration,
+                                 self._checkpoint_state(pending))
+
+    def _complete_checkpoint(self, iteration: int, recommendation_rating: float, recommendation_reasoning: str) -> None:
+        if self.checkpoint is not None:
+            result = {"recommendation_rating": recommendation_rating, "recommendation_reasoning": recommendation_reasoning}
+            self.checkpoint.complete(self.checkpoint_key, self.persona_id, iteration, self._checkpoint_state(), result)
+
+    def _resume_checkpoint(self) -> Optional[Dict]:
+        """Restore the session from the checkpoint journal when resuming.
+
+        Returns:
+            The checkpoint the session continues from (see CheckpointJournal.load),
+            or None if the session starts from scratch
+        """
+        if self.checkpoint is None or not self.resume:
+            return None
+        saved = self.checkpoint.load(self.checkpoint_key)
+        if saved is None:
+            return None
+        state = saved["state"]
+        self.current_article = state["article"]
+        self._beam = state["beam"]
+        self.rounds_to_target = state["rounds_to_target"]
+        self.stop_reason = state.get("stop_reason")
+        self.article_edits = state.get("article_edits", [])
+        for article in state.get("articles", []):
+            self.article_store.put(article)
+        self.user_agent.restore_checkpoint(state["user"])
+        self.editor_agent.restore_checkpoint(state["editor"])
+        # Rows of journaled calls may still have been queued at the crash; stored ones are skipped
+        self._logged_rows = state.get("rows", [])
+        self._parse_failed_since_row = state.get("parse_failed_since_row", False)
+        for row in self._logged_rows:
+            self._submit_row(row)
+        if saved["status"] == "completed":
+            print(f"Session {self.user_agent.session_id} already completed, reusing its journaled result")
+        else:
+            print(f"Resuming session {self.user_agent.session_id} at iteration {saved['iteration'] + 1} "
+                  f"after its last journaled '{saved['phase']}' call")
+        return saved
+
+    def _journaled_result(self, saved: Dict) -> Tuple:
+        """The run() result of a session the journal already holds as completed."""
+        self._close_owned_sink()
+        result = saved["result"]
+        return self.user_agent.history, result["recommendation_rating"], result["recommendation_reasoning"]
+
+    def _ratings(self) -> List[float]:
+        """The session's ratings so far on the 1-4 scale, starting with the initial one."""
+        return [self.initial_rating] + [entry[1] for entry in self.user_agent.history]
+
+    def _iteration_estimate(self, reactions: int, rewrites: int) -> Tuple[int, float]:
+        """Estimated tokens and cost of an iteration of persona reactions and editor rewrites."""
+        article_tokens = len(self.current_article) // CHARS_PER_TOKEN
+        user_prompt = len(_messages_text(self.user_agent.get_messages(self.current_article))) // CHARS_PER_TOKEN
+        editor_prompt = len(_messages_text(self.editor_agent.get_messages(self.current_article))) // CHARS_PER_TOKEN
+        # A rewrite's completion holds the whole article besides its summary
+        editor_completion = article_tokens + DEFAULT_COMPLETION_TOKENS
+        tokens = (reactions * (user_prompt + DEFAULT_COMPLETION_TOKENS)
+                  + rewrites * (editor_prompt + editor_completion))
+        cost = (reactions * call_cost(USER_MODEL, user_prompt, DEFAULT_COMPLETION_TOKENS)
+                + rewrites * call_cost(EDITOR_MODEL, editor_prompt, editor_completion))
+        return tokens, cost
+
+    def _recommendation_estimate(self) -> Tuple[int, float]:
+        """Estimated tokens and cost of the recommendation call once memory holds three articles."""
+        missing_articles = 3 - len(self.user_agent.memory[-3:])
+        prompt = len(self.user_agent._render_recommendation_prompt(False, None)) // CHARS_PER_TOKEN
+        # Rewrites tend to grow the article
+        prompt = int((prompt + missing_articles * len(self.current_article) // CHARS_PER_TOKEN) * GROWTH_MARGIN)
+        completion = DEFAULT_COMPLETION_TOKENS
+        return prompt + completion, call_cost(RECOMMENDATION_MODEL, prompt, completion)
+
+    def _open_budget(self) -> bool:
+        """Reserve the session's recommendation call with the governor, if there is one."""
+        if self.governor is None:
+            return True
+        if self.governor.open_session(self.user_agent.session_id, *self._recommendation_estimate()):
+            return True
+        print(f"Budget: skipping persona {self.persona_id}, the run's budget is exhausted")
+        return False
+
+    def _budget_skipped(self) -> Tuple:
+        """The run() result of a session the budget could not start."""
+        self.stop_reason = "budget"
+        self._close_owned_sink()
+        return self.user_agent.history, None, "Skipped: the run's budget was exhausted"
+
+    def _admit_iteration_now(self, reactions: int, rewrites: int) -> bool:
+        """Ask the governor to admit the next iteration of a session run on its own thread."""
+        if self.governor is None:
+            return True
+        admitted = self.governor.admit_now(self.user_agent.session_id, *self._iteration_estimate(reactions, rewrites))
+        if not admitted:
+            print(f"Budget: finishing session after {len(self.user_agent.history)} iterations")
+            self.stop_reason = "budget"
+        return admitted
+
+    async def _admit_iteration(self, reactions: int, rewrites: int) -> bool:
+        """Wait for the governor to admit the next iteration, behind sessions expected to gain more per token."""
+        if self.governor is None:
+            return True
+        admitted = await self.governor.admit(
+            self.user_agent.session_id, self._ratings(), self.target_rating,
+            *self._iteration_estimate(reactions, rewrites)
+        )
+        if not admitted:
+            print(f"Budget: finishing session after {len(self.user_agent.history)} iterations")
+            self.stop_reason = "budget"
+        return admitted
+
+    def _settle_iteration(self) -> None:
+        if self.governor is not None:
+            self.governor.settle(self.user_agent.session_id)
+
+    def _close_budget(self) -> None:
+        if self.governor is not None:
+            self.governor.close_session(self.user_agent.session_id)
+
+    def _policy_stop(self, iteration: int) -> Optional[str]:
+        """Ask the stopping policies whether the session should end after this iteration's reaction.
+
+        Returns:
+            The reason of the first policy that says to stop, which becomes the stop reason, or None
+        """
+        remaining = self.max_iterations - iteration - 1
+        if not self.stopping_policies or remaining < 1:
+            return None
+        ratings = [(entry[1] - 1) / 3 for entry in self.user_agent.history]  # 1-4 scale to 0-1 scale
+        reason = first_stop(self.stopping_policies, ratings, self.target_rating, remaining)
+        if reason:
+            print(f"Stopping early after iteration {iteration + 1}: {reason}")
+            self.stop_reason = reason
+        return reason
+
+    def _iteration_end(self, iteration: int, normalized_rating: float) -> Optional[str]:
+        """Whether the session ends with this reaction: "target_reached", "stopped" by a policy, or None."""
+        if normalized_rating >= self.target_rating:
+            print(f"Target rating {self.target_rating} (normalized from 1-4 scale) reached at iteration {iteration}")
+            self.rounds_to_target = iteration
+            self.stop_reason = "target"
+            return "target_reached"
+        if self._policy_stop(iteration):
+            return "stopped"
+        return None
+
+    def _print_connection_status(self) -> None:
         # Debug: Check Supabase connection status
         print(f"\nDEBUG - Supabase connection status:")
         print(f"use_db flag: {self.use_db}")
         print(f"supabase client initialized: {self.supabase is not None}")
         if self.supabase:
             print(f"supabase client type: {type(self.supabase)}")
+
+    def _print_iteration_header(self, iteration: int) -> None:
+        print(f"\n{'='*50}")
+        print(f"Iteration {iteration + 1}/{self.max_iterations}")
+        print(f"Current rating: {self.user_agent.current_rating}")
+        print(f"{'='*50}\n")
+
+    def _apply_user_response(self, iteration: int, user_response: str) -> Tuple[str, float, float]:
+        """Record the user agent's reaction to the current article and log the iteration.
+
+        Args:
+            iteration: Zero-based iteration index
+            user_response: Raw response text from the user agent
+
+        Returns:
+            A tuple containing (reaction, rating, normalized rating)
+        """
+        reaction, rating, reasoning = self.user_agent.process_response(user_response)
+        self._mark_parse_result(self.user_agent.last_parse_failed)
+        return self._record_user_reaction(iteration, reaction, rating, reasoning)
+
+    def _record_user_reaction(self, iteration: int, reaction: str, rating: float,
+                              reasoning: Optional[str]) -> Tuple[str, float, float]:
+        """Apply a parsed user reaction; reasoning is None while it is still streaming."""
+        self.user_agent.current_rating = rating
+        self.user_agent.history.append((reaction, rating, reasoning))
+        if reasoning is not None:
+            self.user_agent.add_turn(self.current_article, {"reaction": reaction, "rating": rating, "reasoning": reasoning})
         
-        iteration = 0
-        while iteration < self.max_iterations:
-            print(f"\n{'='*50}")
-            print(f"Iteration {iteration + 1}/{self.max_iterations}")
-            print(f"Current rating: {self.user_agent.current_rating}")
-            print(f"{'='*50}\n")
-            
-            # User agent reads and reacts to article
-            user_prompt = self.user_agent.get_prompt(self.current_article)
-            user_response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": user_prompt}]
-            ).choices[0].message.content
-            
-            reaction, rating, reasoning = self.user_agent.process_response(user_response)
-            self.user_agent.current_rating = rating
-            self.user_agent.history.append((reaction, rating, reasoning))
-            
-            # Add to memory
-            self.user_agent.add_to_memory(self.current_article, reaction, rating)
-            
-            # Log the iteration
-            if self.use_db:
-                # Note: during iterations, we pass None for recommended_rating
-                self._log_to_supabase(iteration + 1, reaction, rating, self.current_article)
-            else:
-                self._log_to_csv(iteration, reaction, rating, self.current_article)
-            
-            print(f"User reaction: {reaction}")
-            print(f"New rating: {rating}")
+        # Add to memory
+        self.user_agent.add_to_memory(self.current_article, reaction, rating)
+        
+        # Log the iteration
+        self._check_stop()
+        # Note: during iterations, we pass None for recommended_rating
+        self._log_response(iteration + 1, reaction, rating, self.current_article)
+        if self.sink:
+            self._log_to_sink(iteration, reaction, rating, self.current_article)
+        
+        print(f"User reaction: {reaction}")
+        print(f"New rating: {rating}")
+        if reasoning is not None:
             print(f"Reasoning: {reasoning}")
-            
-            # Normalize rating to 0-1 scale for comparison with target_rating
-            normalized_rating = (rating - 1) / 3  # Convert 1-4 scale to 0-1 scale
-            
-            # Check if target rating is reached
-            if normalized_rating >= self.target_rating:
-                print(f"Target rating {self.target_rating} (normalized from 1-4 scale) reached at iteration {iteration}")
-                break
-            
-            # Editor agent edits the article
-            editor_prompt = self.editor_agent.get_prompt(self.current_article)
-            editor_response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": editor_prompt}]
-            ).choices[0].message.content
-            
-            old_article = self.current_article
-            edited_article, _, editor_changes = self.editor_agent.process_response(editor_response)
-            self.current_article = edited_article
-            
-            # Generate and display diff summary
-            diff_summary = generate_diff_summary(old_article, edited_article)
-            
-            # Add to editor's memory
-            self.editor_agent.add_to_memory(self.current_article, reaction, rating)
-            
-            print(f"\nEditor's Changes Summary:")
-            print(f"{editor_changes}")
-            print(f"\nUpdated Article:")
-            print(f"{edited_article[:200]}...") # Print the first 200 chars of the article
-            
-            iteration += 1
         
+        # Normalize rating to 0-1 scale for comparison with target_rating
+        normalized_rating = (rating - 1) / 3  # Convert 1-4 scale to 0-1 scale
+        return reaction, rating, normalized_rating
+
+    def _apply_editor_response(self, reaction: str, rating: float, editor_response: str) -> None:
+        """Replace the current article with the editor agent's rewrite.
+
+        Args:
+            reaction: The user reaction the rewrite responds to
+            rating: The user rating the rewrite responds to
+            editor_response: Raw response text from the editor agent
+        """
+        old_article = self.current_article
+        edited_article, _, editor_changes = self.editor_agent.process_response(editor_response)
+        self._mark_parse_result(self.editor_agent.last_parse_failed)
+        self.current_article = edited_article
+        self._store_revision(edited_article, old_article)
+        
+        self._record_article_edit(diff_texts(old_article, edited_article))
+        self.editor_agent.add_turn(old_article, {"changes_summary": editor_changes, "article": edited_article})
+        
+        # Add to editor's memory
+        self.editor_agent.add_to_memory(self.current_article, reaction, rating)
+        
+        print(f"\nEditor's Changes Summary:")
+        print(f"{editor_changes}")
+        print(f"\nUpdated Article:")
+        print(f"{edited_article[:200]}...") # Print the first 200 chars of the article
+
+    def _record_article_edit(self, diff: TextDiff) -> None:
+        edit = {"iteration": self.iteration, **diff.stats()}
+        self.article_edits.append(edit)
+        print(f"Similarity to previous article: {edit['similarity']:.2f} "
+              f"({edit['edits']} edits in {edit['sentences_changed']} sentences)")
+
+    def _print_completion(self, iteration: int) -> None:
         # After simulation completes, ask user agent for recommendation rating
         print(f"\n{'='*50}")
         print(f"Simulation completed after {iteration} iterations.")
+        self.stop_reason = self.stop_reason or "max_iterations"
+        print(f"Stopped by: {self.stop_reason}")
         print(f"Final acceptance rating: {self.user_agent.current_rating}/4")
+        if self.user_agent.prompt_mode == "compact":
+            saved = self.user_agent.prompt_tokens_saved + self.editor_agent.prompt_tokens_saved
+            print(f"Prompt tokens saved by compact prompts so far: {saved}")
+        if self.speculate:
+            stats = self.speculation_stats
+            print(f"Speculative rewrites kept: {stats['hits']}/{stats['hits'] + stats['discarded']}, "
+                  f"saved {stats['seconds_saved']:.2f}s")
         print(f"Asking persona for vaccine recommendation likelihood...")
         print(f"{'='*50}\n")
-        
-        recommendation_prompt = self.user_agent.get_recommendation_prompt()
-        recommendation_response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": recommendation_prompt}]
-        ).choices[0].message.content
-        
+
+    def _apply_recommendation_response(self, iteration: int, recommendation_response: str) -> Tuple[float, str]:
+        """Record the final recommendation and log the final state of the session.
+
+        Args:
+            iteration: Number of completed editing iterations
+            recommendation_response: Raw response text from the recommendation call
+
+        Returns:
+            A tuple containing (recommendation rating, recommendation reasoning)
+        """
         recommendation_rating, recommendation_reasoning = self.user_agent.process_recommendation_response(recommendation_response)
+        self._mark_parse_result(self.user_agent.last_parse_failed)
         self.user_agent.recommendation_rating = recommendation_rating
         
         print(f"Recommendation rating: {recommendation_rating}/4")
         print(f"Recommendation reasoning: {recommendation_reasoning}")
         
         # Log the final state with recommendation
-        if self.use_db:
-            self._log_to_supabase(
-                iteration, 
-                "Positive" if self.user_agent.current_rating >= 2.5 else "Negative", 
-                self.user_agent.current_rating,
-                self.current_article,
-                recommendation_rating,
-                recommendation_reasoning
-            )
-        else:
-            self._log_to_csv(
+        self._check_stop()
+        self._log_response(
+            iteration,
+            "Positive" if self.user_agent.current_rating >= 2.5 else "Negative",
+            self.user_agent.current_rating,
+            self.current_article,
+            recommendation_rating,
+            recommendation_reasoning,
+            kind="final"
+        )
+        if self.sink:
+            self._log_to_sink(
                 iteration,
                 "Final state", 
                 self.user_agent.current_rating, 
@@ -528,8 +1584,316 @@ class Simulation:
                 recommendation_rating,
                 recommendation_reasoning
             )
+        self._close_owned_sink()
+        return recommendation_rating, recommendation_reasoning
+
+    def run(self):
+        if self.beam_width > 1:
+            return asyncio.run(self.run_beam_async())
+        if self.backend.async_only:
+            raise RuntimeError(f"the {self.backend.name} backend only answers calls made from run_async()")
+        saved = self._resume_checkpoint()
+        if saved and saved["status"] == "completed":
+            return self._journaled_result(saved)
+        if not self._open_budget():
+            return self._budget_skipped()
+        try:
+            self._print_connection_status()
+            
+            iteration = saved["iteration"] if saved else 0
+            pending = saved["state"]["pending"] if saved else None
+            while iteration < self.max_iterations:
+                if not self._admit_iteration_now(1, 1):
+                    break
+                self.iteration = iteration + 1
+                self._print_iteration_header(iteration)
+                
+                speculation = None
+                if pending:
+                    # The reaction was journaled before the restart; only the rewrite is outstanding
+                    reaction, rating, normalized_rating = pending
+                    pending = None
+                else:
+                    # User agent reads and reacts to article
+                    user_messages = self.user_agent.get_messages(self.current_article)
+                    speculation = self._start_speculation() if self.speculate else None
+                    if self.stream:
+                        reaction, rating, normalized_rating = self._stream_user_reaction(iteration, user_messages)
+                    else:
+                        user_response = self._chat("user", USER_MODEL, user_messages)
+                        reaction, rating, normalized_rating = self._apply_user_response(iteration, user_response)
+                    self._save_checkpoint("user", iteration, (reaction, rating, normalized_rating))
+                
+                # Check if target rating is reached
+                ended = self._iteration_end(iteration, normalized_rating)
+                editor_response = self._resolve_speculation(speculation, ended) if speculation else None
+                if ended:
+                    # The streamed reasoning's usage is charged before the iteration's reservation is released
+                    self._join_reasoning()
+                    self._settle_iteration()
+                    break
+                
+                # Editor agent edits the article
+                if editor_response is None:
+                    editor_messages = self.editor_agent.get_messages(self.current_article)
+                    editor_response = self._chat("editor", EDITOR_MODEL, editor_messages)
+                self._apply_editor_response(reaction, rating, editor_response)
+                
+                iteration += 1
+                # The next user call must not start before this one's turn is recorded
+                self._join_reasoning()
+                self._save_checkpoint("editor", iteration)
+                self._settle_iteration()
+            
+            self._print_completion(iteration)
+            
+            recommendation_messages = self.user_agent.get_recommendation_messages()
+            recommendation_response = self._chat("recommendation", RECOMMENDATION_MODEL, recommendation_messages)
+            recommendation_rating, recommendation_reasoning = self._apply_recommendation_response(iteration, recommendation_response)
+            self._join_reasoning()
+            self._complete_checkpoint(iteration, recommendation_rating, recommendation_reasoning)
+            
+            return self.user_agent.history, recommendation_rating, recommendation_reasoning
+        finally:
+            self._close_speculation()
+            self._close_budget()
+
+    async def run_async(self, limiter: Optional[RateLimiter] = None):
+        """Run the simulation using the async client so many sessions can share one event loop.
+
+        Blocking work such as database and CSV logging runs in a worker thread.
+
+        Args:
+            limiter: Optional rate limiter shared by every session in the cohort
+
+        Returns:
+            The same (history, recommendation_rating, recommendation_reasoning) tuple as run()
+        """
+        if self.beam_width > 1:
+            return await self.run_beam_async(limiter)
+        saved = await asyncio.to_thread(self._resume_checkpoint)
+        if saved and saved["status"] == "completed":
+            return self._journaled_result(saved)
+        if not self._open_budget():
+            return self._budget_skipped()
+        try:
+            self._print_connection_status()
+            
+            iteration = saved["iteration"] if saved else 0
+            pending = saved["state"]["pending"] if saved else None
+            while iteration < self.max_iterations:
+                if not await self._admit_iteration(1, 1):
+                    break
+                self.iteration = iteration + 1
+                self._print_iteration_header(iteration)
+                
+                speculation = None
+                if pending:
+                    reaction, rating, normalized_rating = pending
+                    pending = None
+                else:
+                    user_messages = self.user_agent.get_messages(self.current_article)
+                    if self.speculate:
+                        self._check_stop()
+                        editor_messages = self.editor_agent.get_messages(self.current_article)
+                        speculation = asyncio.create_task(self._acomplete(
+                            "editor", EDITOR_MODEL, editor_messages, limiter, self._call_context("editor")
+                        ))
+                    if self.stream:
+                        reaction, rating, normalized_rating = await asyncio.to_thread(
+                            self._stream_user_reaction, iteration, user_messages, limiter, asyncio.get_running_loop()
+                        )
+                    else:
+                        user_response = await self._achat("user", USER_MODEL, user_messages, limiter)
+                        reaction, rating, normalized_rating = await asyncio.to_thread(
+                            self._apply_user_response, iteration, user_response
+                        )
+                    await asyncio.to_thread(self._save_checkpoint, "user", iteration, (reaction, rating, normalized_rating))
+                
+                ended = self._iteration_end(iteration, normalized_rating)
+                editor_response = await self._aresolve_speculation(speculation, ended) if speculation else None
+                if ended:
+                    await asyncio.to_thread(self._join_reasoning)
+                    self._settle_iteration()
+                    break
+                
+                if editor_response is None:
+                    editor_messages = self.editor_agent.get_messages(self.current_article)
+                    editor_response = await self._achat("editor", EDITOR_MODEL, editor_messages, limiter)
+                self._apply_editor_response(reaction, rating, editor_response)
+                
+                iteration += 1
+                await asyncio.to_thread(self._join_reasoning)
+                await asyncio.to_thread(self._save_checkpoint, "editor", iteration)
+                self._settle_iteration()
+            
+            self._print_completion(iteration)
+            
+            recommendation_messages = self.user_agent.get_recommendation_messages()
+            recommendation_response = await self._achat("recommendation", RECOMMENDATION_MODEL, recommendation_messages, limiter)
+            recommendation_rating, recommendation_reasoning = await asyncio.to_thread(
+                self._apply_recommendation_response, iteration, recommendation_response
+            )
+            await asyncio.to_thread(self._join_reasoning)
+            await asyncio.to_thread(self._complete_checkpoint, iteration, recommendation_rating, recommendation_reasoning)
+            
+            return self.user_agent.history, recommendation_rating, recommendation_reasoning
+        finally:
+            self._close_budget()
+
+    def _candidate_params(self, candidate: int) -> Dict:
+        """Completion parameters of one beam candidate; with a session seed, distinct seeds make the rewrites differ."""
+        params = self._completion_params()
+        if self.seed is not None:
+            params["seed"] = self.seed + candidate
+        return params
+
+    async def _beam_rewrite(self, article: str, candidate: int, limiter: Optional[RateLimiter]) -> Tuple[str, str]:
+        """Ask the editor for one candidate rewrite of `article`.
+
+        Returns:
+            A tuple containing (rewritten article, changes summary)
+        """
+        messages = self.editor_agent.get_messages(article)
+        context = {**self._call_context("editor"), "article": article, "candidate": candidate}
+        # Unseeded candidates send identical requests, so only the tag keeps their cached rewrites apart
+        response, record = await self._acomplete("editor", EDITOR_MODEL, messages, limiter, context,
+                                                 self._candidate_params(candidate), cache_tag={"candidate": candidate})
+        edited_article, _, changes = self.editor_agent.process_response(response)
+        record.candidate = candidate
+        self._note_parse_result(record, self.editor_agent.last_parse_failed)
+        self.telemetry.record(record)
+        return edited_article, changes
+
+    async def _beam_score(self, article: str, candidate: int, limiter: Optional[RateLimiter]) -> Tuple[str, float, str]:
+        """Have the persona react to one candidate article.
+
+        Returns:
+            A tuple containing (reaction, rating, reasoning)
+        """
+        messages = self.user_agent.get_messages(article)
+        context = {**self._call_context("user"), "article": article}
+        response, record = await self._acomplete("user", USER_MODEL, messages, limiter, context)
+        reaction, rating, reasoning = self.user_agent.process_response(response)
+        record.candidate = candidate
+        self._note_parse_result(record, self.user_agent.last_parse_failed)
+        self.telemetry.record(record)
+        return reaction, rating, reasoning
+
+    def _commit_beam_round(self, round_index: int, scored: List[Tuple]) -> float:
+        """Carry the top-k candidates of a round forward and make the best one current.
+
+        Args:
+            round_index: Zero-based round; round 0 scores the seed article
+            scored: (article, changes, reaction, rating, reasoning) per candidate
+
+        Returns:
+            The normalized rating of the best candidate
+        """
+        ranked = sorted(scored, key=lambda c: c[3], reverse=True)
+        kept = ranked[:self.beam_keep]
+        print(f"Round {round_index}: candidate ratings {[c[3] for c in scored]}, keeping {[c[3] for c in kept]}")
+        for article, changes, _, _, _ in kept:
+            if changes is not None:
+                self._store_revision(article, self.current_article)
+        if kept[0][1] is not None:
+            # The best rewrite continues the editor's conversation; candidate i was written from beam entry i mod k
+            source = self._beam[scored.index(kept[0]) % len(self._beam)]
+            self.editor_agent.add_turn(source, {"changes_summary": kept[0][1], "article": kept[0][0]})
+        # The runners-up go into memory first so the best candidate is the most recent entry
+        for article, _, reaction, rating, _ in reversed(kept[1:]):
+            self.user_agent.add_to_memory(article, reaction, rating)
+        for article, _, reaction, rating, _ in reversed(kept):
+            self.editor_agent.add_to_memory(article, reaction, rating)
         
-        return self.user_agent.history, recommendation_rating, recommendation_reasoning
+        best_article, changes, reaction, rating, reasoning = kept[0]
+        if changes is not None:
+            self._record_article_edit(diff_texts(self.current_article, best_article))
+            print(f"\nEditor's Changes Summary:")
+            print(f"{changes}")
+        self.current_article = best_article
+        self._beam = [c[0] for c in kept]
+        _, _, normalized_rating = self._record_user_reaction(round_index, reaction, rating, reasoning)
+        return normalized_rating
+
+    async def run_beam_async(self, limiter: Optional[RateLimiter] = None):
+        """Run the simulation as a beam search over editor rewrites.
+
+        Each round the editor writes `beam_width` candidates from the articles
+        kept last round, the persona scores all of them concurrently, and the
+        best `beam_keep` carry forward into both agents' memory. Round 0 scores
+        the seed article; the session stops once the best candidate reaches
+        the target rating or after `max_iterations` rounds in total.
+
+        Returns:
+            The same (history, recommendation_rating, recommendation_reasoning) tuple as run()
+        """
+        saved = await asyncio.to_thread(self._resume_checkpoint)
+        if saved and saved["status"] == "completed":
+            return self._journaled_result(saved)
+        if not self._open_budget():
+            return self._budget_skipped()
+        try:
+            self._print_connection_status()
+            
+            if not saved:
+                self._beam = [self.current_article]
+            round_index = saved["iteration"] if saved else 0
+            pending = saved["state"]["pending"] if saved else None
+            finished = bool(saved) and saved["phase"] in ("target", "stopped")
+            while not finished and round_index < self.max_iterations:
+                # Round 0 only scores the seed article
+                candidate_count = self.beam_width if round_index else 1
+                if not await self._admit_iteration(candidate_count, candidate_count if round_index else 0):
+                    break
+                self.iteration = round_index + 1
+                self._print_iteration_header(round_index)
+                self._check_stop()
+                
+                if pending:
+                    # The rewrites of this round were journaled before the restart
+                    candidates = [tuple(candidate) for candidate in pending]
+                    pending = None
+                elif round_index == 0:
+                    candidates = [(self.current_article, None)]
+                else:
+                    candidates = await asyncio.gather(*(
+                        self._beam_rewrite(self._beam[i % len(self._beam)], i, limiter) for i in range(self.beam_width)
+                    ))
+                    await asyncio.to_thread(self._save_checkpoint, "rewrites", round_index, candidates)
+                scores = await asyncio.gather(*(
+                    self._beam_score(article, i, limiter) for i, (article, _) in enumerate(candidates)
+                ))
+                scored = [(article, changes, *score) for (article, changes), score in zip(candidates, scores)]
+                normalized_rating = await asyncio.to_thread(self._commit_beam_round, round_index, scored)
+                
+                if normalized_rating >= self.target_rating:
+                    print(f"Target rating {self.target_rating} (normalized from 1-4 scale) reached after {round_index} rounds")
+                    self.rounds_to_target = round_index
+                    self.stop_reason = "target"
+                    await asyncio.to_thread(self._save_checkpoint, "target", round_index)
+                    self._settle_iteration()
+                    break
+                if self._policy_stop(round_index):
+                    await asyncio.to_thread(self._save_checkpoint, "stopped", round_index)
+                    self._settle_iteration()
+                    break
+                round_index += 1
+                await asyncio.to_thread(self._save_checkpoint, "round", round_index)
+                self._settle_iteration()
+            
+            self._print_completion(round_index)
+            
+            recommendation_messages = self.user_agent.get_recommendation_messages()
+            recommendation_response = await self._achat("recommendation", RECOMMENDATION_MODEL, recommendation_messages, limiter)
+            recommendation_rating, recommendation_reasoning = await asyncio.to_thread(
+                self._apply_recommendation_response, round_index, recommendation_response
+            )
+            await asyncio.to_thread(self._complete_checkpoint, round_index, recommendation_rating, recommendation_reasoning)
+            
+            return self.user_agent.history, recommendation_rating, recommendation_reasoning
+        finally:
+            self._close_budget()
 
 def load_personas(file_path='personas.json'):
     """Load personas from JSON file"""
@@ -546,7 +1910,8 @@ def load_personas(file_path='personas.json'):
             print(f"Error loading personas from alternate path: {e2}")
             return []
 
-def main():
+def get_personas_to_run() -> List[Dict]:
+    """Load the personas to simulate, falling back to a built-in example persona."""
     # Load personas from file
     personas = load_personas()
     
@@ -608,49 +1973,323 @@ def main():
                 "narrative": "Brian is an electrician living in Dartmouth. He got the initial two COVID shots mainly because of travel and social pressures but has skipped subsequent boosters. He spends time online reading forums and watching videos that question the official narrative on vaccine safety and effectiveness, finding mainstream news untrustworthy. He's concerned about potential long-term health impacts that might not be known yet and feels healthy enough to handle COVID if he gets it. He dislikes feeling pressured by public health officials and prefers to make his own choices based on his research and gut feeling."
             }
         }
-        personas_to_run = [persona_data]
-    else:
-        # Use all personas from the file
-        personas_to_run = personas
+        return [persona_data]
+    
+    # Use all personas from the file
+    return personas
+
+def build_result(index: int, persona_data: Dict, sim: Simulation, history, recommendation_rating, recommendation_reasoning) -> Dict:
+    """Collect the summary fields for a finished simulation."""
+    return {
+        'persona_name': persona_data['persona']['persona_name'],
+        'persona_id': persona_data['persona'].get('persona_id', f"unknown_{index}"),
+        'final_rating': sim.user_agent.current_rating,
+        'history': history,
+        'recommendation_rating': recommendation_rating,
+        'recommendation_reasoning': recommendation_reasoning,
+        'session_id': sim.user_agent.session_id,
+        'beam_width': sim.beam_width,
+        'rounds_to_target': sim.rounds_to_target,
+        'stop_reason': sim.stop_reason,
+        'edit_similarity': [edit['similarity'] for edit in sim.article_edits]
+    }
+
+def print_summary(results: List[Dict]) -> None:
+    """Print the cohort summary for the results collected so far."""
+    print("\n=== SIMULATION SUMMARY ===")
+    for result in results:
+        print(f"Persona: {result['persona_name']} (ID: {result['persona_id']})")
+        print(f"  - Final Rating: {result['final_rating']}/4")
+        print(f"  - Recommendation Rating: {result['recommendation_rating']}/4")
+        print(f"  - Stopped by: {result['stop_reason']}")
+        print(f"  - Recommendation Reasoning: {result['recommendation_reasoning'][:150]}..." if len(result['recommendation_reasoning']) > 150 else result['recommendation_reasoning'])
+
+def print_beam_report(results: List[Dict], telemetry: Telemetry) -> None:
+    """Compare rounds-to-target and per-persona cost across the beam widths that were run."""
+    sessions = telemetry.by_session()
+    by_width: Dict[int, List[Dict]] = {}
+    for result in results:
+        by_width.setdefault(result['beam_width'], []).append(result)
+    
+    print("\n=== BEAM WIDTH COMPARISON ===")
+    print(f"{'width':>5} {'personas':>8} {'reached':>8} {'avg rounds':>10} {'calls/persona':>13} {'tokens/persona':>14}")
+    for width, width_results in sorted(by_width.items()):
+        rounds = [r['rounds_to_target'] for r in width_results if r['rounds_to_target'] is not None]
+        costs = [sessions.get(r['session_id'], {}) for r in width_results]
+        calls = sum(c.get('calls', 0) for c in costs) / len(width_results)
+        tokens = sum(c.get('prompt_tokens', 0) + c.get('completion_tokens', 0) for c in costs) / len(width_results)
+        avg_rounds = f"{sum(rounds) / len(rounds):.1f}" if rounds else "-"
+        print(f"{width:>5} {len(width_results):>8} {len(rounds):>8} {avg_rounds:>10} {calls:>13.1f} {tokens:>14.0f}")
+
+def print_parse_report(telemetry: Telemetry) -> None:
+    """Show how often responses failed to parse, per model and per persona, and what re-asks recovered."""
+    print("\n=== PARSE FAILURES ===")
+    print(f"{'':<40} {'calls':>6} {'failed':>6} {'rate':>6} {'re-asks':>7} {'recovered':>9}")
+    for label, groups in (("model", telemetry.by_model()), ("persona", telemetry.by_persona())):
+        for key, totals in sorted(groups.items()):
+            if label == "persona" and not totals["parse_failures"]:
+                continue
+            recovered = totals["reasks"] - totals["reask_failures"]
+            print(f"{f'{label} {key}':<40.40} {totals['parsed_calls']:>6} {totals['parse_failures']:>6} "
+                  f"{totals['parse_failure_rate']:>6.1%} {totals['reasks']:>7} {recovered:>9}")
+
+def finish_run(cache: Optional[CompletionCache], supabase_writer: Optional[WriteBehindWriter],
+               sink: Optional[ResultSink] = None, telemetry: Optional[Telemetry] = None,
+               metrics_path: Optional[str] = None, checkpoint: Optional[CheckpointJournal] = None,
+               local_store: Optional[LocalResponseStore] = None,
+               article_store: Optional[ArticleStore] = None,
+               governor: Optional[BudgetGovernor] = None) -> None:
+    """Drain shared resources at the end of a run and report their statistics."""
+    if telemetry:
+        totals = telemetry.totals()
+        print(f"LLM calls: {totals['calls']}, prompt tokens: {totals['prompt_tokens']}, "
+              f"completion tokens: {totals['completion_tokens']}, parse failures: {totals['parse_failures']}")
+        if totals["cached_tokens"]:
+            print(f"Cached prompt tokens: {totals['cached_tokens']} "
+                  f"({totals['cached_tokens'] / totals['prompt_tokens']:.0%} of prompt tokens)")
+        if totals["parse_failures"] or totals["reasks"]:
+            print_parse_report(telemetry)
+        if totals["speculative_calls"]:
+            hit_rate = totals["speculation_hits"] / totals["speculative_calls"]
+            print(f"Speculative editor calls: {totals['speculative_calls']}, hit rate {hit_rate:.0%}, "
+                  f"wall-clock saved {totals['speculation_seconds_saved']:.1f}s")
+        if metrics_path:
+            telemetry.write_report(metrics_path)
+            print(f"Metrics report written to {metrics_path}")
+    if sink:
+        sink.close()
+        print(f"Wrote {sink.rows_written} result rows to {sink.path}")
+    if supabase_writer:
+        supabase_writer.close()
+        print(f"Supabase writer: {supabase_writer.stats}")
+    if local_store:
+        local_store.close()
+        print(f"Local database {local_store.path}: {local_store.stats}")
+    if article_store:
+        print(f"Article store {article_store.path}: {article_store.stats()}")
+        article_store.close()
+    if cache:
+        print(f"Completion cache: {cache.stats()}")
+    if governor:
+        print(f"Budget: {governor.stats()}")
+    if checkpoint:
+        print(f"Checkpoint journal {checkpoint.path}: {checkpoint.stats()}")
+
+def add_session_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options that shape every session, shared by this command line and the job-queue worker's."""
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="openai",
+                        help="'offline' uses a deterministic local persona model instead of the OpenAI API")
+    parser.add_argument("--cache", default=None, metavar="PATH",
+                        help="Cache completions in this SQLite file and reuse identical requests")
+    parser.add_argument("--cache-max-mb", type=float, default=None,
+                        help="Evict least-recently-used cache entries beyond this size")
+    parser.add_argument("--cache-ttl", type=float, default=None,
+                        help="Seconds before a cached completion expires")
+    parser.add_argument("--cache-only", action="store_true",
+                        help="Fail instead of calling the API when a completion is not cached")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream user responses and continue as soon as the reaction and rating arrive")
+    parser.add_argument("--speculate", action="store_true",
+                        help="Start each editor rewrite while the persona is still evaluating the article")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Ask for JSON responses and re-ask only for the fields a response lacked")
+    parser.add_argument("--max-reasks", type=int, default=DEFAULT_MAX_REASKS, metavar="N",
+                        help="Follow-up calls per response with --structured-output")
+    parser.add_argument("--stopping-policy", dest="stopping_policies", type=parse_policy, action="append",
+                        default=[], metavar="SPEC",
+                        help="End sessions early when a policy says further iterations won't pay off "
+                             "(repeatable): plateau, slope, oscillation or confidence, optionally with "
+                             "settings such as plateau:window=4,tolerance=0.03")
+    parser.add_argument("--prompt-mode", choices=PROMPT_MODES, default="full",
+                        help="'compact' renders minified personas and fits memory into a token budget")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help=f"Prompt token budget in compact mode (default {DEFAULT_TOKEN_BUDGET})")
+    parser.add_argument("--prompt-layout", choices=PROMPT_LAYOUTS, default="single",
+                        help="'conversation' keeps a fixed system prompt and appends each iteration as "
+                             "chat turns, so repeated prefixes hit the provider's prompt cache")
+    parser.add_argument("--metrics-json", default=None, metavar="PATH",
+                        help="Write a JSON report of per-call LLM metrics to this file")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port while the run is in progress")
+    parser.add_argument("--results", default=None, metavar="PATH",
+                        help="Write every session's rows to one file (.parquet, .arrow or .csv)")
+
+def session_kwargs(args: argparse.Namespace) -> Dict:
+    """Simulation keyword arguments for the options added by add_session_arguments()."""
+    return {
+        "prompt_mode": args.prompt_mode,
+        "prompt_layout": args.prompt_layout,
+        "token_budget": args.token_budget,
+        "backend": create_backend(args.backend),
+        "stream": args.stream,
+        "speculate": args.speculate,
+        "structured": args.structured_output,
+        "max_reasks": args.max_reasks,
+        "stopping_policies": args.stopping_policies
+    }
+
+def open_cache(args: argparse.Namespace) -> Optional[CompletionCache]:
+    """The completion cache asked for by the options added by add_session_arguments(), if any."""
+    if not args.cache:
+        return None
+    return CompletionCache(
+        args.cache,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None,
+        ttl_seconds=args.cache_ttl,
+        cache_only=args.cache_only
+    )
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run persona/editor article simulations")
+    add_session_arguments(parser)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run persona sessions concurrently with the async client")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of sessions in flight in async mode")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Requests-per-minute limit shared by all sessions in async mode")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="Tokens-per-minute limit shared by all sessions in async mode")
+    parser.add_argument("--batch", action="store_true",
+                        help="Advance all sessions in lockstep rounds sent as batch-API JSONL files: the "
+                             "OpenAI Batch API with the openai backend, processed locally with any other")
+    parser.add_argument("--batch-dir", default="batches", metavar="PATH",
+                        help="Directory under which each batch run keeps its request and results files")
+    parser.add_argument("--batch-poll-seconds", type=float, default=60,
+                        help="Seconds between status checks of a submitted batch")
+    parser.add_argument("--beam-width", type=int, nargs="+", default=[1], metavar="N",
+                        help="Editor candidates per round; several widths run the cohort once each and compare them")
+    parser.add_argument("--beam-keep", type=int, default=1, metavar="K",
+                        help="Best candidates per round that carry forward into memory in beam mode")
+    parser.add_argument("--local-db", default=None, metavar="PATH",
+                        help="Also write rows in the persona_responses schema to this embedded SQLite database")
+    parser.add_argument("--article-store", default=None, metavar="PATH",
+                        help="Keep article versions deduplicated and delta-compressed in this SQLite file; "
+                             "result rows and agent memory then hold article hashes")
+    parser.add_argument("--checkpoint", default=None, metavar="PATH",
+                        help="Journal every session's state after each call to this SQLite file")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip sessions the checkpoint journal holds as completed and continue partial ones "
+                             f"(journal defaults to {DEFAULT_CHECKPOINT_PATH})")
+    parser.add_argument("--budget-tokens", type=int, default=None,
+                        help="Total prompt and completion tokens the run may spend")
+    parser.add_argument("--budget-usd", type=float, default=None,
+                        help="Total USD the run may spend at list prices")
+    parser.add_argument("--budget-seconds", type=float, default=None,
+                        help="Seconds after which sessions finish instead of starting another iteration")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    print_environment_diagnostics()
+    personas_to_run = get_personas_to_run()
     
     # Check for Supabase parameters and determine whether to use DB
-    use_db = all([os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")])
+    supabase_url, supabase_key = get_supabase_credentials()
+    use_db = all([supabase_url, supabase_key])
     
     print(f"Running simulations for {len(personas_to_run)} personas")
     
+    telemetry = Telemetry()
+    if args.metrics_port:
+        telemetry.serve(args.metrics_port)
+    simulation_kwargs = {**session_kwargs(args), "telemetry": telemetry}
+    local_store = None
+    if args.local_db:
+        local_store = LocalResponseStore(args.local_db)
+        simulation_kwargs["local_store"] = local_store
+    article_store = None
+    if args.article_store:
+        article_store = ArticleStore(args.article_store)
+        simulation_kwargs["article_store"] = article_store
+    checkpoint = None
+    if args.checkpoint or args.resume:
+        checkpoint = CheckpointJournal(args.checkpoint or DEFAULT_CHECKPOINT_PATH)
+        simulation_kwargs["checkpoint"] = checkpoint
+        simulation_kwargs["resume"] = args.resume
+    governor = None
+    if args.budget_tokens is not None or args.budget_usd is not None or args.budget_seconds is not None:
+        governor = BudgetGovernor(args.budget_tokens, args.budget_usd, args.budget_seconds, slots=args.concurrency)
+        telemetry.add_listener(governor.charge)
+        simulation_kwargs["governor"] = governor
+        if not args.use_async:
+            # Sessions can only compete for the budget while they run side by side
+            print("A budget runs sessions concurrently; using the async runner")
+            args.use_async = True
+    cache = open_cache(args)
+    if cache:
+        simulation_kwargs["cache"] = cache
+    
+    sink = open_sink(args.results) if args.results else default_result_sink(None, use_db, local_store)
+    if sink:
+        simulation_kwargs["sink"] = sink
+    
+    # One write-behind queue shared by every session batches inserts across the whole run
+    supabase_writer = None
+    if use_db:
+        try:
+            supabase_writer = WriteBehindWriter(supabase_inserter(create_supabase_client(supabase_url, supabase_key), SUPABASE_TABLE))
+            simulation_kwargs["supabase_writer"] = supabase_writer
+        except Exception as e:
+            print(f"Could not start shared Supabase writer, sessions will use their own: {e}")
+    
     results = []
-    # Run simulation for each persona
-    for i, persona_data in enumerate(personas_to_run):
-        print(f"\nSimulating persona {i+1}/{len(personas_to_run)}: {persona_data['persona']['persona_name']}")
-        
-        # Run simulation
-        sim = Simulation(persona_data, use_db=use_db)
-        history, recommendation_rating, recommendation_reasoning = sim.run()
-        results.append({
-            'persona_name': persona_data['persona']['persona_name'],
-            'persona_id': persona_data['persona'].get('persona_id', f"unknown_{i}"),
-            'final_rating': sim.user_agent.current_rating,
-            'history': history,
-            'recommendation_rating': recommendation_rating,
-            'recommendation_reasoning': recommendation_reasoning
-        })
+    for beam_width in args.beam_width:
+        simulation_kwargs["beam_width"] = beam_width
+        simulation_kwargs["beam_keep"] = min(args.beam_keep, beam_width)
+        if len(args.beam_width) > 1:
+            print(f"\n=== Beam width {beam_width} ===")
         
-        # Output individual result
-        if hasattr(sim, 'output_file'):
-            print(f"Simulation completed. Results saved to {sim.output_file}")
-        else:
-            print("Simulation completed. Results saved to Supabase.")
+        if args.batch:
+            from batch_runner import run_personas_batch, create_batch_executor
+            results.extend(asyncio.run(run_personas_batch(
+                personas_to_run,
+                create_batch_executor(simulation_kwargs["backend"], args.batch_poll_seconds),
+                use_db=use_db,
+                batch_dir=args.batch_dir,
+                **simulation_kwargs
+            )))
+            print_summary(results)
+            continue
         
-        print(f"Final rating: {sim.user_agent.current_rating}/4")
-        print(f"Recommendation rating: {recommendation_rating}/4")
+        if args.use_async:
+            from async_runner import run_personas_async
+            results.extend(asyncio.run(run_personas_async(
+                personas_to_run,
+                use_db=use_db,
+                concurrency=args.concurrency,
+                requests_per_minute=args.rpm,
+                tokens_per_minute=args.tpm,
+                **simulation_kwargs
+            )))
+            print_summary(results)
+            continue
         
-        # Output summary
-        print("\n=== SIMULATION SUMMARY ===")
-        for result in results:
-            print(f"Persona: {result['persona_name']} (ID: {result['persona_id']})")
-            print(f"  - Final Rating: {result['final_rating']}/4")
-            print(f"  - Recommendation Rating: {result['recommendation_rating']}/4")
-            print(f"  - Recommendation Reasoning: {result['recommendation_reasoning'][:150]}..." if len(result['recommendation_reasoning']) > 150 else result['recommendation_reasoning'])
+        # Run simulation for each persona
+        for i, persona_data in enumerate(personas_to_run):
+            print(f"\nSimulating persona {i+1}/{len(personas_to_run)}: {persona_data['persona']['persona_name']}")
+            
+            # Run simulation
+            sim = Simulation(persona_data, use_db=use_db, **simulation_kwargs)
+            history, recommendation_rating, recommendation_reasoning = sim.run()
+            results.append(build_result(i, persona_data, sim, history, recommendation_rating, recommendation_reasoning))
+            
+            # Output individual result
+            if hasattr(sim, 'output_file'):
+                print(f"Simulation completed. Results saved to {sim.output_file}")
+            else:
+                print("Simulation completed. Results saved to Supabase.")
+            
+            print(f"Final rating: {sim.user_agent.current_rating}/4")
+            print(f"Recommendation rating: {recommendation_rating}/4")
+            
+            # Output summary
+            print_summary(results)
+    
+    if len(args.beam_width) > 1:
+        print_beam_report(results, telemetry)
+    finish_run(cache, supabase_writer, sink, telemetry, args.metrics_json, checkpoint, local_store,
+               article_store, governor)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
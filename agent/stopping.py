@@ -0,0 +1,184 @@
+import math
+from typing import Dict, List, Optional, Sequence
+
+# Policies a run can be given on the command line, as "name" or "name:key=value,key=value"
+STOPPING_POLICIES: Dict[str, type] = {}
+
+
+def _register(cls: type) -> type:
+    STOPPING_POLICIES[cls.name] = cls
+    return cls
+
+
+class StoppingPolicy:
+    """Decides from a session's ratings so far whether further iterations are worth their calls.
+
+    Policies see normalized (0-1) ratings in iteration order, the latest
+    last, and are only asked while the target rating has not been reached.
+    """
+    name = ""
+
+    def params(self) -> Dict[str, float]:
+        return {}
+
+    def describe(self) -> str:
+        """The policy with its settings, in the form parse_policy() accepts."""
+        params = ",".join(f"{key}={value:g}" for key, value in self.params().items())
+        return f"{self.name}:{params}" if params else self.name
+
+    def check(self, ratings: Sequence[float], target: float, remaining: int) -> Optional[str]:
+        """Return why the session should stop now, or None to continue.
+
+        Args:
+            ratings: Normalized ratings so far, the latest last
+            target: Normalized target rating
+            remaining: Iterations left before max_iterations
+        """
+        raise NotImplementedError
+
+
+@_register
+class PlateauPolicy(StoppingPolicy):
+    """Stop once the last `window` ratings all lie within `tolerance` of each other."""
+    name = "plateau"
+
+    def __init__(self, window: int = 3, tolerance: float = 0.05) -> None:
+        if window < 2:
+            raise ValueError("plateau window must be at least 2")
+        self.window = int(window)
+        self.tolerance = tolerance
+
+    def params(self) -> Dict[str, float]:
+        return {"window": self.window, "tolerance": self.tolerance}
+
+    def check(self, ratings: Sequence[float], target: float, remaining: int) -> Optional[str]:
+        recent = ratings[-self.window:]
+        if len(recent) == self.window and max(recent) - min(recent) <= self.tolerance:
+            return f"plateau: last {self.window} ratings within {self.tolerance:g}"
+        return None
+
+
+@_register
+class SlopePolicy(StoppingPolicy):
+    """Stop once the least-squares trend over the last `window` ratings gains less than `min_slope` per iteration."""
+    name = "slope"
+
+    def __init__(self, window: int = 4, min_slope: float = 0.02) -> None:
+        if window < 2:
+            raise ValueError("slope window must be at least 2")
+        self.window = int(window)
+        self.min_slope = min_slope
+
+    def params(self) -> Dict[str, float]:
+        return {"window": self.window, "min_slope": self.min_slope}
+
+    def check(self, ratings: Sequence[float], target: float, remaining: int) -> Optional[str]:
+        recent = ratings[-self.window:]
+        if len(recent) < self.window:
+            return None
+        slope = _slope(recent)
+        if slope < self.min_slope:
+            return f"slope: {slope:.3f} per iteration over the last {self.window} ratings"
+        return None
+
+
+@_register
+class OscillationPolicy(StoppingPolicy):
+    """Stop once the last `swings` rating changes alternate in direction, each by at least `min_swing`.
+
+    An editor that keeps undoing its own progress rarely settles on a
+    version the persona rates higher.
+    """
+    name = "oscillation"
+
+    def __init__(self, swings: int = 3, min_swing: float = 0.05) -> None:
+        if swings < 2:
+            raise ValueError("oscillation needs at least 2 swings")
+        self.swings = int(swings)
+        self.min_swing = min_swing
+
+    def params(self) -> Dict[str, float]:
+        return {"swings": self.swings, "min_swing": self.min_swing}
+
+    def check(self, ratings: Sequence[float], target: float, remaining: int) -> Optional[str]:
+        changes = [current - previous for previous, current in zip(ratings, ratings[1:])][-self.swings:]
+        if len(changes) < self.swings or any(abs(change) < self.min_swing for change in changes):
+            return None
+        if all((a > 0) != (b > 0) for a, b in zip(changes, changes[1:])):
+            return f"oscillation: last {self.swings} rating changes alternate in direction"
+        return None
+
+
+@_register
+class ConfidencePolicy(StoppingPolicy):
+    """Stop once even an optimistic projection of the remaining iterations falls short of the target.
+
+    The per-iteration gain is modelled from the session's own changes so far:
+    after `remaining` more iterations the rating is expected to rise by
+    remaining * mean, with a standard deviation of sqrt(remaining) * stdev.
+    The session stops when that projection plus `z` standard deviations
+    (z=1.64 is a one-sided 95% bound) is still below the target.
+    """
+    name = "confidence"
+
+    def __init__(self, z: float = 1.64, min_ratings: int = 3) -> None:
+        if min_ratings < 3:
+            raise ValueError("confidence bound needs at least 3 ratings")
+        self.z = z
+        self.min_ratings = int(min_ratings)
+
+    def params(self) -> Dict[str, float]:
+        return {"z": self.z, "min_ratings": self.min_ratings}
+
+    def check(self, ratings: Sequence[float], target: float, remaining: int) -> Optional[str]:
+        if len(ratings) < self.min_ratings:
+            return None
+        changes = [current - previous for previous, current in zip(ratings, ratings[1:])]
+        mean = sum(changes) / len(changes)
+        stdev = math.sqrt(sum((change - mean) ** 2 for change in changes) / (len(changes) - 1)) if len(changes) > 1 else 0.0
+        bound = ratings[-1] + remaining * mean + self.z * stdev * math.sqrt(remaining)
+        if bound < target:
+            return f"confidence: upper bound {bound:.3f} after {remaining} more iterations is below the target"
+        return None
+
+
+def _slope(values: Sequence[float]) -> float:
+    """Least-squares slope of evenly spaced values."""
+    n = len(values)
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    variance = sum((x - mean_x) ** 2 for x in range(n))
+    return covariance / variance
+
+
+def parse_policy(spec: str) -> StoppingPolicy:
+    """Build a policy from "name" or "name:key=value,key=value", e.g. "plateau:window=4,tolerance=0.03"."""
+    name, _, options = spec.partition(":")
+    if name not in STOPPING_POLICIES:
+        raise ValueError(f"Unknown stopping policy {name!r}, expected one of {sorted(STOPPING_POLICIES)}")
+    kwargs = {}
+    for option in filter(None, options.split(",")):
+        key, separator, value = option.partition("=")
+        if not separator:
+            raise ValueError(f"Stopping policy option {option!r} is not of the form key=value")
+        kwargs[key.strip()] = float(value)
+    try:
+        return STOPPING_POLICIES[name](**kwargs)
+    except TypeError as e:
+        raise ValueError(f"Invalid options for stopping policy {name!r}: {e}") from e
+
+
+def describe_policies(policies: Sequence[StoppingPolicy]) -> str:
+    """All of a run's policies in one string, as recorded with its results."""
+    return ";".join(policy.describe() for policy in policies)
+
+
+def first_stop(policies: Sequence[StoppingPolicy], ratings: List[float], target: float,
+               remaining: int) -> Optional[str]:
+    """The reason given by the first policy that says to stop, or None."""
+    for policy in policies:
+        reason = policy.check(ratings, target, remaining)
+        if reason:
+            return reason
+    return None
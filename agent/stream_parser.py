@@ -0,0 +1,70 @@
+import re
+from typing import List, Optional
+
+# REACTION and RATING are settled once the rating line ends or REASONING begins
+_HEADER = re.compile(r"REACTION:(.*?)RATING:[ \t]*(\S[^\n]*?)[ \t]*(?:\n|REASONING:)", re.S)
+# In a structured response they are settled once the value after "rating" ends
+_JSON_HEADER = re.compile(r'"reaction"\s*:\s*"((?:[^"\\]|\\.)*)"\s*,\s*"rating"\s*:\s*"?([^\s",}]+)"?\s*[,}]')
+
+
+class ReactionStreamParser:
+    """Incrementally parses a streamed REACTION/RATING/REASONING user response.
+
+    The reaction and rating are available as soon as the rating line is
+    complete, long before the reasoning has finished streaming. A structured
+    parser reads the same fields from a JSON object whose "reaction" and
+    "rating" keys come first.
+    """
+
+    def __init__(self, structured: bool = False) -> None:
+        self._header = _JSON_HEADER if structured else _HEADER
+        self._parts: List[str] = []
+        self._head = ""
+        self.reaction: Optional[str] = None
+        self.rating: Optional[float] = None
+        # True once the header was found but its rating could not be read
+        self.failed = False
+
+    @property
+    def header_decided(self) -> bool:
+        """Whether feeding more text can no longer change reaction and rating."""
+        return self.rating is not None or self.failed
+
+    @property
+    def text(self) -> str:
+        """Everything received so far."""
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> bool:
+        """Add a chunk of the response.
+
+        Returns:
+            True once the reaction and rating are decided
+        """
+        self._parts.append(chunk)
+        if not self.header_decided:
+            self._head += chunk
+            match = self._header.search(self._head)
+            if match:
+                self._parse_header(match.group(1).strip(), match.group(2))
+        return self.header_decided
+
+    def _parse_header(self, reaction: str, rating_str: str) -> None:
+        try:
+            # Handle cases like "4/4" or "4"
+            rating = float(rating_str.split("/")[0])
+        except ValueError:
+            self.failed = True
+            return
+        if not 1 <= rating <= 4:
+            print(f"Warning: Rating {rating} out of bounds, clamping to valid range")
+            rating = max(1, min(4, rating))
+        self.reaction = reaction
+        self.rating = rating
+
+    def reasoning(self) -> Optional[str]:
+        """The reasoning in the text received so far, or None if it has not started."""
+        text = self.text
+        if "REASONING:" not in text:
+            return None
+        return text.split("REASONING:")[1].strip()
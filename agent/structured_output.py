@@ -0,0 +1,147 @@
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Output formats an Agent can ask for: the labelled-section text format or a JSON object
+OUTPUT_FORMATS = ("text", "json")
+
+# Fields of each kind of response in the order the model writes them. Reaction
+# and rating come first so a streamed reaction is usable before its reasoning
+RESPONSE_FIELDS = {
+    "user": {
+        "reaction": {"type": "string", "enum": ["Positive", "Negative"]},
+        "rating": {"type": "number"},
+        "reasoning": {"type": "string"}
+    },
+    "editor": {
+        "changes_summary": {"type": "string"},
+        "article": {"type": "string"}
+    },
+    "recommendation": {
+        "recommendation_rating": {"type": "number"},
+        "reasoning": {"type": "string"}
+    }
+}
+
+# What each field must hold, as told to the model in prompts and re-asks
+FIELD_DESCRIPTIONS = {
+    "reaction": '"Positive" or "Negative"',
+    "rating": "number between 1 and 4",
+    "reasoning": "5-10 sentences explaining your reaction based on your persona",
+    "changes_summary": "a brief 2-3 sentence summary of what specific changes you are making to the article and why",
+    "article": "the full improved article text",
+    "recommendation_rating": "number between 1 and 4"
+}
+# The recommendation's reasoning explains something else than a reaction
+_KIND_DESCRIPTIONS = {
+    ("recommendation", "reasoning"): "5-10 sentences explaining your recommendation likelihood based on your persona"
+}
+
+# Fields holding a rating on the 1-4 scale
+RATING_FIELDS = ("rating", "recommendation_rating")
+
+
+def _describe(kind: str, field: str) -> str:
+    return _KIND_DESCRIPTIONS.get((kind, field), FIELD_DESCRIPTIONS[field])
+
+
+def response_format(kind: str, fields: Optional[Sequence[str]] = None) -> Dict:
+    """The `response_format` chat-completion parameter for a kind of response.
+
+    Args:
+        kind: "user", "editor" or "recommendation"
+        fields: Subset of the kind's fields to ask for, as in a re-ask (all if omitted)
+    """
+    fields = list(fields or RESPONSE_FIELDS[kind])
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{kind}_response",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {field: RESPONSE_FIELDS[kind][field] for field in fields},
+                "required": fields,
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def schema_fields(params: Dict) -> Optional[List[str]]:
+    """The fields a request's response_format asks for, or None for a free-text request."""
+    schema = (params.get("response_format") or {}).get("json_schema", {}).get("schema")
+    return list(schema["properties"]) if schema else None
+
+
+def format_instructions(kind: str) -> str:
+    """The prompt section telling the model which JSON object to reply with."""
+    lines = "\n".join(f'- "{field}": {_describe(kind, field)}' for field in RESPONSE_FIELDS[kind])
+    return f"Respond with a single JSON object with exactly these keys:\n{lines}"
+
+
+def reask_prompt(kind: str, missing: Sequence[str]) -> str:
+    """A short follow-up asking for only the fields a response lacked."""
+    lines = "\n".join(f'- "{field}": {_describe(kind, field)}' for field in missing)
+    return ("Your reply was missing these fields or had invalid values for them. "
+            f"Respond with only a JSON object with exactly these keys:\n{lines}")
+
+
+def _valid_value(field: str, value):
+    """Return the field's value in canonical form, or None if it is missing or invalid."""
+    if field in RATING_FIELDS:
+        if isinstance(value, str):
+            # Handle cases like "4/4" or "4"
+            value = value.split("/")[0].strip()
+        try:
+            rating = float(value)
+        except (TypeError, ValueError):
+            return None
+        if rating != rating:
+            return None
+        if not 1 <= rating <= 4:
+            print(f"Warning: Rating {rating} out of bounds, clamping to valid range")
+            rating = max(1.0, min(4.0, rating))
+        return rating
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    if field == "reaction":
+        if value.lower().startswith("positive"):
+            return "Positive"
+        if value.lower().startswith("negative"):
+            return "Negative"
+        return None
+    return value
+
+
+def parse_fields(kind: str, text: str) -> Tuple[Dict, List[str]]:
+    """Parse a JSON response in a single pass.
+
+    Text around the outermost braces, such as a Markdown code fence, is ignored.
+
+    Returns:
+        The valid fields and the names of the fields that are missing or invalid,
+        in the kind's field order
+    """
+    data = None
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            pass
+    if not isinstance(data, dict):
+        data = {}
+    fields, missing = {}, []
+    for field in RESPONSE_FIELDS[kind]:
+        value = _valid_value(field, data.get(field))
+        if value is None:
+            missing.append(field)
+        else:
+            fields[field] = value
+    return fields, missing
+
+
+def to_json(kind: str, fields: Dict) -> str:
+    """Serialize parsed fields in field order, e.g. a response merged from an answer and its re-ask."""
+    return json.dumps({field: fields[field] for field in RESPONSE_FIELDS[kind] if field in fields}, ensure_ascii=False)
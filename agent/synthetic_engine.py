@@ -0,0 +1,474 @@
+"""Vectorized generator for synthetic persona_responses data.
+
+Produces the same columns and distributions as generate_synthetic_data, but
+samples whole batches of sessions as NumPy arrays and yields column batches,
+so millions of sessions can be generated for load testing.
+"""
+import os
+import csv
+import json
+import time
+import string
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from generate_synthetic_data import (
+    ARTICLE_TEMPLATES, ARTICLE_VARIABLES, REASONING_TEMPLATES, REASONING_VARIABLES,
+    FIXED_PERSONAS, RATING_MIN, RATING_MAX, MAX_INITIAL_RATING, MAX_FINAL_RATING,
+    TARGET_NORMALIZED_RATING, SUCCESS_PERCENTAGE, MAX_ITERATIONS_PER_SESSION,
+    MAX_RATING_CHANGE_PER_ITERATION
+)
+
+# Column order of the persona_responses CSV, including the misspelled recommened columns
+COLUMNS = [
+    'session_id', 'iteration', 'persona_id', 'persona_name', 'current_rating',
+    'normalized_current_rating', 'reaction', 'article', 'recommened_rating',
+    'normalized_recommened_rating', 'reason', 'is_fact', 'is_real', 'editor_changes'
+]
+
+# Arrow type of every column, so all Parquet partitions share one schema, empty ones included
+PARQUET_TYPES = {
+    'session_id': 'string', 'iteration': 'int64', 'persona_id': 'int64', 'persona_name': 'string',
+    'current_rating': 'double', 'normalized_current_rating': 'double', 'reaction': 'string',
+    'article': 'string', 'recommened_rating': 'double', 'normalized_recommened_rating': 'double',
+    'reason': 'string', 'is_fact': 'bool', 'is_real': 'bool', 'editor_changes': 'string'
+}
+
+# Sessions sampled together in one column batch
+DEFAULT_BATCH_SESSIONS = 50000
+# Partition file formats generate_shards can write
+SHARD_FORMATS = ("csv", "parquet")
+# Partition count when none is given; output depends on it, so it is not derived from the CPU count
+DEFAULT_SHARDS = 8
+# Leading underscore so Parquet dataset readers skip it when reading the directory
+MANIFEST_NAME = "_manifest.json"
+
+# Same list generate_changes_summary draws from
+CHANGES = [
+    "Adjusted tone to better align with the reader's values",
+    "Added more specific data points from trusted sources",
+    "Emphasized community protection benefits",
+    "Included more information about safety monitoring",
+    "Acknowledged concerns while providing factual context",
+    "Added perspectives from diverse experts",
+    "Clarified the risk-benefit analysis",
+    "Included more detail about the research methodology",
+    "Focused more on long-term data",
+    "Addressed specific concerns mentioned in previous feedback"
+]
+
+_TARGET_STOP_RATING = TARGET_NORMALIZED_RATING * (RATING_MAX - RATING_MIN) + RATING_MIN
+
+
+class CompiledTemplates:
+    """Templates compiled once into tables of pre-rendered segments.
+
+    Each template's slots are grouped into runs whose option combinations
+    fit in `max_segments`, and every combination of a run is rendered with
+    its surrounding literal text up front. Filling a batch then draws an
+    option index per slot, combines them into one segment index per run,
+    and concatenates a handful of segment columns, instead of scanning
+    every variable name with str.replace for every row.
+    """
+
+    def __init__(self, templates: Sequence[str], variables: Dict[str, List[str]], max_segments: int = 4096) -> None:
+        # Per template: one (option counts, segment table) pair per run of slots
+        self.runs: List[List[Tuple[List[int], np.ndarray]]] = []
+        for template in templates:
+            runs, literals, slot_options, combinations = [], [], [], 1
+            trailing = ""
+            for literal, field, _, _ in string.Formatter().parse(template):
+                if field is None:
+                    trailing = literal
+                    continue
+                options = variables[field]
+                if slot_options and combinations * len(options) > max_segments:
+                    runs.append(self._compile_run(literals, slot_options, ""))
+                    literals, slot_options, combinations = [], [], 1
+                literals.append(literal)
+                slot_options.append(options)
+                combinations *= len(options)
+            runs.append(self._compile_run(literals, slot_options, trailing))
+            self.runs.append(runs)
+
+    @staticmethod
+    def _compile_run(literals: List[str], slot_options: List[List[str]], trailing: str) -> Tuple[List[int], np.ndarray]:
+        """Render every option combination of a run; literals[i] precedes slot i."""
+        table = [
+            "".join(literal + option for literal, option in zip(literals, combination)) + trailing
+            for combination in itertools.product(*slot_options)
+        ]
+        return [len(options) for options in slot_options], np.array(table, dtype=object)
+
+    def fill(self, rng: np.random.Generator, count: int) -> np.ndarray:
+        """Fill `count` templates, each chosen uniformly at random.
+
+        Returns:
+            An object array of strings
+        """
+        out = np.empty(count, dtype=object)
+        choice = rng.integers(len(self.runs), size=count)
+        for template, runs in enumerate(self.runs):
+            rows = np.flatnonzero(choice == template)
+            if not len(rows):
+                continue
+            text = None
+            for counts, table in runs:
+                index = np.zeros(len(rows), dtype=np.int64)
+                for options in counts:
+                    index = index * options + rng.integers(options, size=len(rows))
+                text = table[index] if text is None else text + table[index]
+            out[rows] = text
+        return out
+
+
+ARTICLES = CompiledTemplates(ARTICLE_TEMPLATES, ARTICLE_VARIABLES)
+REASONINGS = CompiledTemplates(REASONING_TEMPLATES, REASONING_VARIABLES)
+
+
+def _join_groups(parts: np.ndarray, lengths: np.ndarray, separator: str) -> np.ndarray:
+    """Join consecutive runs of strings, `lengths[i]` parts for group i."""
+    ends = np.cumsum(lengths)
+    separators = np.full(len(parts), separator, dtype=object)
+    separators[ends - 1] = ""
+    return np.add.reduceat(parts + separators, ends - lengths)
+
+
+def sample_articles(rng: np.random.Generator, count: int) -> np.ndarray:
+    """Articles of one main template sentence plus 1-3 extra ones, like generate_article."""
+    sentences = 1 + rng.integers(1, 4, size=count)
+    return _join_groups(ARTICLES.fill(rng, int(sentences.sum())), sentences, " ")
+
+
+def sample_reasonings(rng: np.random.Generator, count: int) -> np.ndarray:
+    return REASONINGS.fill(rng, count)
+
+
+def sample_changes(rng: np.random.Generator, count: int) -> np.ndarray:
+    """1-3 distinct change descriptions joined by ". ", like generate_changes_summary."""
+    changes = np.array(CHANGES, dtype=object)
+    picks = changes[np.argsort(rng.random((count, len(CHANGES))), axis=1)[:, :3]]
+    taken = rng.integers(1, 4, size=count)
+    text = picks[:, 0].copy()
+    for column in (1, 2):
+        more = taken > column
+        text[more] = text[more] + ". " + picks[more, column]
+    return text
+
+
+def sample_progressions(rng: np.random.Generator, count: int, success_share: float = SUCCESS_PERCENTAGE / 100):
+    """Sample the rating progressions of `count` sessions at once.
+
+    Follows calculate_realistic_progression column by column: successful
+    sessions climb in even steps of at most 0.1 over 4-6 iterations and then
+    jump to the target if they have not reached it within the 7-iteration
+    cap; the others wander below the target for the full 7 iterations.
+    Exactly round(count * success_share) sessions are successful.
+
+    Returns:
+        (ratings, lengths, success): ratings is a (count, 7) array padded with
+        NaN past each session's length
+    """
+    cap = MAX_ITERATIONS_PER_SESSION
+    success = np.zeros(count, dtype=bool)
+    success[rng.permutation(count)[:int(round(count * success_share))]] = True
+
+    ratings = np.full((count, cap), np.nan)
+    current = np.round(rng.uniform(RATING_MIN, MAX_INITIAL_RATING, size=count), 1)
+    ratings[:, 0] = current
+
+    # Successful sessions: even steps towards the target
+    max_steps = min(6, cap - 1)
+    steps_used = rng.integers(4, max_steps + 1, size=count)
+    step = np.minimum(MAX_RATING_CHANGE_PER_ITERATION, (_TARGET_STOP_RATING - current) / steps_used)
+    step[step <= 0] = MAX_RATING_CHANGE_PER_ITERATION
+    climbing = current.copy()
+    for column in range(1, max_steps + 1):
+        change = np.minimum(MAX_RATING_CHANGE_PER_ITERATION, step + rng.uniform(-0.01, 0.01, size=count))
+        climbing = np.round(np.minimum(_TARGET_STOP_RATING, climbing + change), 1)
+        active = success & (column <= steps_used)
+        ratings[active, column] = climbing[active]
+    lengths = np.where(success, steps_used + 1, cap)
+    # Those still below the target get one final step onto it, if the cap allows
+    last = ratings[np.arange(count), lengths - 1]
+    forced = success & ((last - RATING_MIN) / (RATING_MAX - RATING_MIN) < TARGET_NORMALIZED_RATING) & (lengths < cap)
+    ratings[forced, lengths[forced]] = _TARGET_STOP_RATING
+    lengths = lengths + forced
+
+    # Unsuccessful sessions: small moves that slow down just below the target
+    ceiling = _TARGET_STOP_RATING - 0.1
+    wandering = current.copy()
+    for column in range(1, cap):
+        headroom = ceiling - wandering
+        high = np.where(headroom < 0.3, np.minimum(0.05, headroom * 0.3),
+                        np.minimum(MAX_RATING_CHANGE_PER_ITERATION, headroom * 0.2))
+        change = np.clip(rng.uniform(-0.05, high), -MAX_RATING_CHANGE_PER_ITERATION, MAX_RATING_CHANGE_PER_ITERATION)
+        wandering = np.round(np.clip(wandering + change, RATING_MIN, ceiling), 1)
+        ratings[~success, column] = wandering[~success]
+
+    return ratings, lengths, success
+
+
+def _session_ids(rng: np.random.Generator, count: int) -> np.ndarray:
+    """Version-4 UUID strings drawn from `rng`, so seeded runs are reproducible."""
+    raw = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    text = raw.tobytes().hex()
+    return np.array([
+        f"{text[i:i + 8]}-{text[i + 8:i + 12]}-{text[i + 12:i + 16]}-{text[i + 16:i + 20]}-{text[i + 20:i + 32]}"
+        for i in range(0, 32 * count, 32)
+    ], dtype=object)
+
+
+def generate_batch(rng: np.random.Generator, sessions: int,
+                   personas: Sequence[Dict] = FIXED_PERSONAS) -> Dict[str, np.ndarray]:
+    """Generate the rows of `sessions` sessions as one column batch.
+
+    Returns:
+        A dict from column name to an array with one entry per row
+    """
+    ratings, lengths, _ = sample_progressions(rng, sessions)
+    rows = int(lengths.sum())
+    session_of_row = np.repeat(np.arange(sessions), lengths)
+    starts = np.cumsum(lengths) - lengths
+    iteration = np.arange(rows) - starts[session_of_row] + 1
+    current = ratings[~np.isnan(ratings)]
+
+    persona_index = rng.integers(len(personas), size=sessions)[session_of_row]
+    persona_ids = np.array([p["persona_id"] for p in personas])
+    persona_names = np.array([p["persona_name"] for p in personas], dtype=object)
+
+    # Recommendations on the final row of a session, and occasionally on others
+    is_last = iteration == lengths[session_of_row]
+    has_recommendation = is_last | (rng.random(rows) < 0.1)
+    variation = rng.uniform(-0.2, 0.2, size=rows)
+    recommended = np.round(np.clip(current + variation, RATING_MIN, MAX_FINAL_RATING), 1)
+    recommended[~has_recommendation] = np.nan
+    reason = np.full(rows, "", dtype=object)
+    reason[has_recommendation] = sample_reasonings(rng, int(has_recommendation.sum()))
+
+    editor_changes = np.full(rows, "", dtype=object)
+    edited = iteration > 1
+    editor_changes[edited] = sample_changes(rng, int(edited.sum()))
+
+    return {
+        'session_id': _session_ids(rng, sessions)[session_of_row],
+        'iteration': iteration,
+        'persona_id': persona_ids[persona_index],
+        'persona_name': persona_names[persona_index],
+        'current_rating': current,
+        'normalized_current_rating': np.round((current - RATING_MIN) / (RATING_MAX - RATING_MIN), 2),
+        'reaction': np.where(current >= 2.5, "Positive", "Negative").astype(object),
+        'article': sample_articles(rng, rows),
+        'recommened_rating': recommended,
+        'normalized_recommened_rating': np.round((recommended - RATING_MIN) / (RATING_MAX - RATING_MIN), 2),
+        'reason': reason,
+        'is_fact': rng.random(rows) < 0.7,
+        'is_real': rng.random(rows) < 0.6,
+        'editor_changes': editor_changes
+    }
+
+
+def iter_batches(num_sessions: int, rng: Optional[np.random.Generator] = None,
+                 batch_sessions: int = DEFAULT_BATCH_SESSIONS,
+                 personas: Sequence[Dict] = FIXED_PERSONAS) -> Iterator[Dict[str, np.ndarray]]:
+    """Yield column batches covering `num_sessions` sessions in total."""
+    rng = rng if rng is not None else np.random.default_rng()
+    for start in range(0, num_sessions, batch_sessions):
+        yield generate_batch(rng, min(batch_sessions, num_sessions - start), personas)
+
+
+def _csv_column(values: np.ndarray) -> List:
+    """Column values as the CSV writer should print them; missing ratings become empty cells."""
+    if values.dtype.kind == 'f':
+        return [("" if v != v else v) for v in values.tolist()]
+    return values.tolist()
+
+
+def write_csv(batches: Iterator[Dict[str, np.ndarray]], path: str) -> int:
+    """Write column batches to a CSV file in the persona_responses layout.
+
+    Returns:
+        The number of rows written
+    """
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for batch in batches:
+            writer.writerows(zip(*(_csv_column(batch[column]) for column in COLUMNS)))
+            rows += len(batch['session_id'])
+    return rows
+
+
+def write_parquet(batches: Iterator[Dict[str, np.ndarray]], path: str) -> int:
+    """Write column batches to a Parquet file, one row group per batch; missing ratings become nulls.
+
+    A file without batches still gets the schema, so every shard of a dataset exists.
+
+    Returns:
+        The number of rows written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet partitions; install it with 'pip install pyarrow'") from e
+
+    schema = pa.schema([(column, PARQUET_TYPES[column]) for column in COLUMNS])
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            table = pa.table({column: pa.array(batch[column], type=schema.field(column).type, from_pandas=True)
+                              for column in COLUMNS})
+            writer.write_table(table)
+            rows += table.num_rows
+    return rows
+
+
+def load_personas(path: str) -> List[Dict]:
+    """Read personas from a JSON list of {persona_id, persona_name} objects or from data/personas.json."""
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    personas = []
+    for i, entry in enumerate(entries):
+        persona = entry.get("persona", entry)
+        personas.append({"persona_id": persona.get("persona_id", i + 1), "persona_name": persona["persona_name"]})
+    return personas
+
+
+def shard_sizes(num_sessions: int, num_shards: int) -> List[int]:
+    """Split sessions over shards as evenly as possible, larger shards first."""
+    base, extra = divmod(num_sessions, num_shards)
+    return [base + (shard < extra) for shard in range(num_shards)]
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_shard(output_dir: str, shard: int, sessions: int, seed_sequence: np.random.SeedSequence,
+                 file_format: str, batch_sessions: int, personas: Sequence[Dict]) -> Dict:
+    """Generate one shard into its own partition file; runs in a worker process."""
+    path = os.path.join(output_dir, f"part-{shard:05d}.{file_format}")
+    batches = iter_batches(sessions, np.random.default_rng(seed_sequence), batch_sessions, personas)
+    rows = write_parquet(batches, path) if file_format == "parquet" else write_csv(batches, path)
+    return {"shard": shard, "file": os.path.basename(path), "sessions": sessions, "rows": rows,
+            "sha256": _file_sha256(path)}
+
+
+def generate_shards(output_dir: str, num_sessions: int, num_shards: int, seed: Optional[int] = None,
+                    workers: Optional[int] = None, file_format: str = "csv",
+                    batch_sessions: int = DEFAULT_BATCH_SESSIONS,
+                    personas: Sequence[Dict] = FIXED_PERSONAS) -> Dict:
+    """Generate synthetic sessions as partition files in parallel, plus a manifest.
+
+    Every shard draws from its own stream spawned from one master seed, so a
+    shard's content depends only on the seed, the shard count and its
+    position, never on how many workers ran or in which order they finished.
+    The same arguments therefore produce byte-identical files for any
+    `workers`.
+
+    Args:
+        output_dir: Directory receiving part-NNNNN files and _manifest.json
+        num_sessions: Total number of sessions across all shards
+        num_shards: Number of partition files
+        seed: Master seed; a fresh one is drawn and recorded in the manifest if None
+        workers: Worker processes; defaults to the number of CPUs, 1 runs in-process
+        file_format: "csv" or "parquet"
+        batch_sessions: Sessions sampled per column batch within a shard
+        personas: {persona_id, persona_name} dictionaries sessions are assigned to
+
+    Returns:
+        The manifest
+    """
+    if file_format not in SHARD_FORMATS:
+        raise ValueError(f"Unknown format {file_format!r}, expected one of {SHARD_FORMATS}")
+    if num_shards < 1:
+        raise ValueError("num_shards must be at least 1")
+    os.makedirs(output_dir, exist_ok=True)
+
+    master = np.random.SeedSequence(seed)
+    sizes = shard_sizes(num_sessions, num_shards)
+    jobs = [(output_dir, shard, size, stream, file_format, batch_sessions, list(personas))
+            for shard, (size, stream) in enumerate(zip(sizes, master.spawn(num_shards)))]
+    workers = min(workers or os.cpu_count() or 1, num_shards)
+    if workers == 1:
+        shards = [_write_shard(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = list(pool.map(_write_shard, *zip(*jobs)))
+
+    manifest = {
+        "seed": master.entropy,
+        "num_sessions": num_sessions,
+        "num_shards": num_shards,
+        "format": file_format,
+        "batch_sessions": batch_sessions,
+        "columns": COLUMNS,
+        "personas": list(personas),
+        "rows": sum(shard["rows"] for shard in shards),
+        "shards": shards
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def generate_synthetic_data(num_sessions: int, output_file: Optional[str] = None, seed: Optional[int] = None,
+                            batch_sessions: int = DEFAULT_BATCH_SESSIONS) -> str:
+    """Generate `num_sessions` synthetic sessions into one CSV file.
+
+    Args:
+        num_sessions: Number of sessions to generate
+        output_file: CSV path; defaults to a timestamped file name
+        seed: Seed for reproducible output
+        batch_sessions: Sessions sampled per column batch
+
+    Returns:
+        The path of the written file
+    """
+    if output_file is None:
+        output_file = f"synthetic_persona_responses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    rows = write_csv(iter_batches(num_sessions, np.random.default_rng(seed), batch_sessions), output_file)
+    print(f"Generated {rows} entries for {num_sessions} sessions of synthetic data in {output_file}")
+    return output_file
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic persona_responses data as partitioned files")
+    parser.add_argument("--sessions", type=int, required=True, help="Total number of sessions to generate")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS,
+                        help="Number of partition files; output depends on this, never on --workers")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--seed", type=int, default=None, help="Master seed; recorded in the manifest either way")
+    parser.add_argument("--format", dest="file_format", choices=SHARD_FORMATS, default="csv")
+    parser.add_argument("--out", default=None, help="Output directory (default: a timestamped directory)")
+    parser.add_argument("--personas", default=None, metavar="PATH",
+                        help="JSON file of personas to assign sessions to (default: the 7 fixed personas)")
+    parser.add_argument("--batch-sessions", type=int, default=DEFAULT_BATCH_SESSIONS)
+    args = parser.parse_args(argv)
+
+    output_dir = args.out or f"synthetic_persona_responses_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    personas = load_personas(args.personas) if args.personas else FIXED_PERSONAS
+    started = time.perf_counter()
+    manifest = generate_shards(output_dir, args.sessions, args.shards, args.seed, args.workers,
+                               args.file_format, args.batch_sessions, personas)
+    elapsed = time.perf_counter() - started
+    print(f"Generated {manifest['rows']} rows for {args.sessions} sessions in {args.shards} {args.file_format} "
+          f"partitions under {output_dir} in {elapsed:.1f}s ({manifest['rows'] / elapsed:,.0f} rows/s)")
+    print(f"Seed {manifest['seed']}; manifest written to {os.path.join(output_dir, MANIFEST_NAME)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import json
+import threading
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = "persona_sim"
+
+
+@dataclass
+class CallRecord:
+    """Metrics for one chat-completion call."""
+    session_id: str
+    persona_id: str
+    persona_name: str
+    iteration: int
+    kind: str  # "user", "editor" or "recommendation"
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens the provider served from its prompt cache
+    cached_tokens: int = 0
+    latency_seconds: float = 0.0
+    ttfb_seconds: Optional[float] = None
+    retries: int = 0
+    cache_hit: bool = False
+    parse_failed: Optional[bool] = None
+    # Structured-output follow-ups asking for the fields an earlier response lacked
+    reask: bool = False
+    # Streamed calls only: seconds until the reaction and rating had arrived
+    header_seconds: Optional[float] = None
+    # Beam search calls only: index of the candidate within its round
+    candidate: Optional[int] = None
+    # Speculative editor calls only: "hit", "target_reached" or "stopped"
+    speculation: Optional[str] = None
+    # Wall-clock seconds a speculation hit took off the iteration
+    seconds_saved: float = 0.0
+    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+
+
+def _new_totals() -> Dict:
+    return {
+        "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "latency_seconds": 0.0,
+        "retries": 0, "cache_hits": 0, "parsed_calls": 0, "parse_failures": 0, "parse_failure_rate": 0.0,
+        "reasks": 0, "reask_failures": 0, "overlapped_seconds": 0.0,
+        "speculative_calls": 0, "speculation_hits": 0, "speculation_seconds_saved": 0.0
+    }
+
+
+def _add(totals: Dict, record: CallRecord) -> None:
+    totals["calls"] += 1
+    totals["prompt_tokens"] += record.prompt_tokens
+    totals["completion_tokens"] += record.completion_tokens
+    totals["cached_tokens"] += record.cached_tokens
+    totals["latency_seconds"] += record.latency_seconds
+    totals["retries"] += record.retries
+    totals["cache_hits"] += int(record.cache_hit)
+    if record.reask:
+        totals["reasks"] += 1
+        totals["reask_failures"] += int(bool(record.parse_failed))
+    elif record.parse_failed is not None:
+        totals["parsed_calls"] += 1
+        totals["parse_failures"] += int(record.parse_failed)
+        totals["parse_failure_rate"] = totals["parse_failures"] / totals["parsed_calls"]
+    if record.header_seconds is not None:
+        # Time the simulation moved on while the rest of the response streamed in
+        totals["overlapped_seconds"] += max(0.0, record.latency_seconds - record.header_seconds)
+    if record.speculation is not None:
+        totals["speculative_calls"] += 1
+        totals["speculation_hits"] += int(record.speculation == "hit")
+        totals["speculation_seconds_saved"] += record.seconds_saved
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Telemetry:
+    """Collects per-call LLM metrics and aggregates them per session and per persona.
+
+    One instance is shared by every session of a run; it is thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self.records: List[CallRecord] = []
+        self._listeners: List[Callable[[CallRecord], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[CallRecord], None]) -> None:
+        """Call `listener` with every record from now on, such as a budget that charges usage."""
+        self._listeners.append(listener)
+
+    def record(self, record: CallRecord) -> CallRecord:
+        """Store a call record and return it so parse results can be filled in later."""
+        with self._lock:
+            self.records.append(record)
+        for listener in self._listeners:
+            listener(record)
+        return record
+
+    def _group(self, key) -> Dict[str, Dict]:
+        groups: Dict[str, Dict] = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            totals = groups.setdefault(key(record), _new_totals())
+            _add(totals, record)
+        return groups
+
+    def totals(self) -> Dict:
+        """Metrics summed over every call."""
+        totals = _new_totals()
+        with self._lock:
+            for record in self.records:
+                _add(totals, record)
+        return totals
+
+    def by_session(self) -> Dict[str, Dict]:
+        """Metrics per session, including the persona and the number of iterations seen."""
+        sessions = self._group(lambda r: r.session_id)
+        with self._lock:
+            for record in self.records:
+                session = sessions[record.session_id]
+                session["persona_id"] = record.persona_id
+                session["persona_name"] = record.persona_name
+                session["iterations"] = max(session.get("iterations", 0), record.iteration)
+        return sessions
+
+    def by_persona(self) -> Dict[str, Dict]:
+        """Metrics per persona across all of its sessions."""
+        return self._group(lambda r: f"{r.persona_id}:{r.persona_name}")
+
+    def by_model(self) -> Dict[str, Dict]:
+        """Metrics per model."""
+        return self._group(lambda r: r.model)
+
+    def report(self, include_calls: bool = False) -> Dict:
+        """Build the JSON run report."""
+        report = {
+            "generated_at": datetime.now().isoformat(),
+            "totals": self.totals(),
+            "by_model": self.by_model(),
+            "by_persona": self.by_persona(),
+            "by_session": self.by_session()
+        }
+        if include_calls:
+            with self._lock:
+                report["calls"] = [asdict(record) for record in self.records]
+        return report
+
+    def write_report(self, path: str, include_calls: bool = True) -> None:
+        """Write the JSON run report to a file."""
+        with open(path, 'w') as f:
+            json.dump(self.report(include_calls), f, indent=2)
+
+    def prometheus_text(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        groups: Dict[tuple, Dict] = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            labels = (record.model, record.kind, str(record.persona_id), record.persona_name)
+            _add(groups.setdefault(labels, _new_totals()), record)
+
+        metrics = [
+            ("llm_calls_total", "counter", "Chat-completion calls", "calls"),
+            ("prompt_tokens_total", "counter", "Prompt tokens reported in usage", "prompt_tokens"),
+            ("completion_tokens_total", "counter", "Completion tokens reported in usage", "completion_tokens"),
+            ("cached_prompt_tokens_total", "counter", "Prompt tokens served from the provider's prompt cache", "cached_tokens"),
+            ("llm_latency_seconds_total", "counter", "Wall-clock seconds spent in chat-completion calls", "latency_seconds"),
+            ("llm_retries_total", "counter", "Retries taken by the API client", "retries"),
+            ("llm_cache_hits_total", "counter", "Calls served from the completion cache", "cache_hits"),
+            ("parse_failures_total", "counter", "Responses that did not parse, before any re-ask", "parse_failures"),
+            ("reasks_total", "counter", "Follow-up calls asking for the fields a structured response lacked", "reasks"),
+            ("speculative_calls_total", "counter", "Speculative editor calls, kept or discarded", "speculative_calls"),
+            ("speculation_hits_total", "counter", "Speculative editor calls whose rewrite was kept", "speculation_hits"),
+            ("speculation_seconds_saved_total", "counter", "Wall-clock seconds saved by kept speculative calls", "speculation_seconds_saved"),
+            ("llm_overlapped_seconds_total", "counter", "Seconds of streamed responses received after the simulation moved on", "overlapped_seconds"),
+        ]
+        lines = []
+        for name, metric_type, help_text, key in metrics:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            for (model, kind, persona_id, persona_name), totals in sorted(groups.items()):
+                label_text = (f'model="{_escape_label(model)}",kind="{_escape_label(kind)}",'
+                              f'persona_id="{_escape_label(persona_id)}",persona="{_escape_label(persona_name)}"')
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {totals[key]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0"):
+        """Expose /metrics for Prometheus scraping from a background thread.
+
+        Returns:
+            The running ThreadingHTTPServer; call shutdown() to stop it
+        """
+        # Imported here so runs without --metrics-port do not pay for http.server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return server
@@ -0,0 +1,45 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The agent modules import each other as top-level modules, as they do when run from this directory
+sys.path.insert(0, AGENT_DIR)
+
+
+@pytest.fixture
+def personas():
+    """The bundled personas."""
+    from simulation import load_personas
+    return load_personas(os.path.join(AGENT_DIR, "data", "personas.json"))
+
+
+class FakeClock:
+    """Monotonic time that only moves when the rate limiter sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._sleep = asyncio.sleep
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await self._sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake clock driving every RateLimiter created during the test."""
+    import rate_limiter
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(rate_limiter, "asyncio", SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep))
+    return clock
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+from analytics import ConvergenceAnalytics
+from local_store import LocalResponseStore
+from synthetic_engine import generate_shards
+
+
+def snapshot(analytics):
+    """Every persona and session metric, rounded so summation order does not matter."""
+    def rounded(rows):
+        return [{key: round(value, 9) if isinstance(value, float) else value for key, value in row.items()}
+                for row in rows]
+    return rounded(analytics.persona_metrics()), rounded(analytics.session_metrics())
+
+
+@pytest.fixture
+def shards(tmp_path):
+    directory = str(tmp_path / "shards")
+    manifest = generate_shards(directory, 120, 4, seed=11, workers=1)
+    return [os.path.join(directory, shard["file"]) for shard in manifest["shards"]]
+
+
+def test_refreshing_again_ingests_nothing(tmp_path, shards):
+    analytics = ConvergenceAnalytics(str(tmp_path / "analytics.duckdb"))
+    first = analytics.refresh([os.path.dirname(shards[0])])
+    before = snapshot(analytics)
+    assert sum(first.values()) > 0
+
+    assert sum(analytics.refresh([os.path.dirname(shards[0])]).values()) == 0
+    assert snapshot(analytics) == before
+
+
+def test_files_ingested_one_by_one_match_a_single_refresh(tmp_path, shards):
+    together = ConvergenceAnalytics(str(tmp_path / "together.duckdb"))
+    together.refresh(shards)
+
+    incremental = ConvergenceAnalytics(str(tmp_path / "incremental.duckdb"))
+    for path in reversed(shards):
+        incremental.ingest_file(path)
+        incremental.ingest_file(shards[0])
+    assert snapshot(incremental) == snapshot(together)
+
+
+def test_store_ingested_in_small_batches_matches_one_batch(tmp_path, shards):
+    import csv
+
+    store_path = str(tmp_path / "responses.db")
+    store = LocalResponseStore(store_path)
+    with open(shards[0], newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows[:len(rows) // 2]:
+        store.submit(row)
+    store.flush()
+
+    # Sessions straddle the batches and the two refreshes
+    batched = ConvergenceAnalytics(str(tmp_path / "batched.duckdb"))
+    assert batched.ingest_store(store_path, batch_rows=7) == len(rows) // 2
+    for row in rows[len(rows) // 2:]:
+        store.submit(row)
+    store.close()
+    assert batched.ingest_store(store_path, batch_rows=7) == len(rows) - len(rows) // 2
+    assert batched.ingest_store(store_path, batch_rows=7) == 0
+
+    whole = ConvergenceAnalytics(str(tmp_path / "whole.duckdb"))
+    whole.ingest_store(store_path)
+    assert snapshot(batched) == snapshot(whole)
+
+
+@pytest.mark.parametrize("format_error_rate", [0.0, 0.5])
+def test_simulated_parse_failures_count_for_store_rows(tmp_path, personas, format_error_rate):
+    from llm_backends import OfflinePersonaBackend
+    from simulation import Simulation
+    from telemetry import Telemetry
+
+    store_path = str(tmp_path / "responses.db")
+    store = LocalResponseStore(store_path)
+    telemetry = Telemetry()
+    # Without re-asks a response missing a field keeps its fallback value
+    simulation = Simulation(personas[1], max_iterations=5, use_db=False, local_store=store, structured=True,
+                            max_reasks=0, telemetry=telemetry,
+                            backend=OfflinePersonaBackend(format_error_rate=format_error_rate))
+    simulation.run()
+    store.close()
+    failed_calls = sum(bool(record.parse_failed) for record in telemetry.records)
+    flagged = store.query("SELECT count(*) AS n FROM persona_responses WHERE parse_error")[0]["n"]
+    assert (failed_calls > 0) == (format_error_rate > 0)
+    assert 0 < flagged <= failed_calls if failed_calls else flagged == 0
+
+    analytics = ConvergenceAnalytics(str(tmp_path / "analytics.duckdb"))
+    analytics.ingest_store(store_path)
+    assert analytics.session_metrics()[0]["parse_error_fraction"] == flagged / len(store.query(
+        "SELECT id FROM persona_responses"))
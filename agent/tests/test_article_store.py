@@ -0,0 +1,62 @@
+import pytest
+
+from article_store import ArticleStore, article_hash
+
+SEED = "Vaccines are tested in large trials before they are approved. " * 20
+
+
+def versions(count):
+    """An editor's chain of rewrites, each adding a sentence to the last."""
+    text = SEED
+    for i in range(count):
+        text += f" Rewrite {i} adds a passage about concern number {i}."
+        yield text
+
+
+def put_chain(store, texts):
+    parent = store.put(SEED)
+    refs = []
+    for text in texts:
+        parent = store.put(text, parent)
+        refs.append(parent)
+    return refs
+
+
+def test_delta_chain_round_trips_from_a_fresh_store(tmp_path):
+    path = str(tmp_path / "articles.db")
+    texts = list(versions(40))
+    store = ArticleStore(path, max_chain=8)
+    refs = put_chain(store, texts)
+    store.close()
+
+    # No cached text: every version is rebuilt from its stored delta chain
+    reopened = ArticleStore(path, max_chain=8, cache_entries=1)
+    assert [reopened.get(ref) for ref in reversed(refs)] == list(reversed(texts))
+    assert reopened.get(article_hash(SEED)) == SEED
+
+
+def test_chain_length_is_bounded(tmp_path):
+    store = ArticleStore(str(tmp_path / "articles.db"), max_chain=4)
+    refs = put_chain(store, versions(20))
+    depths = [store._conn.execute("SELECT depth FROM articles WHERE hash = ?", (ref,)).fetchone()[0]
+              for ref in refs]
+    assert max(depths) == 4
+    assert depths[:10] == [1, 2, 3, 4, 0, 1, 2, 3, 4, 0]
+    stats = store.stats()
+    assert stats["deltas"] == sum(depth > 0 for depth in depths)
+    assert stats["stored_bytes"] < stats["bytes"]
+
+
+def test_identical_text_is_stored_once(tmp_path):
+    store = ArticleStore(str(tmp_path / "articles.db"))
+    first = store.put(SEED)
+    assert store.put(SEED, first) == first
+    stats = store.stats()
+    assert (stats["versions"], stats["puts"], stats["dedup_hits"]) == (1, 2, 1)
+    assert first in store
+
+
+def test_unknown_hash_raises_key_error(tmp_path):
+    store = ArticleStore(str(tmp_path / "articles.db"))
+    with pytest.raises(KeyError):
+        store.get(article_hash("never stored"))
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from async_runner import run_personas_async
+from llm_backends import OfflinePersonaBackend
+from result_sinks import CsvSink
+from simulation import Simulation
+from telemetry import Telemetry
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """How many sessions run at once, and the limiter each one was given."""
+    sessions = {"running": 0, "peak": 0, "limiters": []}
+    run_async = Simulation.run_async
+
+    async def counted(self, limiter=None):
+        sessions["running"] += 1
+        sessions["peak"] = max(sessions["peak"], sessions["running"])
+        sessions["limiters"].append(limiter)
+        try:
+            return await run_async(self, limiter)
+        finally:
+            sessions["running"] -= 1
+    monkeypatch.setattr(Simulation, "run_async", counted)
+    return sessions
+
+
+def run_cohort(tmp_path, personas, **kwargs):
+    sink = CsvSink(str(tmp_path / "results.csv"))
+    try:
+        return asyncio.run(run_personas_async(personas, use_db=False, sink=sink, max_iterations=2,
+                                              backend=OfflinePersonaBackend(), **kwargs))
+    finally:
+        sink.close()
+
+
+@pytest.mark.parametrize("concurrency", [1, 2, 4])
+def test_concurrency_bounds_the_sessions_in_flight(tmp_path, personas, sessions, concurrency):
+    cohort = [personas[i % len(personas)] for i in range(4)]
+    results = run_cohort(tmp_path, cohort, concurrency=concurrency)
+    assert sessions["peak"] == concurrency
+    assert [result["persona_id"] for result in results] == [p["persona"]["persona_id"] for p in cohort]
+
+
+def test_concurrency_below_one_is_rejected(tmp_path, personas):
+    with pytest.raises(ValueError):
+        run_cohort(tmp_path, personas[:1], concurrency=0)
+
+
+def test_every_call_draws_from_one_shared_limiter(tmp_path, personas, sessions, clock):
+    telemetry = Telemetry()
+    run_cohort(tmp_path, [personas[1], personas[1]], concurrency=2, requests_per_minute=6, telemetry=telemetry)
+    limiter, other = sessions["limiters"]
+    assert limiter is other
+    # The bucket starts with six requests; every further call waits ten seconds for a refill
+    calls = len(telemetry.records)
+    assert calls > 6
+    assert clock.now == pytest.approx((calls - 6) * 10)
@@ -0,0 +1,94 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+from batch_runner import LocalBatchExecutor, LockstepBatchBackend, run_personas_batch
+from llm_backends import OfflinePersonaBackend
+from result_sinks import CsvSink
+from simulation import Simulation
+from telemetry import Telemetry
+
+
+class RecordingExecutor(LocalBatchExecutor):
+    """Runs batch files offline, noting the calls in each round and dropping chosen result lines."""
+
+    def __init__(self, drop=lambda round_file, line: False):
+        super().__init__(OfflinePersonaBackend())
+        self.drop = drop
+        self.rounds = {}
+
+    def run(self, requests_path, results_path, contexts=None):
+        round_file = os.path.basename(requests_path).split("-")[1]
+        self.rounds.setdefault(int(round_file), []).extend(
+            (context["role"], context["iteration"]) for context in (contexts or {}).values())
+        super().run(requests_path, results_path, contexts)
+        with open(results_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(results_path, "w", encoding="utf-8") as f:
+            f.writelines(line for line in lines if not self.drop(int(round_file), json.loads(line)))
+
+
+def run_cohort(directory, personas, executor, **kwargs):
+    os.makedirs(directory, exist_ok=True)
+    sink = CsvSink(os.path.join(directory, "results.csv"))
+    try:
+        return asyncio.run(run_personas_batch(personas, executor, use_db=False,
+                                              batch_dir=os.path.join(directory, "batches"), max_iterations=2,
+                                              sink=sink, **kwargs))
+    finally:
+        sink.close()
+
+
+def test_sessions_move_in_lockstep_rounds(tmp_path, personas):
+    executor = RecordingExecutor()
+    # Persona 0 reaches the target on its first reaction, persona 1 never does
+    results = run_cohort(tmp_path, [personas[0], personas[1]], executor)
+    assert [result["stop_reason"] for result in results] == ["target", "max_iterations"]
+    assert {number: sorted(calls) for number, calls in executor.rounds.items()} == {
+        1: [("user", 1), ("user", 1)],
+        2: [("editor", 1), ("recommendation", 1)],
+        3: [("user", 2)],
+        4: [("editor", 2)],
+        5: [("recommendation", 2)],
+    }
+
+
+def test_dropped_result_lines_go_out_again_next_round(tmp_path, personas):
+    expected = run_cohort(tmp_path / "clean", [personas[1]], RecordingExecutor())
+
+    telemetry = Telemetry()
+    # The first reaction's result line is missing from its output file
+    executor = RecordingExecutor(drop=lambda round_file, line: round_file == 1)
+    results = run_cohort(tmp_path / "dropped", [personas[1]], executor, telemetry=telemetry)
+    assert executor.rounds[1] == executor.rounds[2] == [("user", 1)]
+    assert [record.retries for record in telemetry.records][:2] == [1, 0]
+    assert [result["final_rating"] for result in results] == [result["final_rating"] for result in expected]
+
+
+def test_request_fails_after_max_attempts(tmp_path):
+    executor = RecordingExecutor(drop=lambda round_file, line: True)
+    backend = LockstepBatchBackend(executor, str(tmp_path), sessions=1, max_attempts=2)
+
+    async def call():
+        return await backend.acomplete("gpt-4o-mini", [{"role": "user", "content": "Hi"}],
+                                       {"role": "user", "iteration": 1})
+    with pytest.raises(RuntimeError, match="after 2 attempts"):
+        asyncio.run(call())
+    assert sorted(executor.rounds) == [1, 2]
+    assert backend.stats() == {"rounds": 2, "files": 2, "requests": 2, "failed_requests": 2}
+
+
+def test_sync_runs_are_rejected_before_any_call(tmp_path, personas):
+    executor = RecordingExecutor()
+    backend = LockstepBatchBackend(executor, str(tmp_path / "batches"), sessions=1)
+    sink = CsvSink(str(tmp_path / "results.csv"))
+    simulation = Simulation(personas[1], use_db=False, backend=backend, sink=sink)
+    with pytest.raises(RuntimeError, match="only answers calls made from run_async"):
+        simulation.run()
+    sink.close()
+    assert executor.rounds == {} and simulation.telemetry.records == []
+
+    with pytest.raises(ValueError):
+        Simulation(personas[1], use_db=False, backend=backend, sink=sink, stream=True)
@@ -0,0 +1,149 @@
+import time
+import asyncio
+
+import pytest
+
+from budget import BudgetGovernor, call_cost, expected_step, MIN_STEP, PRIOR_STEP
+from llm_backends import CompletionStream, OfflinePersonaBackend
+from result_sinks import CsvSink
+from simulation import Simulation
+from telemetry import CallRecord, Telemetry
+
+
+def record(session_id, prompt_tokens, completion_tokens=0, model="gpt-4o-mini"):
+    return CallRecord(session_id, "1", "Persona", 1, "user", model,
+                      prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def test_call_cost_discounts_cached_prompt_tokens():
+    assert call_cost("gpt-4o", 1_000_000, 0) == pytest.approx(2.50)
+    assert call_cost("gpt-4o", 1_000_000, 0, cached_tokens=1_000_000) == pytest.approx(1.25)
+    assert call_cost("unknown-model", 1000, 1000) == 0.0
+
+
+def test_expected_step():
+    assert expected_step([]) == PRIOR_STEP
+    assert expected_step([2.0, 2.0, 2.0]) == MIN_STEP
+    assert expected_step([1.0, 4.0]) == pytest.approx(1.0)
+
+
+def test_sessions_that_cannot_reserve_their_recommendation_are_skipped():
+    governor = BudgetGovernor(max_tokens=1000)
+    assert governor.open_session("a", 400, 0.0)
+    assert governor.open_session("b", 400, 0.0)
+    assert not governor.open_session("c", 400, 0.0)
+    governor.close_session("a")
+    assert governor.open_session("c", 400, 0.0)
+    assert governor.stats()["sessions_skipped"] == 1
+
+
+def test_admit_now_reserves_the_largest_iteration_seen():
+    governor = BudgetGovernor(max_tokens=1000)
+    governor.open_session("a", 100, 0.0)
+    assert governor.admit_now("a", 300, 0.0)
+    governor.charge(record("a", 400, 50))
+    governor.settle("a")
+    # 450 spent + 100 reserved + 1.25 * 450 for the next iteration exceeds the cap
+    assert not governor.admit_now("a", 300, 0.0)
+    stats = governor.stats()
+    assert (stats["spent_tokens"], stats["iterations_admitted"], stats["iterations_denied"]) == (450, 1, 1)
+
+
+def test_cost_ceiling():
+    governor = BudgetGovernor(max_cost=0.01)
+    governor.open_session("a", 0, 0.001)
+    assert governor.admit_now("a", 0, 0.005)
+    governor.settle("a")
+    assert not governor.admit_now("a", 0, 0.01)
+
+
+def test_out_of_time_admits_nothing():
+    governor = BudgetGovernor(max_seconds=0)
+    assert not governor.open_session("a", 0, 0.0)
+
+
+def test_slots_bound_iterations_in_flight():
+    async def scenario():
+        governor = BudgetGovernor(max_tokens=10_000, slots=1)
+        for key in ("a", "b"):
+            governor.open_session(key, 10, 0.0)
+        assert await governor.admit("a", [2.0], 0.8, 100, 0.0)
+        waiting = asyncio.create_task(governor.admit("b", [2.0], 0.8, 100, 0.0))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        governor.settle("a")
+        assert await asyncio.wait_for(waiting, 1)
+    asyncio.run(scenario())
+
+
+def test_free_slot_goes_to_the_highest_expected_gain_per_token():
+    async def scenario():
+        governor = BudgetGovernor(max_tokens=10_000, slots=1)
+        for key in ("running", "stalled", "improving"):
+            governor.open_session(key, 10, 0.0)
+        assert await governor.admit("running", [2.0], 0.8, 100, 0.0)
+        order = []
+
+        async def wait(key, ratings):
+            await governor.admit(key, ratings, 0.8, 100, 0.0)
+            order.append(key)
+            governor.settle(key)
+        tasks = [asyncio.create_task(wait("stalled", [2.0, 2.0, 2.0])),
+                 asyncio.create_task(wait("improving", [1.0, 1.5, 2.0]))]
+        await asyncio.sleep(0.01)
+        governor.settle("running")
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert order == ["improving", "stalled"]
+    asyncio.run(scenario())
+
+
+def test_waiting_session_is_told_to_finish_once_the_budget_cannot_cover_it():
+    async def scenario():
+        governor = BudgetGovernor(max_tokens=1000, slots=1)
+        governor.open_session("a", 100, 0.0)
+        governor.open_session("b", 100, 0.0)
+        assert await governor.admit("a", [2.0], 0.8, 500, 0.0)
+        waiting = asyncio.create_task(governor.admit("b", [2.0], 0.8, 500, 0.0))
+        await asyncio.sleep(0.01)
+        # Still waiting: a's iteration may settle below its reservation
+        assert not waiting.done()
+        governor.charge(record("a", 700))
+        governor.settle("a")
+        assert not await asyncio.wait_for(waiting, 1)
+    asyncio.run(scenario())
+
+
+class SlowReasoningBackend(OfflinePersonaBackend):
+    """Streams whose reasoning keeps arriving after the rating has been read."""
+
+    def stream(self, *args, **kwargs):
+        stream = super().stream(*args, **kwargs)
+
+        def chunks():
+            for chunk in stream:
+                yield chunk
+                time.sleep(0.01)
+            return stream.completion
+        return CompletionStream(chunks())
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_streamed_call_is_charged_before_its_iteration_settles(tmp_path, personas, mode):
+    settled = []
+
+    class Governor(BudgetGovernor):
+        def settle(self, key):
+            settled.append(self.spent_tokens)
+            super().settle(key)
+
+    governor = Governor(max_tokens=10 ** 6)
+    telemetry = Telemetry()
+    telemetry.add_listener(governor.charge)
+    sink = CsvSink(str(tmp_path / "results.csv"))
+    # Reaches the target on its first reaction, which ends the session
+    simulation = Simulation(personas[0], use_db=False, backend=SlowReasoningBackend(), stream=True,
+                            governor=governor, telemetry=telemetry, sink=sink)
+    simulation.run() if mode == "sync" else asyncio.run(simulation.run_async())
+    sink.close()
+    assert simulation.stop_reason == "target"
+    assert settled == [telemetry.records[0].prompt_tokens + telemetry.records[0].completion_tokens]
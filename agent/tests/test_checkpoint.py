@@ -0,0 +1,125 @@
+import time
+import asyncio
+
+import pytest
+
+from checkpoint import CheckpointJournal
+from llm_backends import CompletionStream, create_backend
+from local_store import LocalResponseStore
+from simulation import Simulation
+
+# Columns that must match a run that never crashed; session ids differ between runs
+COMPARED = ("iteration", "kind", "reaction", "current_rating", "recommened_rating", "reason", "article")
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingBackend:
+    """The offline backend, dying on the call after `limit`."""
+
+    def __init__(self, limit=None):
+        self.inner = create_backend("offline")
+        self.limit = limit
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def _tick(self):
+        self.calls += 1
+        if self.limit is not None and self.calls > self.limit:
+            raise Crash()
+
+    def complete(self, *args, **kwargs):
+        self._tick()
+        return self.inner.complete(*args, **kwargs)
+
+    async def acomplete(self, *args, **kwargs):
+        self._tick()
+        return await self.inner.acomplete(*args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        self._tick()
+        stream = self.inner.stream(*args, **kwargs)
+
+        def chunks():
+            # The reasoning still streams after the simulation has moved on
+            for chunk in stream:
+                yield chunk
+                time.sleep(0.002)
+            return stream.completion
+        return CompletionStream(chunks())
+
+
+class LostQueue:
+    """A local store whose queued rows all die with the process."""
+
+    def __init__(self):
+        self.rows = []
+
+    def submit(self, row):
+        self.rows.append(row)
+
+
+def run(persona, mode, backend, store, checkpoint=None, resume=False):
+    simulation = Simulation(persona, max_iterations=5, use_db=False, seed=3, backend=backend,
+                            local_store=store, checkpoint=checkpoint, resume=resume, stream=mode == "stream")
+    if mode == "async":
+        return asyncio.run(simulation.run_async())
+    return simulation.run()
+
+
+def stored_rows(store):
+    rows = store.query("SELECT * FROM persona_responses ORDER BY kind DESC, iteration")
+    return [tuple(row[column] for column in COMPARED) for row in rows], {row["session_id"] for row in rows}
+
+
+@pytest.fixture
+def persona(personas):
+    # Never reaches the target with the offline backend, so the session runs every iteration
+    return personas[1]
+
+
+@pytest.fixture
+def reference(tmp_path, persona):
+    def reference(mode):
+        store = LocalResponseStore(str(tmp_path / f"reference-{mode}.db"))
+        backend = CrashingBackend()
+        result = run(persona, mode, backend, store)
+        store.close()
+        return result, stored_rows(store)[0], backend.calls
+    return reference
+
+
+@pytest.mark.parametrize("mode", ["sync", "async", "stream"])
+@pytest.mark.parametrize("queued_rows_lost", [False, True])
+def test_resumed_session_matches_an_uninterrupted_one(tmp_path, persona, reference, mode, queued_rows_lost):
+    expected, expected_rows, calls = reference(mode)
+    for limit in range(calls):
+        checkpoint = CheckpointJournal(str(tmp_path / f"{mode}-{queued_rows_lost}-{limit}.ckpt"))
+        store = LocalResponseStore(str(tmp_path / f"{mode}-{queued_rows_lost}-{limit}.db"))
+        with pytest.raises(Crash):
+            run(persona, mode, CrashingBackend(limit), LostQueue() if queued_rows_lost else store, checkpoint)
+        # Rows of the crashed process either never reached the database or all did
+        store.flush()
+
+        backend = CrashingBackend()
+        assert run(persona, mode, backend, store, checkpoint, resume=True) == expected
+        assert backend.calls == calls - limit
+        store.close()
+        rows, sessions = stored_rows(store)
+        assert rows == expected_rows, limit
+        assert len(sessions) == 1
+
+
+def test_completed_session_is_not_run_again(tmp_path, persona):
+    checkpoint = CheckpointJournal(str(tmp_path / "journal.ckpt"))
+    store = LocalResponseStore(str(tmp_path / "responses.db"))
+    result = run(persona, "sync", CrashingBackend(), store, checkpoint)
+    backend = CrashingBackend()
+    assert run(persona, "sync", backend, store, checkpoint, resume=True) == result
+    assert backend.calls == 0
+    store.close()
+    assert len(stored_rows(store)[0]) == len(result[0]) + 1
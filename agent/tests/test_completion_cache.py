@@ -0,0 +1,81 @@
+import pytest
+
+import completion_cache
+from completion_cache import CacheMissError, CompletionCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(completion_cache.time, "time", clock)
+    return clock
+
+
+def messages(text):
+    return [{"role": "user", "content": text}]
+
+
+def put(cache, clock, text, response):
+    clock.now += 1
+    cache.put("model", messages(text), None, response)
+
+
+def test_hit_and_miss_counts(tmp_path, clock):
+    cache = CompletionCache(str(tmp_path / "cache.db"))
+    assert cache.get("model", messages("a")) is None
+    put(cache, clock, "a", "response")
+    assert cache.get("model", messages("a")) == "response"
+    assert cache.get("model", messages("a"), {"seed": 1}) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+
+def test_overwrite_counts_only_the_size_difference(tmp_path, clock):
+    cache = CompletionCache(str(tmp_path / "cache.db"))
+    put(cache, clock, "a", "x" * 100)
+    put(cache, clock, "a", "x" * 40)
+    put(cache, clock, "b", "x" * 10)
+    assert cache.stats()["bytes"] == 50 == cache._total_size()
+
+
+def test_evicts_least_recently_used_entries(tmp_path, clock):
+    cache = CompletionCache(str(tmp_path / "cache.db"), max_bytes=250)
+    for text in ("a", "b", "c"):
+        put(cache, clock, text, text * 100)
+    # Only the first entry fit next to the second; the third evicted it
+    assert cache.get("model", messages("a")) is None
+    clock.now += 1
+    assert cache.get("model", messages("b")) == "b" * 100
+    put(cache, clock, "d", "d" * 100)
+    # "c" was used longer ago than "b", so it goes first
+    assert cache.get("model", messages("c")) is None
+    assert cache.get("model", messages("b")) == "b" * 100
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["bytes"] == 200
+
+
+def test_expired_entries_are_misses(tmp_path, clock):
+    cache = CompletionCache(str(tmp_path / "cache.db"), ttl_seconds=10)
+    put(cache, clock, "a", "x" * 30)
+    put(cache, clock, "b", "x" * 20)
+    clock.now += 9.5
+    assert cache.get("model", messages("a")) is None
+    assert cache.get("model", messages("b")) == "x" * 20
+    assert cache.stats()["bytes"] == 20
+    clock.now += 1
+    assert cache.purge_expired() == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_cache_only_mode_raises_on_miss(tmp_path, clock):
+    cache = CompletionCache(str(tmp_path / "cache.db"), cache_only=True)
+    with pytest.raises(CacheMissError):
+        cache.get("model", messages("a"))
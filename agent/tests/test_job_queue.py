@@ -0,0 +1,134 @@
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+
+def persona(persona_id):
+    return {"persona": {"persona_id": persona_id, "persona_name": f"Persona {persona_id}"}}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=0.05, max_attempts=3)
+
+
+def test_enqueue_is_idempotent(queue):
+    assert queue.enqueue(persona(1), seed=7) is not None
+    assert queue.enqueue(persona(1), seed=7) is None
+    assert queue.enqueue(persona(1), seed=8) is not None
+    assert queue.stats() == {"queued": 2}
+
+
+def test_expired_lease_is_taken_over_and_fences_the_old_holder(queue):
+    queue.enqueue(persona(1))
+    first = queue.lease("worker-a")
+    assert first.attempt == 1
+    assert queue.lease("worker-b") is None
+
+    time.sleep(0.1)
+    second = queue.lease("worker-b")
+    assert second.job_id == first.job_id
+    assert second.attempt == 2
+
+    # The stale holder can no longer touch the job
+    assert not queue.heartbeat(first)
+    assert not queue.complete(first, {"rating": 1})
+    assert not queue.fail(first, "boom")
+
+    assert queue.heartbeat(second)
+    assert queue.complete(second, {"rating": 4})
+    assert queue.stats() == {"done": 1}
+
+
+def test_heartbeat_renews_a_lease_nobody_took_over(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lease_seconds=0.5)
+    queue.enqueue(persona(1))
+    job = queue.lease("worker-a")
+    time.sleep(0.6)
+    assert queue.heartbeat(job)
+    assert queue.lease("worker-b") is None
+
+
+def test_job_fails_after_max_attempts(queue):
+    queue.enqueue(persona(1))
+    for attempt in range(1, 4):
+        job = queue.lease(f"worker-{attempt}")
+        assert job.attempt == attempt
+        time.sleep(0.1)
+    assert queue.requeue_expired() == 0
+    assert queue.lease("worker-4") is None
+    assert queue.stats() == {"failed": 1}
+
+
+def test_fail_requeues_while_attempts_remain(queue):
+    queue.enqueue(persona(1))
+    job = queue.lease("worker-a")
+    assert queue.fail(job, "transient")
+    assert queue.stats() == {"queued": 1}
+    job = queue.lease("worker-a")
+    assert job.attempt == 2
+
+
+def test_holds_only_the_current_unexpired_lease(queue):
+    queue.enqueue(persona(1))
+    first = queue.lease("worker-a")
+    assert queue.holds(first)
+    time.sleep(0.1)
+    # Expired: another worker may take the job at any moment
+    assert not queue.holds(first)
+    second = queue.lease("worker-b")
+    assert queue.holds(second) and not queue.holds(first)
+
+
+def test_stale_worker_stops_before_the_new_holder_logs_its_session(tmp_path, personas):
+    import threading
+
+    from llm_backends import OfflinePersonaBackend
+    from local_store import LocalResponseStore
+    from simulation import Simulation
+    from job_queue import run_worker
+
+    path = str(tmp_path / "jobs.db")
+    # Worker a's lease lapses during its first call; worker b leases with a long lease meanwhile
+    stale_queue = JobQueue(path, lease_seconds=0.05)
+    new_queue = JobQueue(path, lease_seconds=60)
+    stale_queue.enqueue(personas[1], seed=1)
+    store = LocalResponseStore(str(tmp_path / "responses.db"))
+    taken_over = threading.Event()
+    jobs = []
+
+    class StallingBackend(OfflinePersonaBackend):
+        calls = 0
+
+        def complete(self, *args, **kwargs):
+            StallingBackend.calls += 1
+            completion = super().complete(*args, **kwargs)
+            if not jobs:
+                time.sleep(0.1)
+                jobs.append(new_queue.lease("worker-b"))
+                taken_over.set()
+            return completion
+
+    stale = threading.Thread(target=run_worker, args=(stale_queue, "worker-a"),
+                             kwargs=dict(use_db=False, poll_interval=0.01, drain=True, max_iterations=5,
+                                         local_store=store, backend=StallingBackend()))
+    stale.start()
+    assert taken_over.wait(5)
+    job = jobs[0]
+    assert job.attempt == 2
+
+    simulation = Simulation(job.persona_data, max_iterations=5, use_db=False, seed=job.seed, local_store=store,
+                            backend=OfflinePersonaBackend(), fence=lambda: new_queue.holds(job))
+    history, _, _ = simulation.run()
+    assert new_queue.complete(job, {"iterations": len(history)})
+    stale.join(5)
+    assert not stale.is_alive()
+    store.close()
+
+    # The stale worker's one call came back after the takeover and logged nothing
+    assert StallingBackend.calls == 1
+    sessions = store.query("SELECT DISTINCT session_id FROM persona_responses")
+    assert sessions == [{"session_id": simulation.user_agent.session_id}]
+    assert new_queue.stats() == {"done": 1}
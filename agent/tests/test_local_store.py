@@ -0,0 +1,99 @@
+import json
+import sqlite3
+
+import pytest
+
+import local_store
+from local_store import LocalResponseStore
+
+
+def row(session_id="s1", iteration=1, **overrides):
+    return {"session_id": session_id, "iteration": iteration, "persona_id": 3, "persona_name": "Ana",
+            "current_rating": 2.5, "normalized_current_rating": 0.5, "reaction": "Positive", **overrides}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalResponseStore(str(tmp_path / "responses.db"), batch_size=3, flush_interval=60)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("overrides", [
+    {"iteration": 0}, {"iteration": 11}, {"reaction": "Neutral"}, {"kind": "summary"}, {"persona_name": None}
+])
+def test_check_constraints_reject_the_whole_batch(store, overrides):
+    with pytest.raises(sqlite3.IntegrityError):
+        store.insert_batch([row(iteration=2), row(**{"iteration": 3, **overrides})])
+    assert store.query("SELECT * FROM persona_responses") == []
+
+
+def test_rows_already_stored_are_skipped(store):
+    store.insert_batch([row(iteration=1), row(iteration=1, kind="final", recommened_rating=3.0)])
+    store.insert_batch([row(iteration=1, current_rating=4.0), row(iteration=2)])
+    rows = store.query("SELECT iteration, kind, current_rating FROM persona_responses ORDER BY id")
+    assert rows == [{"iteration": 1, "kind": "reaction", "current_rating": 2.5},
+                    {"iteration": 1, "kind": "final", "current_rating": 2.5},
+                    {"iteration": 2, "kind": "reaction", "current_rating": 2.5}]
+
+
+def test_csv_strings_are_converted(store):
+    store.insert_batch([row(is_fact="False", is_real="True", recommened_rating="", parse_error="1")])
+    stored = store.query("SELECT is_fact, is_real, recommened_rating, parse_error FROM persona_responses")
+    assert stored == [{"is_fact": 0, "is_real": 1, "recommened_rating": None, "parse_error": 1}]
+
+
+def test_submitted_rows_are_inserted_in_batches(store, monkeypatch):
+    batches = []
+    insert = store.insert_batch
+    monkeypatch.setattr(store._writer, "insert_batch", lambda rows: (batches.append(len(rows)), insert(rows)))
+    for iteration in range(1, 8):
+        store.submit(row(iteration=iteration))
+    assert store.flush(5)
+    assert batches == [3, 3, 1]
+    assert [r["iteration"] for r in store.session_rows("s1")] == list(range(1, 8))
+    assert store.stats["rows_written"] == 7
+
+
+def test_database_from_before_row_keys_is_migrated(tmp_path):
+    path = str(tmp_path / "old.db")
+    old_schema = local_store.SCHEMA.replace(
+        ",\n    kind TEXT NOT NULL DEFAULT 'reaction' CHECK (kind IN ('reaction', 'final')),\n"
+        "    parse_error INTEGER NOT NULL DEFAULT 0", "")
+    assert "kind" not in old_schema
+    conn = sqlite3.connect(path)
+    conn.executescript(old_schema)
+    columns = ["session_id", "iteration", "persona_id", "persona_name", "current_rating",
+               "normalized_current_rating", "reaction", "recommened_rating"]
+    conn.executemany(f"INSERT INTO persona_responses ({', '.join(columns)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+        ("s1", 1, 3, "Ana", 2.5, 0.5, "Positive", None),
+        # Logged twice by a resume before rows had a key
+        ("s1", 1, 3, "Ana", 2.5, 0.5, "Positive", None),
+        ("s1", 1, 3, "Ana", 2.5, 0.5, "Positive", 3.0),
+    ])
+    conn.commit()
+    conn.close()
+
+    store = LocalResponseStore(path)
+    store.insert_batch([row(iteration=1)])
+    store.close()
+    assert store.query("SELECT id, kind, parse_error FROM persona_responses ORDER BY id") == [
+        {"id": 1, "kind": "reaction", "parse_error": 0}, {"id": 3, "kind": "final", "parse_error": 0}
+    ]
+
+
+def test_cli_imports_csv_files_and_queries_them(tmp_path, capsys):
+    from synthetic_engine import generate_shards
+
+    manifest = generate_shards(str(tmp_path / "shards"), 20, 2, seed=5, workers=1)
+    files = [str(tmp_path / "shards" / shard["file"]) for shard in manifest["shards"]]
+    db = str(tmp_path / "responses.db")
+
+    local_store.main(["--db", db, "import", *files])
+    output = capsys.readouterr().out
+    for shard, path in zip(manifest["shards"], files):
+        assert f"Imported {shard['rows']} rows from {path}" in output
+
+    local_store.main(["--db", db, "query", "SELECT count(DISTINCT session_id) AS sessions, count(*) AS rows "
+                                           "FROM persona_responses"])
+    assert json.loads(capsys.readouterr().out) == {"sessions": 20, "rows": manifest["rows"]}
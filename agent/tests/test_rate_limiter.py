@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from rate_limiter import DEFAULT_COMPLETION_TOKENS, RateLimiter, estimate_tokens
+
+
+def acquire_all(limiter, sizes):
+    async def scenario():
+        return [await limiter.acquire(tokens) for tokens in sizes]
+    return asyncio.run(scenario())
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("x" * 400) == 100 + DEFAULT_COMPLETION_TOKENS
+    assert estimate_tokens("x" * 400, completion_tokens=0) == 100
+
+
+def test_requests_per_minute(clock):
+    limiter = RateLimiter(requests_per_minute=2)
+    acquire_all(limiter, [1, 1, 1, 1])
+    # The full bucket covers two requests; each further one waits for a refill
+    assert clock.now == pytest.approx(60)
+    assert clock.sleeps == [pytest.approx(30), pytest.approx(30)]
+
+
+def test_tokens_per_minute(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    assert acquire_all(limiter, [600, 600]) == [600, 600]
+    assert clock.now == pytest.approx(200 * 60 / 1000)
+
+
+def test_request_larger_than_the_bucket_reserves_the_whole_bucket(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    assert acquire_all(limiter, [5000, 1000]) == [1000, 1000]
+    assert clock.now == pytest.approx(60)
+
+
+def test_both_quotas_wait_for_the_slower_bucket(clock):
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    acquire_all(limiter, [600, 300])
+    assert clock.now == pytest.approx(30)
+
+
+def test_reconcile_returns_or_charges_the_difference(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    reserved, = acquire_all(limiter, [800])
+    limiter.reconcile(reserved, 200)
+    acquire_all(limiter, [800])
+    assert clock.now == 0
+
+    # The call used more than reserved: the overage delays the next one
+    limiter.reconcile(800, 1000)
+    acquire_all(limiter, [100])
+    assert clock.now == pytest.approx(300 * 60 / 1000)
+
+
+def test_reconcile_never_overfills_and_ignores_unknown_usage(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+    limiter.reconcile(500, None)
+    limiter.reconcile(500, 0)
+    assert limiter._token_allowance == 1000
+    RateLimiter(requests_per_minute=10).reconcile(500, 0)
+
+
+def test_waiting_callers_are_admitted_in_arrival_order(clock):
+    async def scenario():
+        limiter = RateLimiter(requests_per_minute=1)
+        order = []
+
+        async def call(name):
+            await limiter.acquire(1)
+            order.append((name, clock.now))
+        await asyncio.gather(*(call(name) for name in "abc"))
+        return order
+    assert asyncio.run(scenario()) == [("a", 0), ("b", pytest.approx(60)), ("c", pytest.approx(120))]
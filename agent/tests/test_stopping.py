@@ -0,0 +1,65 @@
+import pytest
+
+from stopping import (ConfidencePolicy, OscillationPolicy, PlateauPolicy, SlopePolicy, describe_policies,
+                      first_stop, parse_policy)
+
+TARGET = 0.8
+
+
+def test_plateau_stops_on_flat_ratings():
+    policy = PlateauPolicy(window=3, tolerance=0.05)
+    assert policy.check([0.3, 0.5], TARGET, 5) is None
+    assert policy.check([0.3, 0.5, 0.52, 0.56], TARGET, 5) is None
+    assert policy.check([0.3, 0.5, 0.52, 0.53], TARGET, 5).startswith("plateau")
+
+
+def test_slope_stops_when_the_trend_flattens():
+    policy = SlopePolicy(window=4, min_slope=0.02)
+    assert policy.check([0.1, 0.2, 0.3], TARGET, 5) is None
+    assert policy.check([0.1, 0.2, 0.3, 0.4], TARGET, 5) is None
+    assert policy.check([0.1, 0.4, 0.41, 0.42, 0.42], TARGET, 5).startswith("slope")
+    # A falling trend is below any positive minimum
+    assert policy.check([0.5, 0.45, 0.4, 0.35], TARGET, 5) is not None
+
+
+def test_oscillation_needs_alternating_swings_of_minimum_size():
+    policy = OscillationPolicy(swings=3, min_swing=0.05)
+    assert policy.check([0.3, 0.5, 0.3, 0.5], TARGET, 5).startswith("oscillation")
+    # Same direction twice in a row
+    assert policy.check([0.3, 0.5, 0.6, 0.4], TARGET, 5) is None
+    # One swing too small to count
+    assert policy.check([0.3, 0.5, 0.48, 0.6], TARGET, 5) is None
+    assert policy.check([0.3, 0.5, 0.3], TARGET, 5) is None
+
+
+def test_confidence_stops_when_the_target_is_out_of_reach():
+    policy = ConfidencePolicy(z=1.64)
+    steady = [0.1, 0.2, 0.3]
+    assert policy.check(steady, TARGET, 6) is None
+    assert policy.check(steady, TARGET, 2).startswith("confidence")
+    assert policy.check([0.1, 0.2], TARGET, 1) is None
+
+
+@pytest.mark.parametrize("policy", [PlateauPolicy, SlopePolicy, OscillationPolicy])
+def test_windows_below_two_are_rejected(policy):
+    with pytest.raises(ValueError):
+        policy(1)
+
+
+def test_parse_policy_round_trips_its_description():
+    policy = parse_policy("plateau:window=4,tolerance=0.03")
+    assert (policy.window, policy.tolerance) == (4, 0.03)
+    assert parse_policy(policy.describe()).params() == policy.params()
+    assert describe_policies([policy, parse_policy("slope")]) == "plateau:window=4,tolerance=0.03;slope:window=4,min_slope=0.02"
+
+
+@pytest.mark.parametrize("spec", ["unknown", "plateau:window", "plateau:size=3", "plateau:window=1"])
+def test_parse_policy_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_policy(spec)
+
+
+def test_first_stop_reports_the_first_policy_that_fires():
+    policies = [OscillationPolicy(), PlateauPolicy(window=2, tolerance=0.01)]
+    assert first_stop(policies, [0.4, 0.4], TARGET, 5).startswith("plateau")
+    assert first_stop(policies, [0.4, 0.5], TARGET, 5) is None
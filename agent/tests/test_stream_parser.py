@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from stream_parser import ReactionStreamParser
+
+RESPONSE = "REACTION: Positive\nRATING: 3/4\nREASONING: The article cites sources I trust."
+
+
+def feed_in_chunks(parser, text, size):
+    decided_at = None
+    for start in range(0, len(text), size):
+        if parser.feed(text[start:start + size]) and decided_at is None:
+            decided_at = start + size
+    return decided_at
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(RESPONSE)])
+def test_header_is_decided_once_the_rating_line_ends(size):
+    parser = ReactionStreamParser()
+    decided_at = feed_in_chunks(parser, RESPONSE, size)
+    assert (parser.reaction, parser.rating) == ("Positive", 3.0)
+    assert decided_at <= RESPONSE.index("REASONING:") + size
+    assert parser.reasoning() == "The article cites sources I trust."
+    assert parser.text == RESPONSE
+
+
+def test_rating_is_not_settled_mid_line():
+    parser = ReactionStreamParser()
+    assert not parser.feed("REACTION: Negative\nRATING: 2")
+    assert parser.rating is None
+    # "2" could still become "2.5"
+    assert parser.feed(".5\n")
+    assert parser.rating == 2.5
+
+
+def test_rating_followed_directly_by_reasoning():
+    parser = ReactionStreamParser()
+    assert parser.feed("REACTION: Neutral RATING: 4 REASONING: fine")
+    assert (parser.reaction, parser.rating) == ("Neutral", 4.0)
+
+
+def test_out_of_range_rating_is_clamped():
+    parser = ReactionStreamParser()
+    parser.feed("REACTION: Positive\nRATING: 7\n")
+    assert parser.rating == 4
+
+
+def test_unreadable_rating_fails_the_header():
+    parser = ReactionStreamParser()
+    assert parser.feed("REACTION: Positive\nRATING: high\n")
+    assert parser.failed
+    assert parser.rating is None
+    assert parser.reasoning() is None
+
+
+@pytest.mark.parametrize("rating", ['"3"', "3"])
+def test_structured_header(rating):
+    text = '{"reaction": "Mixed", "rating": ' + rating + ', "reasoning": "because"}'
+    parser = ReactionStreamParser(structured=True)
+    decided_at = feed_in_chunks(parser, text, 4)
+    assert parser.reaction == "Mixed"
+    assert parser.rating == 3.0
+    assert decided_at < text.index('"reasoning"') + 4
+    assert json.loads(parser.text)["reasoning"] == "because"
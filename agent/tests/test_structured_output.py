@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from llm_backends import Completion, LLMBackend, OfflinePersonaBackend
+from result_sinks import CsvSink
+from simulation import EDITOR_MODEL, RECOMMENDATION_MODEL, USER_MODEL, Simulation
+from structured_output import parse_fields, reask_prompt, response_format, schema_fields, to_json
+from telemetry import Telemetry
+
+
+@pytest.mark.parametrize("text, fields, missing", [
+    ('{"reaction": "Positive", "rating": 3, "reasoning": "Clear."}',
+     {"reaction": "Positive", "rating": 3.0, "reasoning": "Clear."}, []),
+    # Code fence around the object, a "3/4" rating and a reaction with trailing words
+    ('```json\n{"reaction": "negative, mostly", "rating": "3/4", "reasoning": " Vague. "}\n```',
+     {"reaction": "Negative", "rating": 3.0, "reasoning": "Vague."}, []),
+    ('{"reaction": "Positive", "rating": 9}', {"reaction": "Positive", "rating": 4.0}, ["reasoning"]),
+    ('{"reaction": "Neutral", "rating": "high", "reasoning": ""}', {}, ["reaction", "rating", "reasoning"]),
+    ('{"reaction": "Positive", "rating": 3, "reasoning": "cut off', {}, ["reaction", "rating", "reasoning"]),
+    ("REACTION: Positive\nRATING: 3", {}, ["reaction", "rating", "reasoning"]),
+    ('["Positive", 3]', {}, ["reaction", "rating", "reasoning"]),
+])
+def test_parse_fields(text, fields, missing):
+    assert parse_fields("user", text) == (fields, missing)
+
+
+def test_reask_asks_only_for_the_missing_fields():
+    prompt = reask_prompt("recommendation", ["reasoning"])
+    assert '"reasoning"' in prompt and "recommendation likelihood" in prompt
+    assert '"recommendation_rating"' not in prompt
+    assert schema_fields(response_format("recommendation", ["reasoning"])) is None
+    assert schema_fields({"response_format": response_format("recommendation", ["reasoning"])}) == ["reasoning"]
+    assert schema_fields({}) is None
+
+
+def test_to_json_writes_fields_in_response_order():
+    assert list(json.loads(to_json("editor", {"article": "A", "changes_summary": "C"}))) == ["changes_summary", "article"]
+
+
+class ScriptedBackend(LLMBackend):
+    """Answers re-asks from a script and records what they asked for."""
+
+    name = "scripted"
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def complete(self, model, messages, context=None, **params):
+        self.requests.append((messages, params))
+        return Completion(text=self.answers.pop(0), prompt_tokens=10, completion_tokens=5)
+
+
+def complete_fields(tmp_path, personas, answers, max_reasks=1, response='{"reaction": "Positive", "rating": 3}'):
+    backend = ScriptedBackend(answers)
+    telemetry = Telemetry()
+    simulation = Simulation(personas[1], use_db=False, sink=CsvSink(str(tmp_path / "results.csv")), structured=True,
+                            max_reasks=max_reasks, backend=backend, telemetry=telemetry)
+    record = simulation._new_call_record("user", USER_MODEL)
+    messages = simulation.user_agent.get_messages(simulation.current_article)
+    merged = simulation._complete_fields("user", USER_MODEL, messages, simulation._request_params("user"),
+                                         response, record, simulation._call_context("user"))
+    return json.loads(merged), record, backend, telemetry
+
+
+def test_complete_fields_reasks_for_the_missing_field_only(tmp_path, personas):
+    merged, record, backend, telemetry = complete_fields(tmp_path, personas, ['{"reasoning": "Because."}'])
+    assert merged == {"reaction": "Positive", "rating": 3.0, "reasoning": "Because."}
+    # The response itself did not parse; its follow-up did
+    assert record.parse_failed is True
+    assert [(r.reask, r.parse_failed) for r in telemetry.records] == [(True, False)]
+
+    (messages, params), = backend.requests
+    assert messages[-2] == {"role": "assistant", "content": '{"reaction": "Positive", "rating": 3}'}
+    assert messages[-1]["content"] == reask_prompt("user", ["reasoning"])
+    assert schema_fields(params) == ["reasoning"]
+
+
+def test_complete_fields_gives_up_after_max_reasks(tmp_path, personas):
+    merged, record, backend, telemetry = complete_fields(tmp_path, personas, ['{"rating": 2}', "not json"], max_reasks=2)
+    assert merged == {"reaction": "Positive", "rating": 3.0}
+    assert len(backend.requests) == 2
+    assert [(r.reask, r.parse_failed) for r in telemetry.records] == [(True, True), (True, True)]
+
+
+def test_complete_fields_leaves_a_valid_response_alone(tmp_path, personas):
+    response = '{"reaction": "Negative", "rating": 2, "reasoning": "Unconvinced."}'
+    merged, record, backend, telemetry = complete_fields(tmp_path, personas, [], response=response)
+    assert merged == json.loads(response)
+    assert record.parse_failed is False
+    assert backend.requests == [] and telemetry.records == []
+
+
+@pytest.mark.parametrize("max_reasks", [0, 1])
+def test_parse_failures_are_counted_per_model_and_persona(tmp_path, personas, max_reasks):
+    telemetry = Telemetry()
+    # Every first response leaves out one field
+    sink = CsvSink(str(tmp_path / "results.csv"))
+    simulation = Simulation(personas[1], max_iterations=3, use_db=False, sink=sink, structured=True,
+                            max_reasks=max_reasks, backend=OfflinePersonaBackend(format_error_rate=1.0),
+                            telemetry=telemetry)
+    history, recommendation_rating, reasoning = simulation.run()
+    sink.close()
+
+    by_model = telemetry.by_model()
+    # Three user and editor calls each on one model, one recommendation on another
+    assert USER_MODEL == EDITOR_MODEL != RECOMMENDATION_MODEL
+    assert (by_model[USER_MODEL]["parsed_calls"], by_model[USER_MODEL]["parse_failures"]) == (6, 6)
+    assert (by_model[RECOMMENDATION_MODEL]["parsed_calls"], by_model[RECOMMENDATION_MODEL]["parse_failures"]) == (1, 1)
+    persona, = telemetry.by_persona().values()
+    assert (persona["parse_failures"], persona["parse_failure_rate"]) == (7, 1.0)
+    assert (persona["reasks"], persona["reask_failures"]) == (7 * max_reasks, 0)
+    # Re-asks fill in the fields; without them the agents fall back to their error defaults
+    fallbacks = sum("Error" in str(value) for entry in history for value in entry)
+    assert (fallbacks == 0) == (max_reasks == 1)
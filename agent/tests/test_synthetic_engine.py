@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from generate_synthetic_data import (MAX_ITERATIONS_PER_SESSION, MAX_RATING_CHANGE_PER_ITERATION, RATING_MAX,
+                                     RATING_MIN, TARGET_NORMALIZED_RATING)
+from synthetic_engine import generate_batch, generate_shards, sample_progressions, shard_sizes
+
+TARGET_RATING = TARGET_NORMALIZED_RATING * (RATING_MAX - RATING_MIN) + RATING_MIN
+# Ratings are rounded to one decimal, so differences carry float error
+EPSILON = 1e-9
+
+
+def shard_hashes(manifest):
+    return [(shard["file"], shard["rows"], shard["sha256"]) for shard in manifest["shards"]]
+
+
+def test_shard_sizes_split_evenly():
+    assert shard_sizes(10, 3) == [4, 3, 3]
+    assert sum(shard_sizes(1001, 7)) == 1001
+
+
+def test_same_seed_gives_identical_shards(tmp_path):
+    first = generate_shards(str(tmp_path / "a"), 300, 3, seed=42, workers=1, batch_sessions=64)
+    second = generate_shards(str(tmp_path / "b"), 300, 3, seed=42, workers=1, batch_sessions=64)
+    assert shard_hashes(first) == shard_hashes(second)
+    assert first["seed"] == 42
+    assert [shard["sessions"] for shard in first["shards"]] == [100, 100, 100]
+    assert first["rows"] == sum(shard["rows"] for shard in first["shards"])
+
+
+def test_worker_count_does_not_change_the_output(tmp_path):
+    in_process = generate_shards(str(tmp_path / "a"), 200, 4, seed=7, workers=1)
+    pooled = generate_shards(str(tmp_path / "b"), 200, 4, seed=7, workers=2)
+    assert shard_hashes(in_process) == shard_hashes(pooled)
+
+
+def test_different_seeds_differ(tmp_path):
+    first = generate_shards(str(tmp_path / "a"), 100, 2, seed=1, workers=1)
+    second = generate_shards(str(tmp_path / "b"), 100, 2, seed=2, workers=1)
+    assert [shard["sha256"] for shard in first["shards"]] != [shard["sha256"] for shard in second["shards"]]
+
+
+def test_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        generate_shards(str(tmp_path), 10, 1, seed=1, file_format="xlsx")
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_shards_without_sessions_are_written_empty(tmp_path, file_format):
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+    manifest = generate_shards(str(tmp_path), 3, 8, seed=1, workers=1, file_format=file_format)
+    assert [shard["sessions"] for shard in manifest["shards"]] == [1, 1, 1, 0, 0, 0, 0, 0]
+    assert [shard["rows"] for shard in manifest["shards"][3:]] == [0] * 5
+    assert len({shard["sha256"] for shard in manifest["shards"][3:]}) == 1
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        empty = pq.read_table(str(tmp_path / manifest["shards"][-1]["file"]))
+        assert (empty.num_rows, empty.schema) == (0, pq.read_table(str(tmp_path / manifest["shards"][0]["file"])).schema)
+        assert pq.read_table(str(tmp_path)).num_rows == manifest["rows"]
+
+
+def progressions(count=5000, seed=3, **kwargs):
+    return sample_progressions(np.random.default_rng(seed), count, **kwargs)
+
+
+def test_progressions_stop_at_the_iteration_cap():
+    ratings, lengths, _ = progressions()
+    assert ratings.shape[1] == MAX_ITERATIONS_PER_SESSION
+    assert lengths.min() >= 5 and lengths.max() <= MAX_ITERATIONS_PER_SESSION
+    filled = ~np.isnan(ratings)
+    assert (filled == (np.arange(MAX_ITERATIONS_PER_SESSION) < lengths[:, None])).all()
+
+
+def test_successful_sessions_climb_in_even_steps_of_at_most_a_tenth():
+    ratings, lengths, success = progressions()
+    for row, length in zip(ratings[success], lengths[success]):
+        row = row[:length]
+        # A session still short of the target after its climb jumps straight onto it
+        climb = row[:-1] if row[-1] == TARGET_RATING and row[-1] - row[-2] > MAX_RATING_CHANGE_PER_ITERATION else row
+        steps = np.diff(climb)
+        assert steps.max() <= MAX_RATING_CHANGE_PER_ITERATION + EPSILON
+        assert steps.max() - steps.min() <= EPSILON
+        assert len(steps) >= 4
+
+
+def test_unsuccessful_sessions_never_reach_the_target():
+    ratings, lengths, success = progressions()
+    failed = ratings[~success]
+    assert (lengths[~success] == MAX_ITERATIONS_PER_SESSION).all()
+    assert ((failed - RATING_MIN) / (RATING_MAX - RATING_MIN)).max() < TARGET_NORMALIZED_RATING
+    assert np.abs(np.diff(failed, axis=1)).max() <= MAX_RATING_CHANGE_PER_ITERATION + EPSILON
+    assert failed.min() >= RATING_MIN
+
+
+@pytest.mark.parametrize("count, success_share", [(1, 0.73), (7, 0.73), (1000, 0.73), (1000, 0.0), (10, 1.0)])
+def test_success_share_is_exact(count, success_share):
+    ratings, lengths, success = progressions(count, success_share=success_share)
+    assert success.sum() == int(round(count * success_share))
+    # Only successful sessions end early, and every one that does ends on the target
+    early = lengths < MAX_ITERATIONS_PER_SESSION
+    assert not (early & ~success).any()
+    assert (ratings[early, lengths[early] - 1] == TARGET_RATING).all()
+
+
+def test_batch_rows_follow_their_progressions():
+    batch = generate_batch(np.random.default_rng(5), 500)
+    sessions, first_rows, rows_per_session = np.unique(batch["session_id"].astype(str), return_index=True,
+                                                       return_counts=True)
+    assert len(sessions) == 500
+    assert rows_per_session.max() <= MAX_ITERATIONS_PER_SESSION
+    assert (batch["iteration"][first_rows] == 1).all()
+    assert batch["iteration"].max() <= MAX_ITERATIONS_PER_SESSION
+    reached = batch["normalized_current_rating"] >= TARGET_NORMALIZED_RATING
+    # Only a session's last row can be on the target
+    assert (batch["iteration"][reached] == rows_per_session[np.searchsorted(
+        sessions, batch["session_id"][reached].astype(str))]).all()
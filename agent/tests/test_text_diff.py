@@ -0,0 +1,49 @@
+import pytest
+
+from text_diff import diff_texts
+
+OLD = ("Vaccines are tested in large trials. Side effects are usually mild. "
+       "Talk to your doctor if you have questions.\n\nLocal clinics offer free shots.")
+
+
+def apply(old, diff):
+    text = old
+    for edit in reversed(diff.edits):
+        assert text[edit.old_start:edit.old_end] == edit.old_text
+        text = text[:edit.old_start] + edit.new_text + text[edit.old_end:]
+    return text
+
+
+def words(text):
+    return text.split()
+
+
+@pytest.mark.parametrize("new", [
+    OLD,
+    OLD + " Information from the CDC addresses concerns such as long-term safety.",
+    OLD.replace("usually mild", "mild and short-lived"),
+    OLD.replace("Side effects are usually mild. ", ""),
+    "Local clinics offer free shots. " + OLD.replace("\n\nLocal clinics offer free shots.", ""),
+    "",
+])
+def test_edits_turn_the_old_text_into_the_new_one(new):
+    diff = diff_texts(OLD, new)
+    assert words(apply(OLD, diff)) == words(new)
+    for edit in diff.edits:
+        assert new[edit.new_start:edit.new_end] == edit.new_text
+
+
+def test_identical_texts_have_no_edits():
+    diff = diff_texts(OLD, OLD)
+    assert diff.edits == []
+    assert diff.ratio == 1.0
+    assert diff.sentences_changed == 0
+
+
+def test_word_edit_stays_inside_its_sentence():
+    diff = diff_texts(OLD, OLD.replace("usually mild", "rarely serious"))
+    assert [(edit.op, edit.old_text.strip(), edit.new_text.strip()) for edit in diff.edits] == [
+        ("replace", "usually mild", "rarely serious")
+    ]
+    assert diff.sentences_changed == 1
+    assert diff.summary() == "Removed: Side effects are usually mild.\nAdded: Side effects are rarely serious."
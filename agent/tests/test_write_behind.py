@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+import pytest
+
+import write_behind
+from local_store import LocalResponseStore
+from write_behind import WriteBehindWriter, orphaned_replay_files, replay_spill_file
+
+
+class Database:
+    """An insert function that records batches and fails its first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise ConnectionError("database unreachable")
+            self.batches.append([row["n"] for row in rows])
+
+    @property
+    def rows(self):
+        return [n for batch in self.batches for n in batch]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def spill(path, numbers):
+    with open(path, 'a') as f:
+        for n in numbers:
+            f.write(json.dumps({"n": n}) + "\n")
+
+
+def spilled(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line)["n"] for line in f]
+
+
+@pytest.fixture
+def spill_path(tmp_path):
+    return str(tmp_path / "spill.jsonl")
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Record retry delays instead of sleeping them, without jitter."""
+    delays = []
+    monkeypatch.setattr(write_behind.time, "sleep", delays.append)
+    monkeypatch.setattr(write_behind.random, "uniform", lambda low, high: high)
+    return delays
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_full_batches_are_written_without_waiting_for_the_interval(spill_path):
+    database = Database()
+    writer = WriteBehindWriter(database, batch_size=3, flush_interval=60, spill_path=spill_path)
+    for n in range(7):
+        writer.submit({"n": n})
+    wait_for(lambda: len(database.batches) == 2)
+    assert database.batches == [[0, 1, 2], [3, 4, 5]]
+    assert writer.flush(5)
+    assert database.batches[-1] == [6]
+    writer.close()
+    assert writer.stats["rows_written"] == 7 and writer.stats["batches"] == 3
+
+
+def test_partial_batch_is_written_once_the_interval_passes(spill_path):
+    database = Database()
+    writer = WriteBehindWriter(database, batch_size=100, flush_interval=0.05, spill_path=spill_path)
+    writer.submit({"n": 0})
+    writer.submit({"n": 1})
+    wait_for(lambda: database.batches)
+    assert database.batches == [[0, 1]]
+    writer.close()
+
+
+def test_failed_batch_is_retried_with_capped_exponential_backoff(spill_path, no_backoff):
+    database = Database(failures=4)
+    writer = WriteBehindWriter(database, max_retries=5, base_backoff=0.5, max_backoff=1.0, spill_path=spill_path)
+    writer.submit({"n": 0})
+    writer.close(5)
+    assert database.batches == [[0]]
+    assert no_backoff == [0.5, 1.0, 1.0, 1.0]
+    assert writer.stats["retries"] == 4
+    assert not os.path.exists(spill_path)
+
+
+def test_batch_is_spilled_once_every_retry_failed(spill_path, no_backoff):
+    database = Database(failures=10 ** 6)
+    writer = WriteBehindWriter(database, batch_size=2, max_retries=2, spill_path=spill_path)
+    for n in range(3):
+        writer.submit({"n": n})
+    writer.close(5)
+    assert spilled(spill_path) == [0, 1, 2]
+    assert writer.stats["rows_spilled"] == 3 and writer.stats["rows_written"] == 0
+    assert database.calls == 6
+
+
+def test_spill_file_is_replayed_after_the_next_successful_write(spill_path):
+    spill(spill_path, [10, 11, 12])
+    database = Database()
+    writer = WriteBehindWriter(database, replay_interval=0, spill_path=spill_path)
+    writer.submit({"n": 0})
+    writer.close(5)
+    assert database.batches == [[0], [10, 11, 12]]
+    assert writer.stats["rows_replayed"] == 3
+    assert not os.path.exists(spill_path)
+
+
+def test_rows_spilled_during_a_replay_wait_for_the_next_one(spill_path):
+    spill(spill_path, range(5))
+    database = Database()
+
+    def insert(rows):
+        database(rows)
+        if len(database.batches) == 1:
+            # Another writer spills while the replay is running
+            spill(spill_path, [100])
+        if len(database.batches) == 2:
+            raise ConnectionError("database unreachable")
+
+    assert replay_spill_file(spill_path, insert, batch_size=2) == 2
+    # The concurrently spilled row, then the failed batch and the rest
+    assert spilled(spill_path) == [100, 2, 3, 4]
+    assert os.listdir(os.path.dirname(spill_path)) == ["spill.jsonl"]
+
+    assert replay_spill_file(spill_path, database, batch_size=2) == 4
+    assert database.rows == [0, 1, 2, 3, 100, 2, 3, 4]
+    assert not os.path.exists(spill_path)
+
+
+def test_replay_files_of_dead_processes_are_picked_up(spill_path, dead_pid):
+    spill(f"{spill_path}.replay-{dead_pid}-2", [3])
+    spill(f"{spill_path}.replay-{dead_pid}-1", [1, 2])
+    # Still being replayed by a live process
+    live = f"{spill_path}.replay-{os.getpid()}-3"
+    spill(live, [4])
+    spill(spill_path, [0])
+    assert orphaned_replay_files(spill_path) == [f"{spill_path}.replay-{dead_pid}-1",
+                                                 f"{spill_path}.replay-{dead_pid}-2"]
+
+    database = Database()
+    assert replay_spill_file(spill_path, database) == 4
+    assert database.batches == [[0], [1, 2], [3]]
+    assert sorted(os.listdir(os.path.dirname(spill_path))) == [os.path.basename(live)]
+
+
+def test_writer_recovers_replays_left_by_a_dead_process(spill_path, dead_pid):
+    spill(f"{spill_path}.replay-{dead_pid}-1", [1, 2])
+    database = Database()
+    writer = WriteBehindWriter(database, replay_interval=0, spill_path=spill_path)
+    writer.submit({"n": 0})
+    writer.close(5)
+    assert database.batches == [[0], [1, 2]]
+    assert orphaned_replay_files(spill_path) == []
+
+
+def test_rows_a_dead_replay_already_stored_are_not_duplicated(tmp_path, dead_pid):
+    store = LocalResponseStore(str(tmp_path / "responses.db"))
+    rows = [{"session_id": "s", "iteration": iteration, "persona_id": 1, "persona_name": "Ana",
+             "current_rating": 2.0, "normalized_current_rating": 1 / 3, "reaction": "Negative",
+             "kind": "reaction"} for iteration in (1, 2, 3)]
+    # The dead replay stored its first batch before it died
+    store.insert_batch(rows[:2])
+    orphan = f"{store.path}.spill.jsonl.replay-{dead_pid}-1"
+    with open(orphan, 'w') as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+
+    assert replay_spill_file(f"{store.path}.spill.jsonl", store.insert_batch, batch_size=2) == 3
+    store.close()
+    assert [row["iteration"] for row in store.query("SELECT iteration FROM persona_responses")] == [1, 2, 3]
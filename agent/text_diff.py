@@ -0,0 +1,141 @@
+import re
+from dataclasses import dataclass, asdict, field
+from difflib import SequenceMatcher
+from itertools import accumulate
+from typing import Dict, List, Tuple
+
+# A sentence runs to terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, to a blank line, or to the end of the text. Sentences and tokens
+# carry their trailing whitespace so consecutive spans tile the text
+_SENTENCE = re.compile(r"(\S.*?(?:[.!?]+[\"'”’)\]]*(?=\s)|(?=\n\s*\n)|(?=\s*\Z)))(\s*)", re.S)
+# Words and individual punctuation marks
+_WORD = re.compile(r"\w+|[^\w\s]")
+_TOKEN = re.compile(r"(\w+|[^\w\s])(\s*)")
+
+# Summary lines shown before the rest is elided
+SUMMARY_LINES = 5
+
+
+@dataclass(frozen=True)
+class Edit:
+    """One change between two texts, as character offsets into each of them.
+
+    An insert has an empty old span and a delete an empty new span. Applying the
+    edits of a diff to the old text, last one first, yields the new text up to
+    the kind and amount of whitespace between tokens.
+    """
+    op: str  # "insert", "delete" or "replace"
+    old_start: int
+    old_end: int
+    new_start: int
+    new_end: int
+    old_text: str
+    new_text: str
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class TextDiff:
+    """The result of diffing two article versions."""
+    # Token-level edits in text order
+    edits: List[Edit]
+    # 2 * matched tokens / total tokens of both texts, 1.0 for identical texts
+    ratio: float
+    # Sentence-level changes: (op, removed sentences, added sentences)
+    sentence_changes: List[Tuple[str, List[str], List[str]]] = field(default_factory=list)
+
+    @property
+    def sentences_changed(self) -> int:
+        return sum(max(len(old), len(new)) for _, old, new in self.sentence_changes)
+
+    def summary(self, max_lines: int = SUMMARY_LINES) -> str:
+        """Human-readable list of removed and added sentences."""
+        lines = []
+        for _, removed, added in self.sentence_changes:
+            lines.extend(f"Removed: {sentence}" for sentence in removed)
+            lines.extend(f"Added: {sentence}" for sentence in added)
+        return "\n".join(lines[:max_lines]) + ("\n..." if len(lines) > max_lines else "")
+
+    def stats(self) -> Dict:
+        """Compact per-iteration numbers for logs and reports."""
+        return {
+            "similarity": round(self.ratio, 4),
+            "edits": len(self.edits),
+            "sentences_changed": self.sentences_changed,
+            "chars_deleted": sum(e.old_end - e.old_start for e in self.edits),
+            "chars_inserted": sum(e.new_end - e.new_start for e in self.edits)
+        }
+
+
+def _split(pattern: re.Pattern, text: str, start: int, end: int) -> Tuple[List[str], List[int]]:
+    """Split text[start:end], which starts at a non-space character, into comparison keys.
+
+    A key is the unit's text with any trailing whitespace collapsed to one
+    space; keeping whether whitespace follows makes the edits reproduce the
+    new text. Units tile the range, so offsets are running sums of lengths.
+
+    Returns:
+        The keys and the start offset of every unit, followed by `end`
+    """
+    pairs = pattern.findall(text, start, end)
+    keys = [body + " " if space else body for body, space in pairs]
+    offsets = list(accumulate((len(body) + len(space) for body, space in pairs), initial=start))
+    return keys, offsets
+
+
+def _edit(tag: str, old: str, new: str, old_start: int, old_end: int, new_start: int, new_end: int) -> Edit:
+    return Edit(tag, old_start, old_end, new_start, new_end, old[old_start:old_end], new[new_start:new_end])
+
+
+def _refine(old: str, new: str, old_range: Tuple[int, int], new_range: Tuple[int, int],
+            edits: List[Edit]) -> Tuple[int, int]:
+    """Diff the tokens of a replaced block of sentences, appending token-level edits.
+
+    Returns:
+        The number of tokens the blocks have in common and their total token count
+    """
+    old_keys, old_offsets = _split(_TOKEN, old, *old_range)
+    new_keys, new_offsets = _split(_TOKEN, new, *new_range)
+    matched = 0
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_keys, new_keys).get_opcodes():
+        if tag == "equal":
+            matched += i2 - i1
+        else:
+            edits.append(_edit(tag, old, new, old_offsets[i1], old_offsets[i2], new_offsets[j1], new_offsets[j2]))
+    return matched, len(old_keys) + len(new_keys)
+
+
+def diff_texts(old: str, new: str) -> TextDiff:
+    """Diff two texts sentence by sentence, then token by token inside changed sentences.
+
+    Unchanged sentences are matched as whole units, so the token-level pass
+    only runs over the sentences the editor actually touched. Articles are
+    single paragraphs, which a line diff would treat as one changed line.
+    """
+    old_keys, old_offsets = _split(_SENTENCE, old, len(old) - len(old.lstrip()), len(old))
+    new_keys, new_offsets = _split(_SENTENCE, new, len(new) - len(new.lstrip()), len(new))
+
+    edits: List[Edit] = []
+    sentence_changes = []
+    # Tokens of unchanged sentences count once per text; changed ones are counted as they are diffed
+    unchanged = changed = matched = 0
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_keys, new_keys, autojunk=False).get_opcodes():
+        if tag == "equal":
+            unchanged += len(_WORD.findall(old, old_offsets[i1], old_offsets[i2]))
+            continue
+        sentence_changes.append((tag, [k.rstrip() for k in old_keys[i1:i2]], [k.rstrip() for k in new_keys[j1:j2]]))
+        old_range = (old_offsets[i1], old_offsets[i2])
+        new_range = (new_offsets[j1], new_offsets[j2])
+        if tag == "replace":
+            block_matched, block_tokens = _refine(old, new, old_range, new_range, edits)
+            matched += block_matched
+            changed += block_tokens
+        else:
+            edits.append(_edit(tag, old, new, *old_range, *new_range))
+            changed += len(_WORD.findall(old, *old_range)) + len(_WORD.findall(new, *new_range))
+
+    total = 2 * unchanged + changed
+    ratio = 2 * (unchanged + matched) / total if total else 1.0
+    return TextDiff(edits, ratio, sentence_changes)
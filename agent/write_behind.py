@@ -0,0 +1,314 @@
+import os
+import glob
+import json
+import time
+import queue
+import itertools
+import random
+import atexit
+import argparse
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Default file rows are spilled to when the database stays unreachable
+DEFAULT_SPILL_PATH = "supabase_spill.jsonl"
+
+_STOP = object()
+
+# Distinguishes replay files this process claims within the same millisecond
+_REPLAY_IDS = itertools.count()
+
+
+class _FlushRequest:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+
+
+def supabase_inserter(supabase_client, table: str,
+                      on_conflict: Optional[str] = None) -> Callable[[List[Dict]], None]:
+    """Build a bulk insert function for a Supabase table.
+
+    Args:
+        supabase_client: A connected Supabase client
+        table: Name of the table to insert into
+        on_conflict: Comma-separated columns of a unique key; rows whose key is
+            already stored are skipped, so a batch can safely be sent twice
+
+    Returns:
+        A function inserting a list of rows in one request
+    """
+    def insert(rows: List[Dict]) -> None:
+        if on_conflict:
+            request = supabase_client.table(table).upsert(rows, on_conflict=on_conflict, ignore_duplicates=True)
+        else:
+            request = supabase_client.table(table).insert(rows)
+        result = request.execute()
+        if hasattr(result, 'error') and result.error:
+            raise Exception(result.error)
+    return insert
+
+
+class WriteBehindWriter:
+    """Buffers rows in memory and writes them to the database from a background thread.
+
+    Rows are sent as bulk inserts once `batch_size` rows are buffered or
+    `flush_interval` seconds have passed. Failed batches are retried with
+    exponential backoff and appended to a local JSONL spill file if the
+    database stays unreachable; the spill file is replayed once writes succeed
+    again. Callers never wait on database I/O.
+
+    A replay that dies part-way re-sends its rows later, so `insert_batch`
+    should skip rows that are already stored (see `supabase_inserter`'s
+    on_conflict and LocalResponseStore.insert_batch).
+    """
+
+    def __init__(self, insert_batch: Callable[[List[Dict]], None], batch_size: int = 100,
+                 flush_interval: float = 1.0, max_retries: int = 5, base_backoff: float = 0.5,
+                 max_backoff: float = 30.0, spill_path: str = DEFAULT_SPILL_PATH,
+                 replay_interval: float = 60.0) -> None:
+        """Start the background writer thread.
+
+        Args:
+            insert_batch: Function that inserts a list of rows in one request
+            batch_size: Number of buffered rows that triggers a flush
+            flush_interval: Maximum seconds a row waits in the buffer
+            max_retries: Retries per batch before it is spilled to disk
+            base_backoff: Initial retry delay in seconds, doubled on every retry
+            max_backoff: Upper bound on a single retry delay
+            spill_path: JSONL file that receives batches that could not be written
+            replay_interval: Minimum seconds between automatic spill file replays
+        """
+        self.insert_batch = insert_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.spill_path = spill_path
+        self.replay_interval = replay_interval
+        self.stats = {"rows_written": 0, "batches": 0, "retries": 0, "rows_spilled": 0, "rows_replayed": 0}
+        self._queue: queue.Queue = queue.Queue()
+        self._last_replay = 0.0
+        # Replays left unfinished by a process that died are picked up by the first replay
+        self._recover = bool(orphaned_replay_files(spill_path))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="supabase-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, row: Dict) -> None:
+        """Queue a row for writing without blocking."""
+        if self._closed:
+            raise RuntimeError("WriteBehindWriter is closed")
+        self._queue.put(row)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every row submitted so far has been written or spilled.
+
+        Returns:
+            False if the timeout expired first
+        """
+        if self._closed:
+            return True
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write out the remaining rows and stop the background thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        batch: List[Dict] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(batch)
+                return
+            if isinstance(item, _FlushRequest):
+                self._write(batch)
+                batch = []
+                item.done.set()
+                continue
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+
+    def _write(self, rows: List[Dict]) -> None:
+        """Insert a batch, retrying with backoff and spilling to disk if every attempt fails."""
+        if not rows:
+            return
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.insert_batch(rows)
+                self.stats["rows_written"] += len(rows)
+                self.stats["batches"] += 1
+                self._maybe_replay()
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Supabase batch of {len(rows)} rows failed after {attempt + 1} attempts: {e}")
+                    break
+                self.stats["retries"] += 1
+                delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        self._spill(rows)
+
+    def _spill(self, rows: List[Dict]) -> None:
+        """Durably append rows to the spill file."""
+        with open(self.spill_path, 'a') as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["rows_spilled"] += len(rows)
+        print(f"Spilled {len(rows)} rows to {self.spill_path}")
+
+    def _maybe_replay(self) -> None:
+        if not (self._recover or os.path.exists(self.spill_path)):
+            return
+        if time.monotonic() - self._last_replay < self.replay_interval:
+            return
+        self._last_replay = time.monotonic()
+        self._recover = False
+        self.replay_spill()
+
+    def replay_spill(self) -> int:
+        """Re-send rows from the spill file, keeping any that still fail.
+
+        Returns:
+            The number of rows written to the database
+        """
+        return replay_spill_file(self.spill_path, self.insert_batch, self.batch_size, self.stats)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+def orphaned_replay_files(spill_path: str) -> List[str]:
+    """Replay files whose process died before it finished replaying them, oldest first."""
+    orphans = []
+    for path in glob.glob(glob.escape(spill_path) + ".replay-*"):
+        # Named <spill>.replay-<pid>-<milliseconds>[-<counter>]
+        try:
+            pid, started = (int(part) for part in path[len(spill_path) + len(".replay-"):].split("-")[:2])
+        except ValueError:
+            continue
+        if pid != os.getpid() and not _process_alive(pid):
+            orphans.append((started, path))
+    return [path for _, path in sorted(orphans)]
+
+
+def replay_spill_file(spill_path: str, insert_batch: Callable[[List[Dict]], None],
+                      batch_size: int = 100, stats: Optional[Dict] = None) -> int:
+    """Re-send spilled rows in batches, including those of replays that died part-way.
+
+    Each file is renamed before reading so rows spilled during the replay, by
+    this or another process, go to a fresh file and are never lost. A replay
+    that dies leaves its renamed file behind; once its process is gone, the
+    next replay claims it the same way. Rows of a dead replay may already be
+    stored, so `insert_batch` should skip duplicates.
+
+    Returns:
+        The number of rows written to the database
+    """
+    written = pending = 0
+    for source in [spill_path] + orphaned_replay_files(spill_path):
+        source_written, source_failed = _replay_file(source, spill_path, insert_batch, batch_size)
+        written += source_written
+        pending += source_failed
+        if source_failed:
+            # The database went away again; the remaining files wait for the next replay
+            break
+
+    if stats is not None:
+        stats["rows_replayed"] = stats.get("rows_replayed", 0) + written
+    if written or pending:
+        print(f"Replayed {written} rows from {spill_path}, {pending} still pending")
+    return written
+
+
+def _replay_file(source: str, spill_path: str, insert_batch: Callable[[List[Dict]], None],
+                 batch_size: int) -> Tuple[int, int]:
+    """Claim one spill or orphaned replay file and re-send its rows.
+
+    Returns:
+        A tuple containing (rows written, rows appended back to the spill file)
+    """
+    replay_path = f"{spill_path}.replay-{os.getpid()}-{int(time.time() * 1000)}-{next(_REPLAY_IDS)}"
+    try:
+        os.replace(source, replay_path)
+    except FileNotFoundError:
+        # Nothing spilled, or another process is already replaying this file
+        return 0, 0
+
+    with open(replay_path, 'r') as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+
+    written = 0
+    failed: List[Dict] = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if failed:
+            # The database went away again; keep the rest for the next replay
+            failed.extend(batch)
+            continue
+        try:
+            insert_batch(batch)
+            written += len(batch)
+        except Exception as e:
+            print(f"Replay of {spill_path} stopped: {e}")
+            failed.extend(batch)
+
+    if failed:
+        with open(spill_path, 'a') as f:
+            for row in failed:
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    os.remove(replay_path)
+    return written, len(failed)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay rows spilled while Supabase was unreachable")
+    parser.add_argument("--spill", default=DEFAULT_SPILL_PATH, help="Spill file to replay")
+    parser.add_argument("--table", default="persona_responses_duplicate", help="Table to insert into")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--on-conflict", default="session_id,iteration,kind",
+                        help="Unique key whose already stored rows are skipped; empty for plain inserts")
+    args = parser.parse_args(argv)
+
+    from config import get_supabase_credentials, create_supabase_client
+    url, key = get_supabase_credentials()
+    if not (url and key):
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set to replay spilled rows")
+
+    insert = supabase_inserter(create_supabase_client(url, key), args.table, args.on_conflict or None)
+    replay_spill_file(args.spill, insert, args.batch_size)
+
+if __name__ == "__main__":
+    main()